@@ -0,0 +1,47 @@
+'''Runtime of the sensor x sensor correlation matrix of Corr_Fct.sensor_cross_corr against the number of sensors,
+in memory and written block by block to a memory mapped .npy file. pandas DataFrame.corr on the same aligned matrix for comparison.
+
+24 h in 10 minute bins (144 bins), about 5 % missing bins. Run from the hal_pm directory:  python benchmarks/cross_corr.py'''
+
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from hal_pm import Corr_Fct
+
+SENSOR_COUNTS = [500, 1000, 2000, 5000]
+N_BINS = 144
+
+
+def aligned_matrix(n_sensors, seed = 0):
+    '''a (time bin x sensor) matrix with a shared diurnal signal, sensor noise and missing bins'''
+    rng = np.random.default_rng(seed)
+    diurnal = 10 * np.sin(np.linspace(0, 2 * np.pi, N_BINS))[:, None]
+    matrix = 20 + diurnal * rng.uniform(0.2, 1.5, n_sensors) + rng.normal(0, 5, (N_BINS, n_sensors))
+    matrix[rng.random(matrix.shape) < 0.05] = np.nan
+    return matrix
+
+
+def main():
+    out_path = os.path.join(tempfile.mkdtemp(), "corr.npy")
+    print("{:>8}{:>16}{:>16}{:>16}".format("sensors", "in memory (s)", "memmap (s)", "pandas (s)"))
+    for n_sensors in SENSOR_COUNTS:
+        matrix = aligned_matrix(n_sensors)
+        t = time.perf_counter()
+        Corr_Fct.cross_corr(matrix, min_periods = 3)
+        t_memory = time.perf_counter() - t
+        t = time.perf_counter()
+        Corr_Fct.cross_corr(matrix, min_periods = 3, out_path = out_path)
+        t_memmap = time.perf_counter() - t
+        if n_sensors <= 1000:                                                 # pandas loops over all pairs in Cython, larger matrices take minutes
+            t = time.perf_counter()
+            pd.DataFrame(matrix).corr(min_periods = 3)
+            t_pandas = "{:>16.2f}".format(time.perf_counter() - t)
+        else:
+            t_pandas = "{:>16}".format("-")
+        print("{:>8}{:>16.2f}{:>16.2f}".format(n_sensors, t_memory, t_memmap) + t_pandas)
+
+
+if __name__ == "__main__":
+    main()
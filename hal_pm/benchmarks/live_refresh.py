@@ -0,0 +1,58 @@
+'''Cost of a dashboard refresh: reloading and recomputing the whole trailing window against a Live.refresh that only fetches
+the measurements since the last refresh. Both run against a local Replay_Server.serve_frame that releases the rows over time.
+
+Run from the hal_pm directory:  python benchmarks/live_refresh.py'''
+
+import time
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+from hal_pm import Load_Data
+from hal_pm import Synthetic_Data
+from hal_pm import Filter_Data
+from hal_pm import Descriptive_Stats
+from hal_pm import Time_Cube
+from hal_pm import Replay_Server
+from hal_pm import Live
+
+
+WINDOW_HOURS = 6
+REFRESH = pd.Timedelta("5min")
+
+
+def full_refresh(base_url, now):
+    '''the former refresh: load the window, filter, maxima and aggregates from scratch'''
+    start = now - pd.Timedelta(hours = WINDOW_HOURS)
+    df = Load_Data.load_data(51.3, 53.8, 6.7, 11.6, start.to_pydatetime(), WINDOW_HOURS, base_url = base_url, cache = False)
+    df = Filter_Data.remove_outliers(Filter_Data.remove_missing(df), method = "Z-score")
+    Descriptive_Stats.get_max(df, get_map = False)
+    return Time_Cube.build_cube(df)
+
+
+def main():
+    df = Synthetic_Data.sensor_frame(n_sensors = 500, hours = 12)
+    server, base_url = Replay_Server.serve_frame(df)
+    now = pd.Timestamp("2021-06-01 08:00")
+    server.now = now
+
+    region = Live.new_region(51.3, 53.8, 6.7, 11.6, WINDOW_HOURS, base_url = base_url)
+    t = time.perf_counter()
+    Live.refresh(region, now)
+    print("first refresh (whole window): {:.2f} s, {} cells\n".format(time.perf_counter() - t, len(region["cube"]["cells"])))
+
+    print("{:<20}{:>14}{:>16}{:>14}".format("now", "new rows", "full (s)", "live (s)"))
+    for i in range(4):
+        now += REFRESH
+        server.now = now
+        t = time.perf_counter()
+        full_refresh(base_url, now)
+        t_full = time.perf_counter() - t
+        t = time.perf_counter()
+        changes = Live.refresh(region, now)
+        t_live = time.perf_counter() - t
+        print("{:<20}{:>14}{:>16.2f}{:>14.3f}".format(str(now), changes["fetched"], t_full, t_live))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+'''Size and save time of the map_data HTML output, default output against compact = True
+(geometry written once per polygon, batched sensor layer) with and without simplification.
+
+Uses a synthetic grid of postcode-like polygons. Run from the hal_pm directory:  python benchmarks/map_output.py'''
+
+import os
+import tempfile
+import time
+from hal_pm import Synthetic_Data
+from hal_pm import Map
+
+
+def main():
+    os.chdir(tempfile.mkdtemp())
+    Synthetic_Data.polygon_grid("plz.geojson")
+    df = Synthetic_Data.sensor_frame(n_sensors = 500, hours = 12)
+    print(str(len(df)) + " rows, " + str(df["sensor_id"].nunique()) + " sensors\n")
+
+    modes = [("default", {}), ("compact", {"compact": True}), ("compact, zoom 9", {"compact": True, "simplify_zoom": 9})]
+    print("{:<18}{:>12}{:>14}".format("mode", "size (MB)", "map_data (s)"))
+    for name, kwargs in modes:
+        t = time.perf_counter()
+        Map.map_data(df, "plz.geojson", measurement_type = "measurement_PM10", **kwargs)
+        elapsed = time.perf_counter() - t
+        print("{:<18}{:>12.2f}{:>14.2f}".format(name, os.path.getsize("index_PM10.html") / 1024**2, elapsed))
+
+
+if __name__ == "__main__":
+    main()
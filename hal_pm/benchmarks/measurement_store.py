@@ -0,0 +1,55 @@
+'''Runtime of queries against a Measurement_Store (partition pruning, column selection) against filtering the full data frame,
+and of a cube built lazily from the partitions.
+
+Run from the hal_pm directory:  python benchmarks/measurement_store.py'''
+
+import shutil
+import tempfile
+import time
+from hal_pm import Synthetic_Data
+from hal_pm import Measurement_Store
+from hal_pm import Time_Cube
+
+
+QUERIES = {"all": {},
+           "6 hours": {"start": "2021-06-02 06:00", "end": "2021-06-02 12:00"},
+           "1 tile, 1 day": {"lat_start": 52, "lat_end": 53, "long_start": 8, "long_end": 9, "start": "2021-06-02", "end": "2021-06-03"},
+           "PM10 only": {"columns": ["time", "sensor_id", "measurement_PM10"]}}
+
+
+def main():
+    df = Synthetic_Data.sensor_frame(n_sensors = 3000, hours = 72)
+    root = tempfile.mkdtemp()
+    try:
+        t = time.perf_counter()
+        store = Measurement_Store.open_store(root)
+        Measurement_Store.write(store, df)
+        print("{} rows written to {} partitions: {:.2f} s\n".format(len(df), len(store["index"]), time.perf_counter() - t))
+
+        print("{:<16}{:>10}{:>14}{:>14}{:>14}".format("query", "rows", "partitions", "store (s)", "read all (s)"))
+        for name, query in QUERIES.items():
+            t = time.perf_counter()
+            result = Measurement_Store.query(store, **query)
+            t_store = time.perf_counter() - t
+            t = time.perf_counter()
+            full = Measurement_Store.query(store)
+            keep = (full["time"] >= query.get("start", full["time"].min())) & (full["time"] < query.get("end", "2100-01-01")) & \
+                   (full["lat"] >= query.get("lat_start", -90)) & (full["lat"] <= query.get("lat_end", 90)) & \
+                   (full["lon"] >= query.get("long_start", -180)) & (full["lon"] <= query.get("long_end", 180))
+            full[keep][query.get("columns", full.columns)]
+            t_full = time.perf_counter() - t
+            pruned = len(Measurement_Store.partitions(store, **{k: v for k, v in query.items() if k != "columns"}))
+            print("{:<16}{:>10}{:>14}{:>14.3f}{:>14.3f}".format(name, len(result), pruned, t_store, t_full))
+
+        t = time.perf_counter()
+        Time_Cube.build_cube(Measurement_Store.query(store))
+        t_full = time.perf_counter() - t
+        t = time.perf_counter()
+        Time_Cube.build_cube_stream(Measurement_Store.scan(store))
+        print("\nbuild_cube (read all): {:.2f} s, build_cube_stream (scan): {:.2f} s".format(t_full, time.perf_counter() - t))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+'''Render time of dense multi-day figures: the former way (pyplot state machine, every point drawn, categorical
+"%H:%M" string axis) against Render (Agg figure without pyplot state, real datetime axis, min/max downsampling),
+and the report figures rendered one after another against in parallel processes.
+
+Run from the hal_pm directory:  python benchmarks/render_figures.py'''
+
+import os
+import tempfile
+import time
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from hal_pm import Synthetic_Data
+from hal_pm import Render
+from hal_pm import Plot_Mean
+from hal_pm import Time_Plots
+from hal_pm import Time_Cube
+
+
+DAYS = 3
+
+
+def main():
+    out_dir = tempfile.mkdtemp()
+    df = Synthetic_Data.sensor_frame(n_sensors = 200, sampling_seconds = 30, hours = 24 * DAYS)
+    one_sensor = df[df["sensor_id"] == df["sensor_id"].iloc[0]]
+    print(str(DAYS) + " days, " + str(len(one_sensor)) + " points per sensor, " + str(len(df)) + " rows\n")
+
+    # one dense series, 1 minute means over all days
+    mean_data = df.set_index("time")[["measurement_PM10"]].resample("1Min").mean()
+    t = time.perf_counter()
+    plt.rc('font', size=20)
+    fig, ax = plt.subplots(figsize = (20, 10))
+    ax.plot(mean_data.index.strftime("%H:%M"), mean_data["measurement_PM10"].values)
+    ax.xaxis.set_major_locator(plt.MaxNLocator(20))
+    fig.savefig(os.path.join(out_dir, "former.png"))
+    plt.close(fig)
+    plt.rcdefaults()
+    t_former = time.perf_counter() - t
+
+    t = time.perf_counter()
+    fig, ax = Render.new_figure(figsize = (20, 10))
+    Render.plot_series(ax, mean_data.index.values, mean_data["measurement_PM10"].values)
+    Render.date_axis(ax)
+    Render.set_font(ax, 20)
+    Render.save(fig, os.path.join(out_dir, "render.png"))
+    t_render = time.perf_counter() - t
+    print("{:<48}{:>8.2f} s".format("series of " + str(len(mean_data)) + " points, former", t_former))
+    print("{:<48}{:>8.2f} s\n".format("series of " + str(len(mean_data)) + " points, Render", t_render))
+
+    # the report figures
+    cube = Time_Cube.build_cube(df, base_interval = "1Min")
+    tasks = [{"function": Plot_Mean.plot_mean_pm, "args": (cube,), "kwargs": {"time_interval": "1Min"}, "figure": {"figsize": (20, 20)},
+              "path": os.path.join(out_dir, "plot_mean.png")},
+             {"function": Time_Plots.plot_average_pol, "args": (df,), "kwargs": {"k": 3},
+              "figure": {"nrows": 2, "ncols": 2, "figsize": (20, 20)}, "path": os.path.join(out_dir, "maxplots.png")},
+             {"function": Time_Plots.plot_average_pol, "args": (cube,), "kwargs": {"k": 3},
+              "figure": {"nrows": 2, "ncols": 2, "figsize": (20, 20)}, "path": os.path.join(out_dir, "maxplots_cube.png")},
+             {"function": Plot_Mean.plot_mean_pm, "args": (df,), "kwargs": {"time_interval": "5Min"}, "figure": {"figsize": (20, 20)},
+              "path": os.path.join(out_dir, "plot_mean_5min.png")}]
+    for task in tasks:
+        t = time.perf_counter()
+        Render.render_all([task], max_workers = 1)
+        print("{:<48}{:>8.2f} s".format(os.path.basename(task["path"]), time.perf_counter() - t))
+    t = time.perf_counter()
+    Render.render_all(tasks, max_workers = 1)
+    t_serial = time.perf_counter() - t
+    t = time.perf_counter()
+    Render.render_all(tasks)
+    t_parallel = time.perf_counter() - t
+    print("\n{:<48}{:>8.2f} s".format(str(len(tasks)) + " figures one after another", t_serial))
+    print("{:<48}{:>8.2f} s".format(str(len(tasks)) + " figures in parallel processes", t_parallel))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+'''Memory and runtime of the compact load_data schema compared to the former schema
+(time as strings, sensor_id as object, float64 columns, string measurement_id).
+
+The frame mimics a 24 h state-wide pull: 1500 sensors with one reading every 145 seconds.
+Run from the hal_pm directory:  python benchmarks/schema_comparison.py'''
+
+import time
+from hal_pm import Load_Data
+from hal_pm import Synthetic_Data
+from hal_pm import Filter_Data
+
+N_SENSORS = 1500
+SAMPLING_SECONDS = 145
+HOURS = 24
+
+
+def legacy_frame(n_sensors = N_SENSORS, sampling_seconds = SAMPLING_SECONDS, hours = HOURS, seed = 0):
+    '''builds a frame in the former schema of load_data'''
+    df = Synthetic_Data.sensor_frame(n_sensors = n_sensors, hours = hours, sampling_seconds = sampling_seconds, missing_rate = 0,
+                                     outlier_rate = 0, seed = seed)
+    df = df.astype({"measurement_PM10": "float64", "measurement_PM2.5": "float64", "lat": "float64", "lon": "float64"})
+    df["time"] = df["time"].dt.strftime("%Y-%m-%dT%H:%M:%S").astype(object)
+    df["sensor_id"] = df["sensor_id"].astype(str).astype(object)
+    df["measurement_id"] = df["sensor_id"] + "_" + df["time"]
+    return df
+
+
+def consumers(df):
+    '''the work the analysis modules do on the loaded frame, returns the seconds per step'''
+    timings = {}
+    t = time.perf_counter()
+    for _ in range(3):                                                  # Plot_Mean, Map and Time_Plots each need the time as datetime64
+        date_time = Load_Data.time_column(df)
+    timings["time parsing (3 modules)"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    df[["measurement_PM10", "measurement_PM2.5"]].set_index(date_time).resample("10Min").mean()
+    timings["resample mean"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    df.groupby("sensor_id")[["measurement_PM10", "measurement_PM2.5"]].mean()
+    timings["groupby sensor mean"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    Filter_Data.remove_outliers(df, method = "quantile", quantile = [0, 0.99])
+    timings["remove_outliers"] = time.perf_counter() - t
+    return timings
+
+
+def main():
+    legacy = legacy_frame()
+    t = time.perf_counter()
+    compact = Load_Data.apply_schema(legacy.drop(columns = "measurement_id"))
+    cast_time = time.perf_counter() - t
+
+    print(str(len(legacy)) + " rows (" + str(N_SENSORS) + " sensors, " + str(HOURS) + " h)\n")
+    mem_legacy = legacy.memory_usage(deep = True).sum() / 1024 ** 2
+    mem_compact = compact.memory_usage(deep = True).sum() / 1024 ** 2
+    print("{:<28}{:>12}{:>12}".format("", "former", "compact"))
+    print("{:<28}{:>12.1f}{:>12.1f}".format("memory (MB)", mem_legacy, mem_compact))
+
+    t_legacy = consumers(legacy)
+    t_compact = consumers(compact)
+    for step in t_legacy:
+        print("{:<28}{:>12.3f}{:>12.3f}".format(step + " (s)", t_legacy[step], t_compact[step]))
+    print("{:<28}{:>12.3f}{:>12.3f}".format("total (s)", sum(t_legacy.values()), sum(t_compact.values())))
+    print("\nOne-off cost of apply_schema at load time: {:.3f} s".format(cast_time))
+
+
+if __name__ == "__main__":
+    main()
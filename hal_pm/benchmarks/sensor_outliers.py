@@ -0,0 +1,44 @@
+'''Runtime of the per-sensor outlier methods of Filter_Data.remove_outliers against the number of sensors.
+
+Every sensor reports every 145 seconds for 24 h (about 600 rows per sensor), so 5000 sensors are 3 million rows.
+The runtime should grow linearly with the number of rows and not depend on the number of sensors otherwise.
+The second table keeps 5000 sensors and the number of rows and stretches the time span (hourly readings over 28 days), the
+rolling window must not get slower once the span exceeds 21 days.
+Run from the hal_pm directory:  python benchmarks/sensor_outliers.py'''
+
+import contextlib
+import io
+import time
+from hal_pm import Synthetic_Data
+from hal_pm import Filter_Data
+
+
+SENSOR_COUNTS = [500, 1000, 2000, 5000]
+METHODS = ["Z-score", "sensor_robust_Z", "sensor_rolling_Z"]
+SPAN_DAYS = [7, 14, 28, 56]
+
+
+def timings(df):
+    result = []
+    for method in METHODS:
+        t = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            Filter_Data.remove_outliers(df, method = method)
+        result.append(time.perf_counter() - t)
+    return "".join("{:>22.2f}".format(t) for t in result)
+
+
+def main():
+    print("{:>8}{:>12}".format("sensors", "rows") + "".join("{:>22}".format(m + " (s)") for m in METHODS))
+    for n_sensors in SENSOR_COUNTS:
+        df = Synthetic_Data.sensor_frame(n_sensors = n_sensors)
+        print("{:>8}{:>12}".format(n_sensors, len(df)) + timings(df))
+
+    print("\n{:>8}{:>12}".format("days", "rows") + "".join("{:>22}".format(m + " (s)") for m in METHODS))
+    for days in SPAN_DAYS:
+        df = Synthetic_Data.sensor_frame(n_sensors = 5000, hours = 24 * days, sampling_seconds = 3600 * days // 28)
+        print("{:>8}{:>12}".format(days, len(df)) + timings(df))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+'''Agreement and runtime of Filter_Data.remove_outliers_stream against the in-memory remove_missing + remove_outliers.
+
+The data is the synthetic 24 h frame of schema_comparison.py (with 1 % missing values), cut into chunks of CHUNKSIZE rows.
+Run from the hal_pm directory:  python benchmarks/stream_filter.py'''
+
+import contextlib
+import io
+import time
+import numpy as np
+from hal_pm import Synthetic_Data
+from hal_pm import Filter_Data
+
+
+CHUNKSIZE = 100000
+
+
+def main():
+    df = Synthetic_Data.sensor_frame(missing_rate = 0.01)
+    df = df.sample(frac = 1, random_state = 0).reset_index(drop = True)                  # chunks in random order, so the window baseline is not biased by time
+    chunks = [df.iloc[i:i + CHUNKSIZE] for i in range(0, len(df), CHUNKSIZE)]
+    print(str(len(df)) + " rows in " + str(len(chunks)) + " chunks\n")
+
+    print("{:<16}{:<10}{:>12}{:>12}{:>20}".format("method", "baseline", "exact (s)", "stream (s)", "rows differing"))
+    for method in ["Z-score", "critical_value", "quantile"]:
+        for baseline in ["two_pass", "window"]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                t = time.perf_counter()
+                exact = Filter_Data.remove_outliers(Filter_Data.remove_missing(df), method = method)
+                t_exact = time.perf_counter() - t
+                t = time.perf_counter()
+                streamed = list(Filter_Data.remove_outliers_stream(chunks, method = method, baseline = baseline))
+                t_stream = time.perf_counter() - t
+            kept = np.zeros(len(df), dtype = bool)
+            kept[np.concatenate([c.index.values for c in streamed])] = True
+            kept_exact = np.zeros(len(df), dtype = bool)
+            kept_exact[exact.index.values] = True
+            differing = (kept != kept_exact).sum()
+            print("{:<16}{:<10}{:>12.2f}{:>12.2f}{:>8} ({:.3f} %)".format(method, baseline, t_exact, t_stream, differing, 100 * differing / len(df)))
+
+
+if __name__ == "__main__":
+    main()
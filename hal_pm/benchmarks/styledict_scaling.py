@@ -0,0 +1,60 @@
+'''Runtime of the TimeSliderChoropleth styledict construction in Map.map_data for a growing number
+of polygons and time bins: the former nested loop against the vectorized Map.build_styledict.
+
+Run from the hal_pm directory:  python benchmarks/styledict_scaling.py'''
+
+import time
+import numpy as np
+import pandas as pd
+from branca.colormap import linear
+from hal_pm import Map
+
+POLYGONS = [50, 200, 800, 3200]
+TIME_BINS = [12, 72, 288]                 # 1 h, 6 h and 24 h at 5 minute bins
+LEGACY_LIMIT = 60000                      # the former loop is only timed up to this many rows
+
+
+def aggregated_frame(n_polygons, n_bins, seed = 0):
+    '''a frame like gr_plz_pm in map_data: one row per (time bin, polygon)'''
+    rng = np.random.default_rng(seed)
+    times = pd.date_range("2021-06-01", periods = n_bins, freq = "5Min")
+    df = pd.DataFrame({"time": np.repeat(times, n_polygons),
+                       "polygon_id": np.tile(np.arange(n_polygons), n_bins),
+                       "measurement_PM10": rng.gamma(2, 8, n_polygons * n_bins)})
+    df["dt_index"] = df["time"].astype("int64") // 10**9
+    return df
+
+
+def legacy_styledict(gr_plz_pm, measurement_type, cmap):
+    '''the styledict loop map_data used before'''
+    styledict = {}
+    for poly in pd.unique(gr_plz_pm['polygon_id']):
+        meas = gr_plz_pm.loc[gr_plz_pm['polygon_id'] == poly]
+        poly = int(poly)
+        styledict[poly] = {}
+        for date_time in meas['dt_index']:
+            value = float(meas[measurement_type][meas['dt_index'] == date_time].iloc[0])
+            styledict[poly][date_time] = {'color': cmap(value),'opacity': 0.1}
+    return styledict
+
+
+def main():
+    cmap = linear.BuPu_09.scale(0, 50)
+    print("{:>10}{:>10}{:>10}{:>16}{:>16}".format("polygons", "bins", "rows", "former (s)", "vectorized (s)"))
+    for n_polygons in POLYGONS:
+        for n_bins in TIME_BINS:
+            df = aggregated_frame(n_polygons, n_bins)
+            t = time.perf_counter()
+            Map.build_styledict(df["polygon_id"].values, df["dt_index"].values, df["measurement_PM10"].values, cmap)
+            t_new = time.perf_counter() - t
+            if len(df) <= LEGACY_LIMIT:
+                t = time.perf_counter()
+                legacy_styledict(df, "measurement_PM10", cmap)
+                t_old = "{:>16.3f}".format(time.perf_counter() - t)
+            else:
+                t_old = "{:>16}".format("skipped")
+            print("{:>10}{:>10}{:>10}".format(n_polygons, n_bins, len(df)) + t_old + "{:>16.3f}".format(t_new))
+
+
+if __name__ == "__main__":
+    main()
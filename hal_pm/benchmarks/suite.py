@@ -0,0 +1,42 @@
+'''Benchmark suite: runtime and peak memory of every pipeline stage (load_data against a local replay of the REST-API,
+remove_outliers, get_max, build_cube, plot_average_pol, map_data, corr_matrix) on synthetic data of several size tiers.
+
+Run from the hal_pm directory:
+    python benchmarks/suite.py --tiers small medium --out results.json
+    python benchmarks/suite.py --out new.json --compare results.json        (exit code 1 if a stage regressed)'''
+
+import sys
+from argparse import ArgumentParser
+import matplotlib
+matplotlib.use("Agg")
+from hal_pm import Benchmark
+from hal_pm import Instrumentation
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--tiers', nargs = '+', default = ["small", "medium"], choices = list(Benchmark.TIERS), help = "size tiers to run")
+    parser.add_argument('--stages', nargs = '+', default = Benchmark.STAGES, choices = Benchmark.STAGES, help = "stages to measure")
+    parser.add_argument('--out', type = str, default = None, help = "JSON file for the results")
+    parser.add_argument('--repeat', type = int, default = 3, help = "runs per stage, the fastest one is reported")
+    parser.add_argument('--no_memory', action = "store_true", help = "do not measure the peak memory")
+    parser.add_argument('--compare', type = str, default = None, help = "JSON results of an earlier run to compare with")
+    parser.add_argument('--threshold', type = float, default = 0.2, help = "relative increase that counts as a regression")
+    args = parser.parse_args()
+    Instrumentation.configure()                                                             # the timings of every stage are logged
+
+    results = Benchmark.run(args.tiers, args.stages, out_path = args.out, repeat = args.repeat, memory = not args.no_memory)
+    if args.compare is None:
+        return 0
+    comparison = Benchmark.compare(args.compare, results, threshold = args.threshold)
+    print("\n" + comparison.to_string(index = False, float_format = lambda x: "{:.3f}".format(x)))
+    regressions = comparison[comparison["regression"]]
+    if len(regressions) > 0:
+        print("\n" + str(len(regressions)) + " regression(s): " + ", ".join(regressions["tier"] + "/" + regressions["stage"]))
+        return 1
+    print("\nno regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+'''Runtime of re-aggregating at several intervals from the rows (resample / groupby) against deriving them from one Time_Cube.
+
+Run from the hal_pm directory:  python benchmarks/time_cube.py'''
+
+import time
+from hal_pm import Synthetic_Data
+from hal_pm import Time_Cube
+
+
+INTERVALS = ["1Min", "5Min", "10Min", "30Min", "1h"]
+
+
+def main():
+    df = Synthetic_Data.sensor_frame(n_sensors = 5000)
+    print(str(len(df)) + " rows, " + str(df["sensor_id"].nunique()) + " sensors\n")
+
+    t = time.perf_counter()
+    cube = Time_Cube.build_cube(df, base_interval = "1Min")
+    print("build_cube (1Min): {:.2f} s, {} cells\n".format(time.perf_counter() - t, len(cube["cells"])))
+
+    print("{:<10}{:>14}{:>14}{:>18}{:>18}".format("interval", "resample (s)", "cube (s)", "per sensor (s)", "cube sensor (s)"))
+    for interval in INTERVALS:
+        t = time.perf_counter()
+        df.set_index("time")[Time_Cube.MEASUREMENTS].resample(interval).mean()
+        t_rows = time.perf_counter() - t
+        t = time.perf_counter()
+        Time_Cube.mean_series(cube, interval)
+        t_cube = time.perf_counter() - t
+        t = time.perf_counter()
+        df.groupby(["sensor_id", df["time"].dt.floor(interval)])[Time_Cube.MEASUREMENTS].agg(["count", "mean", "std", "min", "max"])
+        t_rows_sensor = time.perf_counter() - t
+        t = time.perf_counter()
+        Time_Cube.to_frame(cube, interval)
+        t_cube_sensor = time.perf_counter() - t
+        print("{:<10}{:>14.3f}{:>14.3f}{:>18.3f}{:>18.3f}".format(interval, t_rows, t_cube, t_rows_sensor, t_cube_sensor))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+import collections
+import hashlib
+import json
+import os
+import time
+from hal_pm import Load_Data
+from hal_pm import Filter_Data
+from hal_pm import Descriptive_Stats
+from hal_pm import Plot_Mean
+from hal_pm import Time_Plots
+from hal_pm import Corr_Fct
+from hal_pm import Map
+from hal_pm import Boundaries
+from hal_pm import Time_Cube
+from hal_pm import Render
+from hal_pm import Instrumentation
+
+JOB_KEYS = ["lat_start", "lat_end", "long_start", "long_end", "start_date", "delta_hours"]
+JOB_DEFAULTS = {"name": None, "filter": "Z-score", "scd_start_date": None, "geo_boundaries": "geoboundaries/plz_ger.geojson",
+                "base_url": Load_Data.BASE_URL, "compact": False}
+MANIFEST = "manifest.json"
+
+
+def read_jobs(spec_path):
+    '''Reads a job spec file'''
+
+    '''INPUT:'''
+
+    '''spec_path:       JSON file with a list of jobs, or with {"defaults": {...}, "jobs": [...]}. A job needs lat_start, lat_end,'''
+    '''                 long_start, long_end, start_date (ISO format) and delta_hours and can set name, filter, scd_start_date'''
+    '''                 geo_boundaries, base_url and compact (see JOB_DEFAULTS), the defaults apply to every job.'''
+    '''                 compact = true writes the lightweight maps of Map.map_data(..., compact = True)'''
+
+    '''OUTPUT:'''
+
+    '''List of job dictionaries, each with a unique id (its name, or a hash of its parameters)'''
+
+    with open(spec_path) as f:
+        spec = json.load(f)
+    if isinstance(spec, list):
+        spec = {"jobs": spec}
+    if not (isinstance(spec, dict) and isinstance(spec.get("jobs"), list)):
+        raise TypeError("the job spec must be a list of jobs or a dictionary with a list of jobs under jobs")
+
+    jobs = []
+    for entry in spec["jobs"]:
+        job = dict(JOB_DEFAULTS, **spec.get("defaults", {}), **entry)
+        for key in JOB_KEYS:
+            if not key in job:
+                raise NameError("job " + str(entry) + " has no " + key)
+        datetime.fromisoformat(job["start_date"])                                          # raises a ValueError for malformed dates
+        job["id"] = job_id(job)
+        jobs.append(job)
+    ids = [job["id"] for job in jobs]
+    if len(set(ids)) != len(ids):
+        raise ValueError("the job names must be unique")
+    return jobs
+
+
+def job_id(job):
+    '''the name of a job, or a short hash of its parameters if it has no name'''
+    if job.get("name"):
+        return str(job["name"])
+    params = {key: value for key, value in job.items() if key not in ["name", "id"]}
+    return hashlib.sha1(json.dumps(params, sort_keys = True).encode()).hexdigest()[:12]
+
+
+@Instrumentation.timed(rows_out = False)
+def fetch(job, cache = True):
+    '''loads the data of a job (and of its second time window), this part is bound by the network'''
+    def load(start_date):
+        return Load_Data.load_data(job["lat_start"], job["lat_end"], job["long_start"], job["long_end"],
+                                   datetime.fromisoformat(start_date), job["delta_hours"], base_url = job["base_url"], cache = cache)
+    pmdata = load(job["start_date"])
+    pmdata2 = load(job["scd_start_date"]) if job["scd_start_date"] is not None else None
+    return pmdata, pmdata2
+
+
+@Instrumentation.timed()
+def report(job, pmdata, pmdata2 = None, out_dir = ".", render_workers = 1, cache = True):
+    '''Filters the data of a job and writes all plots and maps to out_dir, this part is bound by the CPU'''
+
+    '''INPUT:'''
+
+    '''render_workers:  Number of processes that render the figures (see Render.render_all), default: 1 (batch jobs already run in parallel)'''
+
+    '''OUTPUT:'''
+
+    '''List of the written files'''
+
+    os.makedirs(out_dir, exist_ok = True)
+
+    #3. filter data
+    Instrumentation.logger.info("\nResults after filtering:")
+    pmdata = Filter_Data.remove_missing(pmdata)
+    pmdata = Filter_Data.remove_outliers(pmdata, method = job["filter"])
+
+    #4. descriptive stats
+    Instrumentation.logger.info("\nThe following are the maximum values for the two particle measurements:")
+    pmmax = Descriptive_Stats.get_max(pmdata, get_map = False)                              # the plotly map of the maxima is not part of the report
+    Instrumentation.logger.info("%s", pmmax)
+
+    # one pass over the filtered rows, the mean plots, the time plots and the map are derived from the cube
+    pmcube = Time_Cube.build_cube(pmdata, base_interval = "1Min")
+
+    #6 Correlation
+    corr = Corr_Fct.corr_matrix(pmdata, plot = False)
+    Instrumentation.logger.info("\nThe correlation between the PM2.5 and the PM10 series is %s", corr[0,1])
+
+    #4.-7. the figures are independent of each other and rendered headless (Agg, no pyplot state), possibly in parallel
+    tasks = [{"function": Plot_Mean.plot_mean_pm, "args": (pmcube,), "figure": {"figsize": (20, 20)},
+              "path": os.path.join(out_dir, 'plot_mean.png')},
+             {"function": Time_Plots.plot_average_pol, "args": (pmcube,), "figure": {"nrows": 2, "ncols": 2, "figsize": (20, 20)},
+              "path": os.path.join(out_dir, 'maxplots.png')},
+             {"function": Corr_Fct.plot_corr, "args": (corr,), "figure": {"figsize": (20, 20)},
+              "path": os.path.join(out_dir, 'corrmatrix.png')}]
+    if pmdata2 is not None:                                                                 #7 Second dataframe
+        tasks.append({"function": Plot_Mean.plot_mean_pm, "args": (pmcube,), "kwargs": {"df2": pmdata2}, "figure": {"figsize": (20, 20)},
+                      "path": os.path.join(out_dir, 'plot_mean_2nddf.png')})
+    written = Render.render_all(tasks, max_workers = render_workers)
+
+    #8 Map
+    pm_maps = Map.map_data(pmcube, job["geo_boundaries"], measurement_type = ["measurement_PM2.5", "measurement_PM10"],
+                           compact = job["compact"], out_dir = out_dir, cache_dir = Boundaries.DEFAULT_CACHE_DIR if cache else None)
+    written += [os.path.join(out_dir, "index_" + m[m.find("_")+1:] + ".html") for m in pm_maps]
+    return written
+
+
+def run_job(job, out_dir = ".", cache = True, render_workers = None):
+    '''fetches and reports one job in the current process, the figures are rendered in parallel processes'''
+    pmdata, pmdata2 = fetch(job, cache = cache)
+    return report(job, pmdata, pmdata2, out_dir = out_dir, render_workers = render_workers, cache = cache)
+
+
+def run_batch(spec_path, out_dir = "reports", max_workers = 4, prefetch = 2, cache = True):
+    '''Runs all jobs of a job spec file, every job writes to its own directory out_dir/<job id>'''
+
+    '''INPUT:'''
+
+    '''spec_path:       JSON job spec, see read_jobs'''
+    '''out_dir:         Directory of the job directories and of the manifest'''
+    '''max_workers:     Number of processes that filter, plot and map, type: int, default: 4'''
+    '''prefetch:        Number of jobs whose data is fetched ahead, while the processes work on earlier jobs, type: int, default: 2'''
+    '''cache:           Use the query cache of load_data and the disk cache of the boundaries'''
+
+    '''OUTPUT:'''
+
+    '''The manifest: {job id: {"status": "done" or "failed", ...}}. It is written to out_dir/manifest.json after every job,'''
+    '''so running the same spec again resumes an interrupted batch: jobs that are done (with the same parameters) are skipped,'''
+    '''failed jobs are retried'''
+
+    # Defensive programming
+    if not isinstance(max_workers, int) or max_workers < 1:
+        raise ValueError("max_workers must be a positive integer")
+    if not isinstance(prefetch, int) or prefetch < 1:
+        raise ValueError("prefetch must be a positive integer")
+
+    jobs = read_jobs(spec_path)
+    os.makedirs(out_dir, exist_ok = True)
+    manifest = read_manifest(out_dir)
+    todo = collections.deque(job for job in jobs if not _is_done(manifest, job))
+    Instrumentation.logger.info("%d of %d jobs are already done, %d jobs to run", len(jobs) - len(todo), len(jobs), len(todo))
+
+    def record(job, started, status, outputs = None, error = None):
+        manifest[job["id"]] = {"status": status, "job": job, "outputs": outputs or [], "error": error,
+                               "seconds": round(time.perf_counter() - started, 2),
+                               "finished": datetime.now(timezone.utc).isoformat(timespec = "seconds")}
+        write_manifest(out_dir, manifest)
+        Instrumentation.logger.info("job %s %s", job["id"], status if error is None else status + ": " + error)
+
+    # the network fetch of the next jobs runs in threads of this process while the worker processes are busy with earlier jobs
+    with ThreadPoolExecutor(max_workers = prefetch) as fetchers, ProcessPoolExecutor(max_workers = max_workers) as workers:
+        fetching, running = {}, {}
+
+        def top_up():                                                                       # at most max_workers + prefetch jobs are held in memory
+            while todo and len(fetching) + len(running) < max_workers + prefetch:
+                job = todo.popleft()
+                fetching[fetchers.submit(fetch, job, cache)] = (job, time.perf_counter())
+
+        top_up()
+        while fetching or running:
+            done, _ = wait(list(fetching) + list(running), return_when = FIRST_COMPLETED)
+            for future in done:
+                if future in fetching:
+                    job, started = fetching.pop(future)
+                    try:
+                        pmdata, pmdata2 = future.result()
+                    except Exception as e:
+                        record(job, started, "failed", error = "fetch: " + repr(e))
+                        continue
+                    running[workers.submit(report, job, pmdata, pmdata2, os.path.join(out_dir, job["id"]), 1, cache)] = (job, started)
+                else:
+                    job, started = running.pop(future)
+                    try:
+                        record(job, started, "done", outputs = future.result())
+                    except Exception as e:
+                        record(job, started, "failed", error = repr(e))
+            top_up()
+    return manifest
+
+
+def read_manifest(out_dir):
+    '''reads out_dir/manifest.json, an empty manifest if there is none'''
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(out_dir, manifest):
+    '''writes the manifest atomically, an interrupted batch never leaves a half written manifest'''
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent = 1, default = str)
+    os.replace(path + ".tmp", path)
+
+
+def _is_done(manifest, job):
+    entry = manifest.get(job["id"])
+    return entry is not None and entry["status"] == "done" and entry["job"] == job
@@ -0,0 +1,204 @@
+from datetime import datetime, timezone
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import matplotlib
+from hal_pm import Load_Data
+from hal_pm import Filter_Data
+from hal_pm import Descriptive_Stats
+from hal_pm import Time_Plots
+from hal_pm import Corr_Fct
+from hal_pm import Map
+from hal_pm import Time_Cube
+from hal_pm import Render
+from hal_pm import Replay_Server
+from hal_pm import Synthetic_Data
+from hal_pm import Instrumentation
+
+# size tiers: arguments of Synthetic_Data.sensor_frame. medium is about a 24 h pull of Lower Saxony
+TIERS = {"small": {"n_sensors": 200, "hours": 6},
+         "medium": {"n_sensors": 1500, "hours": 24},
+         "large": {"n_sensors": 5000, "hours": 24}}
+STAGES = ["load_data", "remove_outliers", "get_max", "build_cube", "plot_average_pol", "map_data", "corr_matrix"]
+
+
+def run(tiers = ("small", "medium"), stages = STAGES, out_path = None, repeat = 3, memory = True, seed = 0):
+    '''Times every stage of the pipeline on synthetic data of several sizes and measures its peak memory'''
+
+    '''INPUT:'''
+
+    '''tiers:           names of TIERS (or dictionaries of arguments of Synthetic_Data.sensor_frame), type: list'''
+    '''stages:          stages to measure (see STAGES), the stages get the output of load_data and of remove_outliers as input'''
+    '''out_path:        JSON file the results are written to, default: None (not written)'''
+    '''repeat:          runs per stage, the fastest run is reported, type: int, default: 3'''
+    '''memory:          if True, the peak of the memory allocated during one more run of the stage is measured with tracemalloc'''
+    '''                 (numpy and pandas report their buffers to tracemalloc), it is not part of the timed runs'''
+    '''seed:            seed of the synthetic data'''
+
+    '''OUTPUT:'''
+
+    '''dictionary with meta (versions, platform, date) and results {tier: {"rows": ..., "stages": {stage: {"seconds", "peak_mb"}}}}'''
+
+    # Defensive programming
+    for stage in stages:
+        if not stage in STAGES:
+            raise ValueError(stage + " is not one of " + ", ".join(STAGES))
+    if not isinstance(repeat, int) or repeat < 1:
+        raise ValueError("repeat must be a positive integer")
+
+    results = {"meta": _meta(repeat, memory, seed), "results": {}}
+    for tier in tiers:
+        name, params = (tier, TIERS[tier]) if isinstance(tier, str) else (json.dumps(tier, sort_keys = True), tier)
+        results["results"][name] = run_tier(params, stages, repeat, memory, seed)
+        if out_path is not None:                                                            # written after every tier, a long run can be inspected early
+            write_results(results, out_path)
+    return results
+
+
+def run_tier(params, stages = STAGES, repeat = 3, memory = True, seed = 0):
+    '''runs the stages on one size tier in a temporary directory, returns {"params", "rows", "stages"}'''
+    work = tempfile.mkdtemp(prefix = "hal_pm_benchmark_")
+    try:
+        df = Synthetic_Data.sensor_frame(seed = seed, **params)
+        bbox = (float(df["lat"].min()), float(df["lat"].max()) + 1e-4, float(df["lon"].min()), float(df["lon"].max()) + 1e-4)
+        geo_boundaries = Synthetic_Data.polygon_grid(os.path.join(work, "plz.geojson"), *bbox, n = 40)
+        start = df["time"].min().floor("h").to_pydatetime()
+        hours = (df["time"].max() - pd.Timestamp(start)).total_seconds() / 3600 + 1 / 60
+        timings = {}
+
+        # every stage is a function without arguments, so that it can be run several times
+        def load():
+            return Load_Data.load_data(*bbox, start, hours, base_url = base_url, cache = False)
+
+        def clean():
+            return Filter_Data.remove_outliers(Filter_Data.remove_missing(df), method = "Z-score")
+
+        def plot():
+            fig, ax = Render.new_figure(nrows = 2, ncols = 2, figsize = (20, 20))
+            Time_Plots.plot_average_pol(filtered, ax = ax)
+            Render.save(fig, os.path.join(work, "maxplots.png"))
+
+        def mapping():
+            Map.map_data(filtered, geo_boundaries, measurement_type = ["measurement_PM10", "measurement_PM2.5"], compact = True, out_dir = work)
+
+        functions = {"load_data": load, "remove_outliers": clean,
+                     "get_max": lambda: Descriptive_Stats.get_max(filtered, get_map = False),
+                     "build_cube": lambda: Time_Cube.build_cube(filtered),
+                     "plot_average_pol": plot, "map_data": mapping,
+                     "corr_matrix": lambda: Corr_Fct.corr_matrix(filtered, plot = False)}
+
+        # load_data is measured against recorded responses (as the REST-API sends them), the responses are computed once beforehand
+        server = None
+        if "load_data" in stages:
+            record_dir = os.path.join(work, "responses")
+            recorder, base_url = Replay_Server.serve_frame(df, record_dir = record_dir)
+            load()
+            recorder.shutdown()
+            server, base_url = Replay_Server.serve(record_dir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                filtered = clean() if any(s not in ["load_data", "remove_outliers"] for s in stages) else None
+            for stage in STAGES:
+                if stage in stages:
+                    timings[stage] = measure(functions[stage], repeat = repeat, memory = memory)
+                    Instrumentation.logger.info("{:<12}{:<20}{:>10.3f} s{:>12} MB".format(str(params.get("n_sensors", "")) + " sensors", stage, timings[stage]["seconds"],
+                                                                    "-" if timings[stage]["peak_mb"] is None else round(timings[stage]["peak_mb"], 1)))
+        finally:
+            if server is not None:
+                server.shutdown()
+        return {"params": params, "rows": len(df), "stages": timings}
+    finally:
+        shutil.rmtree(work, ignore_errors = True)
+
+
+def measure(function, repeat = 3, memory = True):
+    '''runs function repeat times and returns the fastest runtime in seconds and the peak memory of one more run in MB (None if not memory).
+    The output printed by function is discarded'''
+    seconds = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            t = time.perf_counter()
+            function()
+            seconds.append(time.perf_counter() - t)
+        peak = None
+        if memory:
+            tracing = tracemalloc.is_tracing()                                             # a trace of the caller (e.g. --memory) keeps running
+            if not tracing:
+                tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                function()
+                peak = (tracemalloc.get_traced_memory()[1] - before) / 1024**2
+            finally:
+                if not tracing:
+                    tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_mb": peak}
+
+
+def compare(baseline, current, threshold = 0.2, min_seconds = 0.05, min_mb = 5):
+    '''Compares two runs (results of run, or paths of their JSON files)'''
+
+    '''INPUT:'''
+
+    '''threshold:       relative increase of the runtime or the peak memory that counts as a regression, default: 0.2 (20 %)'''
+    '''min_seconds, min_mb:  smaller absolute increases are never a regression (timer noise of fast stages)'''
+
+    '''OUTPUT:'''
+
+    '''data frame with one row per tier and stage that both runs have: the runtimes, the peak memory, their ratios and'''
+    '''regression (True if the runtime or the peak memory grew by more than threshold)'''
+
+    baseline = read_results(baseline) if isinstance(baseline, str) else baseline
+    current = read_results(current) if isinstance(current, str) else current
+    rows = []
+    for tier, result in current["results"].items():
+        old_result = baseline["results"].get(tier)
+        if old_result is None:
+            continue
+        for stage, new in result["stages"].items():
+            old = old_result["stages"].get(stage)
+            if old is None:
+                continue
+            row = {"tier": tier, "stage": stage, "seconds_old": old["seconds"], "seconds_new": new["seconds"],
+                   "time_ratio": new["seconds"] / old["seconds"] if old["seconds"] > 0 else np.nan,
+                   "peak_mb_old": old["peak_mb"], "peak_mb_new": new["peak_mb"], "memory_ratio": np.nan}
+            slower = new["seconds"] > old["seconds"] * (1 + threshold) and new["seconds"] - old["seconds"] > min_seconds
+            larger = False
+            if old["peak_mb"] is not None and new["peak_mb"] is not None:
+                row["memory_ratio"] = new["peak_mb"] / old["peak_mb"] if old["peak_mb"] > 0 else np.nan
+                larger = new["peak_mb"] > old["peak_mb"] * (1 + threshold) and new["peak_mb"] - old["peak_mb"] > min_mb
+            row["regression"] = slower or larger
+            rows.append(row)
+    return pd.DataFrame(rows, columns = ["tier", "stage", "seconds_old", "seconds_new", "time_ratio",
+                                         "peak_mb_old", "peak_mb_new", "memory_ratio", "regression"])
+
+
+def write_results(results, out_path):
+    '''writes the results of run as JSON'''
+    directory = os.path.dirname(out_path)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    with open(out_path, "w") as f:
+        json.dump(results, f, indent = 1)
+    return out_path
+
+
+def read_results(path):
+    '''reads results written by write_results'''
+    with open(path) as f:
+        return json.load(f)
+
+
+def _meta(repeat, memory, seed):
+    return {"date": datetime.now(timezone.utc).isoformat(timespec = "seconds"), "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__, "matplotlib": matplotlib.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count(), "repeat": repeat, "memory": memory, "seed": seed}
@@ -0,0 +1,119 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+from hal_pm import Query_Cache
+
+DEFAULT_CACHE_DIR = os.path.join(Query_Cache.DEFAULT_CACHE_DIR, "boundaries")
+
+_boundaries = {}            # file hash -> GeoDataFrame with a built spatial index
+_assignments = {}           # file hash -> data frame of sensor_id, lat, lon and the position of its polygon
+_hashes = {}                # (path, size, mtime) -> file hash
+
+
+def file_hash(geo_boundaries):
+    '''returns the sha1 hash of a boundary file, files are only hashed again if they changed on disk'''
+    stat = os.stat(geo_boundaries)
+    key = (os.path.abspath(geo_boundaries), stat.st_size, stat.st_mtime)
+    if key not in _hashes:
+        sha = hashlib.sha1()
+        with open(geo_boundaries, "rb") as f:
+            for block in iter(lambda: f.read(2 ** 20), b""):
+                sha.update(block)
+        _hashes[key] = sha.hexdigest()
+    return _hashes[key]
+
+
+def load_boundaries(geo_boundaries, bbox = None, cache_dir = DEFAULT_CACHE_DIR, cache_size_mb = Query_Cache.DEFAULT_SIZE_MB):
+    '''
+    Loads a boundary file once per process and keeps its spatial index
+
+    INPUTS:
+    geo_boundaries:      File path of the boundaries (e.g. a geojson file)
+    bbox:                Optional (lat_start, lat_end, long_start, long_end), only polygons intersecting it are returned
+    cache_dir:           Directory where the boundaries are stored as GeoParquet (keyed by the file hash), so that
+                         later processes do not parse the original file again. Needs pyarrow. None: no disk cache
+    cache_size_mb:       Size limit of cache_dir, the least recently used boundaries are deleted first (as in Query_Cache)
+
+    OUTPUTS:
+    plz:                 GeoDataFrame of the boundaries. The index is the same as for gpd.read_file(geo_boundaries),
+                         also when the boundaries are clipped to bbox
+    '''
+
+    # Defensive programming
+    if not (isinstance(geo_boundaries,str)):
+        raise TypeError("geo_boundaries must be a file path as string")
+    if bbox is not None and len(bbox) != 4:
+        raise ValueError("bbox must be (lat_start, lat_end, long_start, long_end)")
+
+    h = file_hash(geo_boundaries)
+    if h not in _boundaries:
+        cached = cache_dir is not None and Query_Cache.available()
+        parquet_path = os.path.join(cache_dir, "boundaries_" + h + ".parquet") if cached else None
+        if cached and os.path.exists(parquet_path):
+            plz = gpd.read_parquet(parquet_path)
+            os.utime(parquet_path)                                          # the modification time is used as last access time for the LRU eviction
+        else:
+            plz = gpd.read_file(geo_boundaries)
+            if cached:
+                os.makedirs(cache_dir, exist_ok = True)
+                plz.to_parquet(parquet_path + ".tmp")
+                os.replace(parquet_path + ".tmp", parquet_path)
+                Query_Cache.evict(cache_dir, cache_size_mb)
+        plz.sindex                                                          # build the spatial index once, it is reused by every query
+        _boundaries[h] = plz
+    plz = _boundaries[h]
+
+    if bbox is None:
+        return plz
+    rows = plz.sindex.query(box(bbox[2], bbox[0], bbox[3], bbox[1]), predicate = "intersects")
+    return plz.iloc[np.sort(rows)]
+
+
+def assign_sensors(geo_boundaries, sensors, cache_dir = DEFAULT_CACHE_DIR):
+    '''
+    Assigns sensors to the polygon they are located in. Sensors do not move, so assignments are memoized per
+    boundary file and only sensors that were not seen before (or whose location changed) are looked up
+
+    INPUTS:
+    geo_boundaries:      File path of the boundaries
+    sensors:             Data frame with the columns sensor_id, lat and lon (one row per sensor)
+    cache_dir:           Disk cache of the boundaries, see load_boundaries
+
+    OUTPUTS:
+    polygon_id:          Series indexed by sensor_id with the index of the polygon in the boundaries,
+                         sensors outside of all polygons are left out
+    '''
+
+    plz = load_boundaries(geo_boundaries, cache_dir = cache_dir)
+    h = file_hash(geo_boundaries)
+    sensors = sensors[["sensor_id", "lat", "lon"]].drop_duplicates("sensor_id").reset_index(drop = True)
+
+    known = _assignments.get(h)
+    if known is None:
+        new = np.ones(len(sensors), dtype = bool)
+    else:
+        lookup = sensors.merge(known, on = "sensor_id", how = "left", suffixes = ("", "_known"))
+        new = (lookup["lat"] != lookup["lat_known"]) | (lookup["lon"] != lookup["lon_known"])      # also True for unknown sensors (NaN)
+        new = new.values
+
+    if new.any():
+        # point in polygon lookup of the new sensors against the spatial index of all polygons
+        new_sensors = sensors[new].reset_index(drop = True)
+        points = gpd.points_from_xy(new_sensors["lon"], new_sensors["lat"], crs = 4326)
+        point_idx, poly_idx = plz.sindex.query(points, predicate = "intersects")
+        position = np.full(len(new_sensors), -1, dtype = np.int64)                                  # -1: the sensor is outside of all polygons
+        first = pd.Series(poly_idx).groupby(point_idx).min()                                        # a sensor on a shared border is assigned to the first polygon
+        position[first.index.values] = first.values
+        new_sensors["position"] = position
+        if known is None:
+            known = new_sensors
+        else:
+            known = pd.concat([known[~known["sensor_id"].isin(new_sensors["sensor_id"])], new_sensors], ignore_index = True)
+        _assignments[h] = known
+
+    position = known.set_index("sensor_id")["position"].reindex(sensors["sensor_id"])
+    position = position[position >= 0]
+    return pd.Series(plz.index[position.values], index = position.index, name = "polygon_id")
@@ -1,67 +1,226 @@
 import numpy as np
 import pandas as pd
 import seaborn as sns
+from hal_pm import Load_Data
+from hal_pm import Time_Cube
+from hal_pm import Instrumentation
+
+MEASUREMENTS = ['measurement_PM2.5', 'measurement_PM10']
 
 def corr_coeff(df):
     """Computes the correlation coefficient between the PM2.5 and PM10 measurements"""
-    
+
     '''INPUT: '''
-    
+
     '''df:              A pandas data frame containing PM2.5 and PM10 measurements for a sensor at a given time'''
-    
+
     '''OUTPUT:'''
-    
+
     '''A float value for the correlation coefficient'''
-    
-    pm25 = np.array(df['measurement_PM2.5'])
-    pm10 = np.array(df['measurement_PM10'])
-    
-    n = len(pm25)
-    
-    meanpm25 = np.mean(pm25)
-    meanpm10 = np.mean(pm10)
-    
-    stdpm25 = np.std(pm25)
-    stdpm10 = np.std(pm10)
-    
-    num = (1/n) * np.sum((pm25 - meanpm25) * (pm10 - meanpm10))
-    denom = stdpm25 * stdpm10
-        
-    return (num/denom)
-
-
-def corr_matrix(df, plot = True):
-    """Computes the correlation matrix between the PM2.5 and PM10 measurements"""
-    
+
+    return corr_matrix(df, plot = False)[0,1]
+
+
+@Instrumentation.timed(rows_out = False)
+def corr_matrix(df, plot = True, measurements = MEASUREMENTS, ax = None):
+    """Computes the correlation matrix between the PM2.5 and PM10 measurements (or any list of measurement columns)"""
+
     '''INPUT: '''
-    
-    '''df:              A pandas data frame containing PM2.5 and PM10 measurements for a sensor at a given time'''
-    
+
+    '''df:              A pandas data frame containing PM2.5 and PM10 measurements for a sensor at a given time, or an iterable of such'''
+    '''                 data frames (e.g. load_data(..., chunksize = ...)), which are accumulated in one pass'''
+    '''measurements:    List of the columns to correlate, default: PM2.5 and PM10'''
+    '''ax:              Optional axes for the plot, default: the current pyplot axes'''
+
     '''OUTPUT:'''
-    
+
     '''A numpy array for the correlation matrix. If plot = True, the correlation matrix plot using seaborn is shown'''
-    
-    ###remove missing check###
-    
-    pm25 = np.array(df['measurement_PM2.5'])
-    pm10 = np.array(df['measurement_PM10'])
-    
-    n = len(pm25)
-    
-    meanpm25 = np.mean(pm25)
-    meanpm10 = np.mean(pm10)
-    
-    stdpm25 = np.std(pm25)
-    stdpm10 = np.std(pm10)
-    
-    num = (1/n) * np.sum((pm25 - meanpm25) * (pm10 - meanpm10))
-    denom = stdpm25 * stdpm10
-    
-    res = np.ones((2,2))
-    res[0,1], res[1,0] = (num/denom), (num/denom)
-    
+    '''Rows with missing values are left out pairwise, i.e. only for the pairs of columns where a value is missing'''
+
+    chunks = [df] if isinstance(df, pd.DataFrame) else df
+    sums, shift = None, None
+    for chunk in chunks:
+        values = np.array(chunk[measurements], dtype = np.float64)     # float32 columns are summed up in double precision
+        if shift is None:
+            valid = ~np.isnan(values)
+            shift = np.where(valid, values, 0).sum(axis = 0) / np.maximum(valid.sum(axis = 0), 1)   # the sums are taken around the mean of the first chunk
+        sums = _add_sums(sums, pairwise_sums(values, shift = shift))
+    if sums is None:
+        raise ValueError("df does not contain any rows")
+    res = corr_from_sums(sums)
+
     if (plot == True):
-        corrdf = pd.DataFrame(res)
-        sns.heatmap(corrdf, annot = True)
-    
-    return res
\ No newline at end of file
+        plot_corr(res, measurements = measurements, ax = ax)
+
+    return res
+
+
+def plot_corr(res, measurements = MEASUREMENTS, ax = None):
+    """Plots a correlation matrix out of corr_matrix as a seaborn heatmap, e.g. to plot a matrix that was already computed"""
+    corrdf = pd.DataFrame(res, index = measurements, columns = measurements)
+    return sns.heatmap(corrdf, annot = True, ax = ax)
+
+
+@Instrumentation.timed()
+def sensor_corr(df, x = 'measurement_PM2.5', y = 'measurement_PM10', min_periods = 3):
+    """Computes the correlation between two measurements for every sensor"""
+
+    '''INPUT: '''
+
+    '''df:              A pandas data frame with the column sensor_id and the measurements x and y'''
+    '''x, y:            Column names of the two measurements'''
+    '''min_periods:     Minimum number of rows with both values per sensor, else the correlation is NaN'''
+
+    '''OUTPUT:'''
+
+    '''A pandas data frame indexed by sensor_id with the number of rows n and the correlation corr'''
+
+    # Defensive programming
+    if not "sensor_id" in df:
+        raise NameError("There is no column named sensor_id in df -- need a column named sensor_id!")
+
+    # one pass: all co-moments of all sensors are grouped sums (np.bincount) of the shifted values
+    codes, sensor_ids = pd.factorize(df['sensor_id'])
+    a = np.array(df[x], dtype = np.float64)
+    b = np.array(df[y], dtype = np.float64)
+    valid = ~(np.isnan(a) | np.isnan(b))
+    a = np.where(valid, a - np.nanmean(a), 0)
+    b = np.where(valid, b - np.nanmean(b), 0)
+    sums = {}
+    for name, weights in [("n", valid), ("sa", a), ("sb", b), ("saa", a * a), ("sbb", b * b), ("sab", a * b)]:
+        sums[name] = np.bincount(codes, weights = weights, minlength = len(sensor_ids))
+    n = sums["n"]
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        cov = sums["sab"] - sums["sa"] * sums["sb"] / n
+        var_a = sums["saa"] - sums["sa"] ** 2 / n
+        var_b = sums["sbb"] - sums["sb"] ** 2 / n
+        corr = cov / np.sqrt(var_a * var_b)
+    corr = np.where(n >= min_periods, corr, np.nan)
+    return pd.DataFrame({"n": n.astype(np.int64), "corr": corr}, index = pd.Index(sensor_ids, name = "sensor_id"))
+
+
+@Instrumentation.timed(rows_out = False)
+def sensor_cross_corr(df, measurement = 'measurement_PM10', time_interval = "10Min", min_periods = 3, block_size = 1024, out_path = None):
+    """Computes the N x N correlation matrix between the time series of all sensors"""
+
+    '''INPUT: '''
+
+    '''df:              A pandas data frame out of load_data or a cube out of Time_Cube.build_cube'''
+    '''measurement:     The measurement to correlate'''
+    '''time_interval:   The series are aligned on time bins of this length (bin means), type: str, default: 10Min'''
+    '''min_periods:     Minimum number of time bins where both sensors have a value, else the correlation is NaN'''
+    '''block_size:      Number of rows of the matrix that are computed at once, limits the temporary memory to 5 * block_size * N floats'''
+    '''out_path:        Optional .npy file path. The matrix is then written block by block to a memory mapped file and not held in memory'''
+
+    '''OUTPUT:'''
+
+    '''r:               N x N numpy array (np.memmap if out_path is given) of the correlations, missing bins are left out pairwise'''
+    '''sensor_ids:      sensor_id of every row and column'''
+
+    cube = df if Time_Cube.is_cube(df) else Time_Cube.build_cube(df, base_interval = time_interval, measurements = [measurement])
+    times, sensor_ids, matrix = Time_Cube.time_matrix(cube, measurement, time_interval)
+    r = cross_corr(matrix, min_periods = min_periods, block_size = block_size, out_path = out_path)
+    return r, sensor_ids
+
+
+@Instrumentation.timed()
+def lagged_corr(df, df2, measurement = 'measurement_PM10', time_interval = "10Min", max_lag = 6):
+    """Computes the correlation between the mean series of two time windows (as compared in Plot_Mean) for a range of lags"""
+
+    '''INPUT: '''
+
+    '''df, df2:         Pandas data frames (or cubes) of the two time windows'''
+    '''measurement:     The measurement to correlate'''
+    '''time_interval:   The length of the time bins of the mean series, type: str, default: 10Min'''
+    '''max_lag:         Largest lag in time bins, lags from -max_lag to max_lag are computed. At lag k, bin t of df is'''
+    '''                 paired with bin t + k of df2 (counted from the start of each window)'''
+
+    '''OUTPUT:'''
+
+    '''A pandas data frame indexed by lag with the number of pairs n and the correlation corr'''
+
+    if not isinstance(max_lag, int) or max_lag < 0:
+        raise ValueError("max_lag must be a non-negative integer")
+    x = _mean_series(df, measurement, time_interval)
+    y = _mean_series(df2, measurement, time_interval)
+    lags = np.arange(-max_lag, max_lag + 1)
+    n = np.zeros(len(lags), dtype = np.int64)
+    corr = np.full(len(lags), np.nan)
+    for i, lag in enumerate(lags):
+        a = x[max(0, -lag):]
+        b = y[max(0, lag):]
+        a, b = a[:min(len(a), len(b))], b[:min(len(a), len(b))]
+        if len(a) < 2:
+            continue
+        sums = pairwise_sums(np.column_stack([a, b]))
+        n[i] = sums["n"][0,1]
+        corr[i] = corr_from_sums(sums)[0,1]
+    return pd.DataFrame({"n": n, "corr": corr}, index = pd.Index(lags, name = "lag"))
+
+
+def cross_corr(matrix, min_periods = 1, block_size = 1024, out_path = None):
+    """Pearson correlations between all columns of a (time x series) matrix with NaN for missing values.
+    For every pair of columns only the rows where both are present are used. The five pairwise sums are matrix
+    products (BLAS) of the zero-filled values and the validity mask, computed for block_size rows of the result at a time"""
+
+    matrix = np.asarray(matrix, dtype = np.float64)
+    k = matrix.shape[1]
+    valid = ~np.isnan(matrix)
+    column_mean = np.where(valid, matrix, 0).sum(axis = 0) / np.maximum(valid.sum(axis = 0), 1)
+    centred = np.where(valid, matrix - column_mean, 0)                 # centring keeps the sums accurate
+    mask = valid.astype(np.float64)
+    squares = centred ** 2
+
+    if out_path is not None:
+        r = np.lib.format.open_memmap(out_path, mode = "w+", dtype = np.float64, shape = (k, k))
+    else:
+        r = np.empty((k, k))
+    for start in range(0, k, block_size):
+        stop = min(start + block_size, k)
+        sums = {"n": mask[:, start:stop].T @ mask,
+                "sx": centred[:, start:stop].T @ mask,                 # sum of series i over the rows where series j is present
+                "sy": mask[:, start:stop].T @ centred,
+                "sxx": squares[:, start:stop].T @ mask,
+                "syy": mask[:, start:stop].T @ squares,
+                "sxy": centred[:, start:stop].T @ centred}
+        block = corr_from_sums(sums)
+        block[sums["n"] < min_periods] = np.nan
+        r[start:stop] = block
+    if out_path is not None:
+        r.flush()
+    return r
+
+
+def pairwise_sums(values, shift = None):
+    """Single pass moment accumulator: the pairwise sums n, sx, sy, sxx, syy, sxy of all pairs of columns of values (rows x columns,
+    NaN for missing values) around shift. The sums of several chunks (with the same shift) are merged by adding them up"""
+    values = np.asarray(values, dtype = np.float64)
+    valid = ~np.isnan(values)
+    shift = np.zeros(values.shape[1]) if shift is None else shift
+    centred = np.where(valid, values - shift, 0)
+    mask = valid.astype(np.float64)
+    return {"n": mask.T @ mask, "sx": centred.T @ mask, "sy": mask.T @ centred,
+            "sxx": (centred ** 2).T @ mask, "syy": mask.T @ centred ** 2, "sxy": centred.T @ centred}
+
+
+def corr_from_sums(sums):
+    """Pearson correlations from the pairwise sums of pairwise_sums"""
+    n = sums["n"]
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        cov = sums["sxy"] - sums["sx"] * sums["sy"] / n
+        var_x = sums["sxx"] - sums["sx"] ** 2 / n
+        var_y = sums["syy"] - sums["sy"] ** 2 / n
+        return np.clip(cov / np.sqrt(var_x * var_y), -1, 1)
+
+
+def _add_sums(a, b):
+    if a is None:
+        return b
+    return {key: a[key] + b[key] for key in a}
+
+
+def _mean_series(df, measurement, time_interval):
+    """mean series of all sensors of a data frame or cube in bins of time_interval, starting at the first bin"""
+    if Time_Cube.is_cube(df):
+        return Time_Cube.mean_series(df, time_interval)[measurement].values
+    return df[[measurement]].set_index(pd.DatetimeIndex(Load_Data.time_column(df))).resample(time_interval).mean()[measurement].values.astype(np.float64)
@@ -5,6 +5,10 @@ import numpy as np
 import warnings
 import plotly.express as px
 from matplotlib import pyplot as plt
+from hal_pm import Load_Data
+from hal_pm import Time_Cube
+from hal_pm import Render
+from hal_pm import Instrumentation
 
 #from ipynb.fs.full.Load_Data import load_data
 #from Clean_Data import remove_outliers
@@ -17,54 +21,136 @@ from matplotlib import pyplot as plt
 #df = remove_outliers(df,method = "quantile", quantile = [0,0.99])
 
 # Define functions 
-def get_max(df,get_map = True):
+@Instrumentation.timed(rows_out = False)
+def get_max(df,get_map = True, k = 1):
     '''returns maximum PM10 and PM2.5 concentration'''
     
     '''INPUTS:'''
     
     '''df:            Pandas Data Frame with PM10 and PM2.5 measurements as columns'''
     '''get_map:       Boolean for getting a map as output or not, default = False, type = boolean'''
+    '''k:             Number of maximum observations per measurement, default = 1, type = int'''
     
     '''OUTPUTS:'''
     
-    '''maxima:        A Pandas Data Frame containing the maximum observations for PM10 and PM2.5'''
+    '''maxima:        A Pandas Data Frame containing the k maximum observations for PM10 and PM2.5'''
     '''max_map:       An interactive map with the location of the maxima'''
     
     # defensive programming
     if not isinstance(get_map,bool):
         raise TypeError("get_map needs to be a boolean")
     
-    measurement = df[["measurement_PM10","measurement_PM2.5"]]
-    
-    where_max = measurement.idxmax()
-    
-    df1 = df.drop(["measurement_id","sensor_id"], axis = 1)
-    maxima = df1.loc[where_max]
-    label = ["max PM10","max PM2.5"]
-    maxima["label"] = label
+    # only the selected rows are copied, not the whole frame
+    parts = []
+    for measurement, label in [("measurement_PM10","max PM10"), ("measurement_PM2.5","max PM2.5")]:
+        part = top_k(df, k = k, measurement = measurement)
+        part["label"] = label
+        parts.append(part)
+    maxima = pd.concat(parts).drop(["measurement_id","sensor_id","rank"], axis = 1, errors = "ignore")    # measurement_id is only present if it was requested in load_data
     
     # also output a map displaying the location of the maxima if wanted
     if get_map == True:
-        median = maxima[['lat','lon']].median()        
-        max_map = px.scatter_mapbox(maxima,
-                             lat="lat",
-                             lon="lon",
-                             color="label")
-        max_map.update_layout(mapbox_style="open-street-map")
-        max_map.update_traces(marker=dict(size=12),
-                          selector=dict(mode='markers'))
-        return maxima, max_map
+        return maxima, _extremes_map(maxima)
     else:
         return maxima
 
 
+def top_k(df, k = 10, measurement = "measurement_PM10", by = None, time_interval = "1h", largest = True):
+    '''returns the rows with the k largest (or smallest) values of a measurement, overall, per sensor or per time bin'''
+    
+    '''INPUTS:'''
+    
+    '''df:            Pandas Data Frame with the measurement as column'''
+    '''k:             Number of rows per group, type = int'''
+    '''measurement:   Name of the measurement column'''
+    '''by:            None (k rows overall), "sensor_id" (k rows per sensor) or "time" (k rows per time bin of length time_interval)'''
+    '''time_interval: Length of the time bins for by = "time", e.g. 10Min, 1h, default = 1h'''
+    '''largest:       True for the largest, False for the smallest values'''
+    
+    '''OUTPUTS:'''
+    
+    '''A Pandas Data Frame with the selected rows (sorted by group and value) and their rank within the group.'''
+    '''The result of several chunks can be combined with merge_top_k, so extremes can be kept while data streams in'''
+    
+    # defensive programming
+    if not isinstance(k,int) or k < 1:
+        raise ValueError("k needs to be a positive integer")
+    if not measurement in df:
+        raise NameError(measurement+" is not a column of df")
+    if by not in [None, "sensor_id", "time"]:
+        raise ValueError("by needs to be None, sensor_id or time")
+    
+    values = df[measurement].to_numpy()
+    rows = np.flatnonzero(~np.isnan(values))                                                # missing values are never selected
+    key = values[rows].astype(np.float64)
+    key = -key if largest else key                                                          # select the k smallest keys
+    
+    if by is None:
+        if len(rows) > k:
+            kth = np.partition(key, k - 1)[k - 1]                                           # partial selection, O(n)
+            part = np.flatnonzero(key < kth)
+            part = np.r_[part, np.flatnonzero(key == kth)[:k - len(part)]]                  # ties at the k-th value: the first rows, as idxmax
+            rows, key = rows[part], key[part]
+        order = np.argsort(key, kind = "stable")
+        selected, rank = rows[order], np.arange(1, len(order) + 1)
+    else:
+        if by == "sensor_id":
+            groups = pd.factorize(df["sensor_id"].to_numpy()[rows], sort = True)[0]
+        else:
+            time = Load_Data.time_column(df).to_numpy()[rows].astype("datetime64[ns]").astype(np.int64)
+            groups = time // pd.Timedelta(time_interval).value
+        order = np.lexsort((key, groups))                                                   # by group, then by value
+        groups = groups[order]
+        start = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        rank = np.arange(len(order)) - np.repeat(start, np.diff(np.r_[start, len(order)])) + 1
+        keep = rank <= k
+        selected, rank = rows[order[keep]], rank[keep]
+    
+    result = df.iloc[selected].copy()
+    result["rank"] = rank
+    return result
+
+
+def merge_top_k(frames, k = 10, measurement = "measurement_PM10", by = None, time_interval = "1h", largest = True):
+    '''merges the results of top_k of several chunks (or workers) to the top k of all data, the inputs hold at most k rows per group,
+    so the merge is as cheap as merging bounded heaps'''
+    frames = [f for f in frames if f is not None and len(f) > 0]
+    if len(frames) == 0:
+        return None
+    merged = pd.concat(frames, ignore_index = True).drop(columns = "rank")
+    return top_k(merged, k = k, measurement = measurement, by = by, time_interval = time_interval, largest = largest)
+
+
+def top_k_stream(chunks, k = 10, measurement = "measurement_PM10", by = None, time_interval = "1h", largest = True):
+    '''keeps the top k rows of data that arrives in chunks (e.g. load_data(..., chunksize = ...)), only the current chunk and
+    at most k rows per group are held in memory'''
+    selected = None
+    for chunk in chunks:
+        current = top_k(chunk, k = k, measurement = measurement, by = by, time_interval = time_interval, largest = largest)
+        selected = merge_top_k([selected, current], k = k, measurement = measurement, by = by, time_interval = time_interval, largest = largest)
+    return selected
+
+
+def _extremes_map(maxima):
+    '''plotly map of the selected rows'''
+    max_map = px.scatter_mapbox(maxima,
+                         lat="lat",
+                         lon="lon",
+                         color="label")
+    max_map.update_layout(mapbox_style="open-street-map")
+    max_map.update_traces(marker=dict(size=12),
+                      selector=dict(mode='markers'))
+    return max_map
+
+
+@Instrumentation.timed(rows_out = False)
 def plot_mean_pm(df, time_interval = "1Min"):
     '''plots the mean PM10 and PM2.5 concentration over the given location against time'''
     
     '''INPUTS:'''
     
-    '''df:             Pandas Data Frame with PM10 and PM2.5 measurements as column'''
-    '''time_interval:  A String indicating over which time interval to average the data.'''
+    '''df:             Pandas Data Frame with PM10 and PM2.5 measurements as column, or a cube out of Time_Cube.build_cube'''
+    '''time_interval:  A String indicating over which time interval to average the data (for a cube a multiple of its interval).'''
     '''                Look at documentation of pandas.DataFrame.resample to get permissive values'''
     
     '''OUTPUTS:'''
@@ -73,20 +159,21 @@ def plot_mean_pm(df, time_interval = "1Min"):
     if not isinstance(time_interval,str):
         raise TypeError("time_interval needs to be a string")
     
-    df['date_time'] = pd.to_datetime(df['time'])
-    df1 = df[['date_time','measurement_PM10','measurement_PM2.5']]
-    mean_data = df1.set_index('date_time').resample(time_interval, label='right').mean()
-    mean_data['date_time'] = mean_data.index.strftime("%m.%d - %H:%M")
-    
-    plt.rc('font', size=20)          # controls default text sizes
+    if Time_Cube.is_cube(df):
+        mean_data = Time_Cube.mean_series(df, time_interval)        # derived from the cube, the rows are not scanned again
+        mean_data.index = mean_data.index + pd.Timedelta(time_interval)
+    else:
+        df1 = df[['measurement_PM10','measurement_PM2.5']].assign(date_time = Load_Data.time_column(df))
+        mean_data = df1.set_index('date_time').resample(time_interval, label='right').mean()
     
     fig, ax = plt.subplots(figsize = (20,10))
-    ax.plot('date_time', 'measurement_PM10', data = mean_data, color = "red")
-    ax.plot('date_time', 'measurement_PM2.5', data = mean_data, color = 'blue')
-    ax.xaxis.set_major_locator(plt.MaxNLocator(20))
+    for column, color in [('measurement_PM10', "red"), ('measurement_PM2.5', 'blue')]:   # real datetime axis, long series are downsampled
+        Render.plot_series(ax, mean_data.index.values, mean_data[column].values, label = column, color = color)
+    Render.date_axis(ax, maxticks = 20)
     ax.grid(True)
     ax.legend(loc = "best")
     ax.set_xlabel("Date and Time")
     ax.set_ylabel("μg/m³")
     ax.set_title("Average PM concentration over the sample area")
+    Render.set_font(ax, 20)          # font size of this plot only, no global plt.rc
     fig.autofmt_xdate(rotation = 45)
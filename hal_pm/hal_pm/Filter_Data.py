@@ -2,10 +2,18 @@ import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
+import collections
 import warnings
+from hal_pm import Stream_Stats
+from hal_pm import Load_Data
+from hal_pm import Instrumentation
+from hal_pm import Sensor_Registry
+
+MEASUREMENTS = ['measurement_PM10','measurement_PM2.5']
 
 
 # check for missing values and potentially remove those. Also print how many observations have been removed
+@Instrumentation.timed()
 def remove_missing(df):
     """Detects and removes missing values, the function prints out how many values were deleted."""
     '''The function deletes the entire row if either the PM10 or PM2.5 value is missing.'''
@@ -20,56 +28,287 @@ def remove_missing(df):
     
     miss = np.any([pd.isna(df['measurement_PM10']),pd.isna(df['measurement_PM2.5'])],axis = 0)
     n_miss = miss.sum()
-    print(n_miss,"observations with missing values were removed from the data frame")
+    Instrumentation.logger.info("%d observations with missing values were removed from the data frame", n_miss)
     return df[miss == False]    
 
 
 # check for outliers and filter those using different methods
-def remove_outliers(df,method = "Z-score", z_val = 2.58, crit_val = [0,100], quantile = [0,0.99]):
+@Instrumentation.timed()
+def remove_outliers(df,method = "Z-score", z_val = 2.58, crit_val = [0,100], quantile = [0,0.99], window = "3h"):
     '''function to remove outliers following a selected method'''
     '''deletes entire row in case either Pm10 or PM2.5 values is an outlier'''
     
     '''INPUTS:'''
     
     '''df:                         Pandas Data Frame'''
-    '''method:                     A string indicating which method to use for filtering the data possible options: Z-score, critical_value, quantile'''
+    '''method:                     A string indicating which method to use for filtering the data possible options: Z-score, critical_value, quantile,'''
+    '''                            sensor_robust_Z (robust Z-score per sensor: 0.6745 * (x - median) / MAD of the sensor),'''
+    '''                            sensor_rolling_Z (Z-score of every value against the mean and standard deviation of the other values of the same'''
+    '''                            sensor within +/- window / 2, so that the baseline follows the diurnal cycle). Both need sensor_id and time columns'''
     '''z_val:                      Z-value, default is 2.58 (only standardised values between -1.96 and 1.96 are kept). type = byte.'''
     '''crit_val:                   List of lower and upper bound to filter values. Type: list, default: [0,100]'''
     '''quantile:                   List of lower and upper quantile to filter values. Type: list, default: [0,0.95]'''
+    '''window:                     Length of the rolling window for sensor_rolling_Z, e.g. 1h, 3h, 1D. Type: string, default: 3h'''
     
     '''OUTPUTS:'''
     
     '''Pandas data frame without outliers. Prints out how many observations were removed'''
-    measurement = df[['measurement_PM10','measurement_PM2.5']]
+    if method not in ["Z-score", "critical_value", "quantile", "sensor_robust_Z", "sensor_rolling_Z"]:
+        raise ValueError("method must be one of Z-score, critical_value, quantile, sensor_robust_Z, sensor_rolling_Z")
+    measurement = df[MEASUREMENTS]
     
     if method == "Z-score":
         mean = measurement.mean()
         sd = measurement.std()
-        z_score = (measurement - mean)/sd
-        exclude_PM10 = np.any([z_score['measurement_PM10'] < -z_val, z_score['measurement_PM10'] > z_val],axis = 0)
-        exclude_PM25 = np.any([z_score['measurement_PM2.5'] < -z_val, z_score['measurement_PM2.5'] > z_val],axis = 0)
+        lower, upper = (mean - z_val * sd).values, (mean + z_val * sd).values                 # |z| > z_val is the same as lying outside mean +/- z_val * sd
     
     if method == "critical_value":
         if len(crit_val) < 2:
-            print("ERROR: please provide a lower and an upper bound")
+            Instrumentation.logger.error("please provide a lower and an upper bound")
             return
         if len(crit_val) > 2:
             warnings.warn("Only first two elements of crit_val will be used!")
-        exclude_PM10 = np.any([measurement['measurement_PM10'] < crit_val[0], measurement['measurement_PM10'] > crit_val[1]],axis = 0)
-        exclude_PM25 = np.any([measurement['measurement_PM2.5'] < crit_val[0], measurement['measurement_PM2.5'] > crit_val[1]],axis = 0)
+        lower, upper = np.repeat(crit_val[0], 2), np.repeat(crit_val[1], 2)
         
     if method == "quantile":
         if len(quantile) < 2:
-            print("ERROR: please provide a lower and an upper quantile")
+            Instrumentation.logger.error("please provide a lower and an upper quantile")
             return 
         if len(quantile) > 2:
             warnings.warn("Only first two elements of quantile will be used!")
-        upper = measurement.quantile(quantile[1])
-        lower = measurement.quantile(quantile[0])
-        exclude_PM10 = np.any([measurement['measurement_PM10'] < lower[0], measurement['measurement_PM10'] > upper[0]],axis = 0)
-        exclude_PM25 = np.any([measurement['measurement_PM2.5'] < lower[1], measurement['measurement_PM2.5'] > upper[1]],axis = 0)
+        upper = measurement.quantile(quantile[1]).values                                       # one bound per column, in the order of MEASUREMENTS
+        lower = measurement.quantile(quantile[0]).values
+    
+    if method in ["sensor_robust_Z", "sensor_rolling_Z"]:
+        if not "sensor_id" in df:
+            raise NameError("There is no column named sensor_id in df -- need a column named sensor_id!")
+        if method == "sensor_robust_Z":
+            lower, upper = _sensor_robust_bounds(df["sensor_id"].values, measurement.values, z_val)         # one bound per row and column
+        else:
+            if not "time" in df:
+                raise NameError("There is no column named time in df -- need a column named time!")
+            lower, upper = _sensor_rolling_bounds(df["sensor_id"].values, Load_Data.time_column(df).values,
+                                                  measurement.values, z_val, pd.Timedelta(window))
             
-    exclude = np.any([exclude_PM10 == True, exclude_PM25 == True],axis = 0)
+    exclude = _outside(measurement.values, lower, upper)
     n_excluded = exclude.sum()
-    print(n_excluded,"outlier observations were deleted")
+    Instrumentation.logger.info("%d outlier observations were deleted", n_excluded)
     return df[exclude == False]
+
+
+def remove_outliers_stream(chunks, method = "Z-score", z_val = 2.58, crit_val = [0,100], quantile = [0,0.99],
+                           baseline = "two_pass", window = None, drop_missing = True, compression = Stream_Stats.DEFAULT_COMPRESSION):
+    '''Removes outliers from data that arrives in chunks (e.g. load_data(..., chunksize = ...)), without holding all data in memory'''
+    '''Same methods as remove_outliers. The mean and standard deviation are kept as running moments (Welford), quantiles as a mergeable t-digest sketch'''
+    '''Tolerance: the Z-score and critical_value bounds equal those of remove_outliers up to floating point. The quantile bounds are approximate,'''
+    '''for the default compression of 200 they lie within about 0.05 percentile ranks of the exact quantiles, so in the two_pass mode'''
+    '''about 0.01 - 0.05 % of the rows are decided differently than by remove_outliers (see benchmarks/stream_filter.py). If the values'''
+    '''have many ties (e.g. readings rounded to integers) all rows of the tie at the bound may be decided differently'''
+    
+    '''INPUTS:'''
+    
+    '''chunks:                     Data frames with the columns of load_data. For baseline = "two_pass" the data is read twice, chunks must then be'''
+    '''                            a list or a function returning a new iterator of the chunks (e.g. lambda: load_data(..., chunksize = 100000),'''
+    '''                            the second call is answered from the query cache)'''
+    '''method:                     A string indicating which method to use for filtering the data possible options: Z-score, critical_value, quantile'''
+    '''z_val:                      Z-value, default is 2.58'''
+    '''crit_val:                   List of lower and upper bound to filter values. Type: list, default: [0,100]'''
+    '''quantile:                   List of lower and upper quantile to filter values. Type: list, default: [0,0.99]'''
+    '''baseline:                   "two_pass": the bounds are computed from all data in a first pass and applied in a second pass.'''
+    '''                            "window": one pass, every chunk is filtered with the bounds of the data up to and including this chunk'''
+    '''                            (or of the last window chunks). The first chunks are then filtered with a shorter baseline'''
+    '''window:                     Number of chunks of the baseline for baseline = "window", type: int, default: None (all chunks so far)'''
+    '''drop_missing:               If True, rows with missing PM10 or PM2.5 values are removed in the same pass (as remove_missing)'''
+    '''compression:                Size parameter of the t-digest, type: int, default: 200'''
+    
+    '''OUTPUTS:'''
+    
+    '''Generator of the filtered chunks. Prints out how many observations were removed once all chunks are consumed'''
+    
+    '''Defensive programming'''
+    if method not in ["Z-score", "critical_value", "quantile"]:
+        raise ValueError("method must be one of Z-score, critical_value, quantile")
+    if baseline not in ["two_pass", "window"]:
+        raise ValueError("baseline must be two_pass or window")
+    if window is not None and (not isinstance(window, int) or window < 1):
+        raise ValueError("window must be a positive integer")
+    if method == "critical_value" and len(crit_val) < 2:
+        raise ValueError("please provide a lower and an upper bound")
+    if method == "quantile" and len(quantile) < 2:
+        raise ValueError("please provide a lower and an upper quantile")
+    if method == "critical_value" and len(crit_val) > 2:
+        warnings.warn("Only first two elements of crit_val will be used!")
+    if method == "quantile" and len(quantile) > 2:
+        warnings.warn("Only first two elements of quantile will be used!")
+    if baseline == "two_pass" and method != "critical_value" and not (callable(chunks) or isinstance(chunks, (list, tuple))):
+        raise TypeError("for baseline = two_pass chunks must be a list or a function returning an iterator of the chunks")
+    
+    def read():
+        return chunks() if callable(chunks) else chunks
+    
+    def summarise(values):                                                                      # mergeable summary of one chunk
+        return outlier_summary(values, method, compression)
+    
+    def merge(summaries):
+        return merge_outlier_summaries(summaries, method, compression)
+    
+    def bounds(summary):
+        return outlier_bounds(summary, method, z_val, crit_val, quantile)
+    
+    def generator():
+        n_miss, n_excluded = 0, 0
+        
+        if baseline == "two_pass" and method != "critical_value":                              # first pass: the summary of all data
+            summaries = []
+            for df in read():
+                values = df[MEASUREMENTS].values.astype(np.float64)
+                if drop_missing:
+                    values = values[~np.isnan(values).any(axis = 1)]
+                summaries.append(summarise(values))
+            summary = merge(summaries)
+            lower, upper = bounds(summary)
+        elif method == "critical_value":
+            lower, upper = bounds(None)
+        
+        recent = collections.deque(maxlen = window)
+        for df in read():
+            values = df[MEASUREMENTS].values.astype(np.float64)
+            miss = np.isnan(values).any(axis = 1) if drop_missing else np.zeros(len(df), dtype = bool)
+            if baseline == "window" and method != "critical_value":
+                recent.append(summarise(values[~miss]))
+                lower, upper = bounds(merge(recent))
+            exclude = _outside(values, lower, upper)
+            n_miss += miss.sum()
+            n_excluded += (exclude & ~miss).sum()
+            yield df[~(miss | exclude)]
+        
+        if drop_missing:
+            Instrumentation.logger.info("%d observations with missing values were removed from the data frame", n_miss)
+        Instrumentation.logger.info("%d outlier observations were deleted", n_excluded)
+    
+    return generator()
+
+
+# keep the measurements of the sensors within an area
+@Instrumentation.timed()
+def filter_area(df, registry, lat_start = None, lat_end = None, long_start = None, long_end = None, center = None, radius_km = None):
+    '''Keeps the rows of the sensors within a bounding box or a radius, the area is looked up per sensor in the grid index of
+    a sensor registry and the rows are then selected by sensor_id, so df does not need the lat and lon columns'''
+
+    '''INPUTS:'''
+
+    '''df:                         Pandas Data Frame with the column sensor_id'''
+    '''registry:                   sensor registry out of Sensor_Registry.build_registry'''
+    '''lat_start, lat_end, long_start, long_end:  bounding box (borders included)'''
+    '''center, radius_km:          alternatively (lat, lon) and the distance in km, type: tuple and float'''
+
+    '''OUTPUTS:'''
+
+    '''Pandas data frame with the rows of the sensors in the area'''
+    if center is not None:
+        if radius_km is None:
+            raise ValueError("radius_km is needed together with center")
+        sensor_ids = Sensor_Registry.within_radius(registry, center[0], center[1], radius_km)
+    elif None in [lat_start, lat_end, long_start, long_end]:
+        raise ValueError("either the bounding box or center and radius_km must be given")
+    else:
+        sensor_ids = Sensor_Registry.in_bbox(registry, lat_start, lat_end, long_start, long_end)
+    return df[np.isin(df["sensor_id"].values, sensor_ids)]
+
+
+def outlier_summary(values, method = "Z-score", compression = Stream_Stats.DEFAULT_COMPRESSION):
+    '''mergeable summary of the PM10 and PM2.5 values (2d array) of one chunk: running moments for Z-score, t-digests for quantile'''
+    if method == "Z-score":
+        return Stream_Stats.moments(values)
+    if method == "quantile":
+        return [Stream_Stats.digest(values[:, j], compression) for j in range(values.shape[1])]
+    return None                                                                                 # critical_value needs no summary
+
+
+def merge_outlier_summaries(summaries, method = "Z-score", compression = Stream_Stats.DEFAULT_COMPRESSION):
+    '''merges the summaries of several chunks (outlier_summary) into the summary of all of them'''
+    if method == "Z-score":
+        merged = None
+        for summary in summaries:
+            merged = Stream_Stats.merge_moments(merged, summary)
+        return merged
+    if method == "quantile":
+        return [Stream_Stats.merge_digests([s[j] for s in summaries], compression) for j in range(len(MEASUREMENTS))]
+    return None
+
+
+def outlier_bounds(summary, method = "Z-score", z_val = 2.58, crit_val = [0,100], quantile = [0,0.99]):
+    '''lower and upper bound of PM10 and PM2.5 (arrays in the order of MEASUREMENTS) from a merged summary'''
+    if method == "critical_value":
+        return np.repeat(crit_val[0], 2), np.repeat(crit_val[1], 2)
+    if method == "Z-score":
+        sd = Stream_Stats.std(summary)
+        return summary["mean"] - z_val * sd, summary["mean"] + z_val * sd
+    return (np.array([Stream_Stats.digest_quantile(d, quantile[0]) for d in summary]),
+            np.array([Stream_Stats.digest_quantile(d, quantile[1]) for d in summary]))
+
+
+def apply_bounds(df, lower, upper, drop_missing = True):
+    '''removes the rows of df outside of the bounds of outlier_bounds (and the rows with missing values if drop_missing),
+    returns the kept rows and the number of removed missing and outlier rows'''
+    values = df[MEASUREMENTS].values.astype(np.float64)
+    miss = np.isnan(values).any(axis = 1) if drop_missing else np.zeros(len(df), dtype = bool)
+    exclude = _outside(values, lower, upper)
+    return df[~(miss | exclude)], int(miss.sum()), int((exclude & ~miss).sum())
+
+
+def _outside(values, lower, upper):
+    '''True for every row where one of the measurements lies outside of its [lower, upper] bound (NaN values are never outside)'''
+    with np.errstate(invalid = "ignore"):
+        return ((values < lower) | (values > upper)).any(axis = 1)
+
+
+def _sensor_robust_bounds(sensor_id, values, z_val):
+    '''bounds median +/- z_val * scale per sensor, with scale = MAD / 0.6745. All sensors are handled by the grouped median kernels of pandas.
+    If more than half of the values of a sensor are equal (MAD = 0), the mean absolute deviation * 1.2533 is used as scale instead'''
+    frame = pd.DataFrame(values, copy = False)
+    groups = frame.groupby(sensor_id, sort = False)
+    median = groups.transform("median").values
+    deviation = pd.DataFrame(np.abs(values - median), copy = False).groupby(sensor_id, sort = False)
+    scale = deviation.transform("median").values / 0.6745
+    scale = np.where(scale > 0, scale, deviation.transform("mean").values * 1.2533)
+    return median - z_val * scale, median + z_val * scale
+
+
+def _sensor_rolling_bounds(sensor_id, time, values, z_val, window):
+    '''bounds mean +/- z_val * sd of the other values of the same sensor within +/- window / 2 around every value.
+    The data is sorted once by sensor and time, the window sums are differences of cumulative sums and the window edges
+    are found for all rows at once by a binary search on a combined (sensor, time) key. The key holds the rank of the time
+    among all times instead of the time itself, so it fits into int64 for any number of sensors and any time span'''
+    codes = pd.factorize(sensor_id)[0].astype(np.int64)
+    t = time.astype("datetime64[ns]").astype(np.int64)
+    t = t - t.min() if len(t) else t
+    half = window.value // 2
+    order = np.lexsort((t, codes))
+    codes_sorted, t = codes[order], t[order]
+    times = np.sort(t)
+    base = codes_sorted * (len(times) + 1)                                                       # the window of a value never reaches into the next sensor
+    key = base + np.searchsorted(times, t, side = "left")                                        # rank of a time: the number of smaller times
+    start = np.searchsorted(key, base + np.searchsorted(times, t - half, side = "left"), side = "left")
+    end = np.searchsorted(key, base + np.searchsorted(times, t + half, side = "right"), side = "left")
+
+    lower = np.empty(values.shape)
+    upper = np.empty(values.shape)
+    for j in range(values.shape[1]):
+        x = values[order, j].astype(np.float64)
+        valid = ~np.isnan(x)
+        centre = pd.Series(np.where(valid, x, 0)).groupby(codes[order]).transform("mean").values    # centred per sensor to keep the cumulative sums accurate
+        x0 = np.where(valid, x - centre, 0)
+        cum_n = np.r_[0, np.cumsum(valid)]
+        cum_s = np.r_[0, np.cumsum(x0)]
+        cum_ss = np.r_[0, np.cumsum(x0 ** 2)]
+        n = cum_n[end] - cum_n[start] - valid                                                     # leave the value itself out of its baseline
+        s = cum_s[end] - cum_s[start] - x0
+        ss = cum_ss[end] - cum_ss[start] - x0 ** 2
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            mean = s / n
+            sd = np.sqrt(np.maximum(ss - n * mean ** 2, 0) / (n - 1))
+        sd = np.where(n > 1, sd, np.nan)                                                          # fewer than two other values: never an outlier
+        lower[order, j] = centre + mean - z_val * sd
+        upper[order, j] = centre + mean + z_val * sd
+    return lower, upper
@@ -0,0 +1,275 @@
+import cProfile
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import pandas as pd
+try:
+    import resource                     # not available on Windows, the process peak memory is then left out
+except ImportError:
+    resource = None
+
+logger = logging.getLogger("hal_pm")    # all messages of hal_pm, use configure or the logging module to change where they go
+logger.addHandler(logging.NullHandler())    # a library does not print unless the application asks for it (main.py calls configure)
+
+_settings = {"metrics_path": None, "profile": set(), "profile_dir": "profiles", "allocations": set(), "memory": False,
+             "started_tracing": False}
+_records = collections.deque(maxlen = 100000)     # stage records of this process (the newest ones in long running live mode), see metrics()
+_counters = {}                          # running totals of the process added by count() from any thread, e.g. bytes_fetched
+_lock = threading.Lock()
+_local = threading.local()              # stack of the open stages of a thread
+
+
+class _StdoutHandler(logging.StreamHandler):
+    '''writes to the current sys.stdout, so that contextlib.redirect_stdout also catches the messages (as it caught the former prints)'''
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class JsonFormatter(logging.Formatter):
+    '''formats every log record as one JSON object per line, the metrics of a stage are included under metrics'''
+
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name, "message": record.getMessage()}
+        if hasattr(record, "metrics"):
+            entry["metrics"] = record.metrics
+        return json.dumps(entry, default = str)
+
+
+def configure(level = "INFO", json_logs = False, log_path = None, metrics_path = None, memory = False, profile = None,
+              profile_dir = "profiles", allocations = None):
+    '''Configures the logger and the instrumentation of hal_pm'''
+
+    '''INPUT:'''
+
+    '''level:           level of the messages, INFO shows what the former prints showed, DEBUG adds one message per stage'''
+    '''                 with its metrics, WARNING only warnings, type: str or int, default: INFO'''
+    '''json_logs:       if True, the messages are written as JSON lines (structured logs), default: False (plain text)'''
+    '''log_path:        file the messages are written to, default: None (standard output)'''
+    '''metrics_path:    JSON lines file, the metrics of every stage are appended to it, default: None'''
+    '''memory:          if True, tracemalloc is started and the peak of the memory allocated in every stage is recorded (peak_mb).'''
+    '''                 This slows numpy and pandas down a little, default: False (only the peak of the process, max_rss_mb)'''
+    '''profile:         names of the stages that are run under cProfile, or True for all stages. The profiles are written to'''
+    '''                 profile_dir/<stage>_<time>.prof (read them with pstats or snakeviz), default: None'''
+    '''allocations:     names of the stages whose ten largest allocation sites (tracemalloc) are added to their record, or True'''
+    '''                 for all stages, implies memory = True, default: None'''
+
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.FileHandler(log_path) if log_path is not None else _StdoutHandler()
+    handler.setFormatter(JsonFormatter() if json_logs else logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+    _settings["metrics_path"] = metrics_path
+    _settings["profile"] = True if profile is True else set(profile or [])
+    _settings["profile_dir"] = profile_dir
+    _settings["allocations"] = True if allocations is True else set(allocations or [])
+    _settings["memory"] = memory or bool(_settings["allocations"])
+    if _settings["memory"] and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _settings["started_tracing"] = True
+    elif not _settings["memory"] and _settings.get("started_tracing"):                      # a trace started by someone else keeps running
+        tracemalloc.stop()
+        _settings["started_tracing"] = False
+
+
+@contextlib.contextmanager
+def stage(name, rows_in = None, **fields):
+    '''Records one stage of the pipeline'''
+
+    '''INPUT:'''
+
+    '''name:            name of the stage, nested stages are recorded as outer/inner'''
+    '''rows_in:         number of input rows (or a data frame)'''
+    '''fields:          further values for the record'''
+
+    '''OUTPUT:'''
+
+    '''the record (dictionary) of the stage, the stage can set rows_out and other values in it. On exit the record gets the'''
+    '''wall time (seconds), what was added to every counter of count() within the stage (e.g. bytes_fetched, http_seconds,'''
+    '''from this thread and from workers started with bind), the peak memory and is logged (DEBUG), appended to the metrics'''
+    '''file and kept for metrics()'''
+
+    stack = _stack()
+    tracing = _settings["memory"] and tracemalloc.is_tracing()                                  # the peak of a trace of others is not reset
+    path = "/".join([s["stage"] for s in stack] + [name])
+    record = dict(fields, stage = path, rows_in = _rows(rows_in), rows_out = None)
+    if stack and tracing and _is_open(stack[-1]):
+        stack[-1]["_peak"] = max(stack[-1].get("_peak", 0), tracemalloc.get_traced_memory()[1])   # keep the peak of the outer stage before it is reset
+    if tracing:
+        tracemalloc.reset_peak()
+    profiled = any(s.get("_profiled") for s in stack)                                           # only one profiler can run at a time
+    profiler = cProfile.Profile() if _selected(_settings["profile"], name) and not profiled else None
+    record["_counts"] = {}                                                                      # filled by count() while the stage is open
+    record["_peak"] = 0
+    record["_profiled"] = profiler is not None or profiled
+    stack.append(record)
+    started = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record["seconds"] = round(time.perf_counter() - started, 6)
+        stack.pop()
+        record["rows_out"] = _rows(record["rows_out"])
+        with _lock:
+            record.update({key: value for key, value in record.pop("_counts").items() if value != 0})
+        peak = record.pop("_peak")
+        record.pop("_profiled")
+        if tracing:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            record["peak_mb"] = round(peak / 1024**2, 3)
+            if stack and _is_open(stack[-1]):
+                stack[-1]["_peak"] = max(stack[-1].get("_peak", 0), peak)
+            if _selected(_settings["allocations"], name):
+                statistics = tracemalloc.take_snapshot().statistics("lineno")[:10]
+                record["top_allocations"] = [{"line": str(s.traceback), "mb": round(s.size / 1024**2, 3)} for s in statistics]
+        if resource is not None:
+            scale = 1 if sys.platform == "darwin" else 1024                                  # ru_maxrss is in bytes on macOS, in kB on Linux
+            record["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1024**2, 1)
+        if profiler is not None:
+            os.makedirs(_settings["profile_dir"], exist_ok = True)
+            record["profile"] = os.path.join(_settings["profile_dir"], path.replace("/", "_") + "_" + str(time.time_ns()) + ".prof")
+            profiler.dump_stats(record["profile"])
+        _emit(record)
+
+
+def timed(name = None, rows_out = True):
+    '''Decorator that records every call of a function as a stage, the input rows are taken from a data frame as first argument
+    and the output rows from a data frame as result (if rows_out)'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name or function.__name__, rows_in = args[0] if args else None) as record:
+                result = function(*args, **kwargs)
+                if rows_out and isinstance(result, pd.DataFrame):
+                    record["rows_out"] = len(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def count(counter, value = 1):
+    '''adds value to a counter, and to the open stages of the calling thread (see bind for worker threads)'''
+    with _lock:
+        _counters[counter] = _counters.get(counter, 0) + value
+        for record in _stack():
+            if _is_open(record):
+                record["_counts"][counter] = record["_counts"].get(counter, 0) + value
+
+
+def bind(function):
+    '''wraps function so that it runs within the stages that are open in the calling thread, e.g. for a thread pool:
+    pool.submit(Instrumentation.bind(f), ...). The counters and the nested stages of the worker then belong to those stages'''
+    parents = list(_stack())
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        stack = _stack()
+        former = list(stack)
+        stack[:] = parents
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stack[:] = former
+    return wrapper
+
+
+@contextlib.contextmanager
+def counted(counter):
+    '''adds the seconds spent in the with block to the counter <counter>_seconds'''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        count(counter + "_seconds", time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def quiet(level = logging.WARNING):
+    '''only messages of at least level are shown in the with block'''
+    former = logger.level
+    logger.setLevel(level)
+    try:
+        yield
+    finally:
+        logger.setLevel(former)
+
+
+def metrics():
+    '''data frame of the stage records of this process (one row per stage, in the order the stages ended)'''
+    with _lock:
+        return pd.DataFrame(list(_records))
+
+
+def summary():
+    '''total, mean and maximum time, the number of calls and the rows per stage'''
+    df = metrics()
+    if len(df) == 0:
+        return df
+    columns = {"seconds": ["count", "sum", "mean", "max"]}
+    for column in ["rows_in", "rows_out", "bytes_fetched", "peak_mb"]:
+        if column in df:
+            columns[column] = ["sum"] if column != "peak_mb" else ["max"]
+    return df.groupby("stage").agg(columns).sort_values(("seconds", "sum"), ascending = False)
+
+
+def reset():
+    '''forgets the stage records and the counters'''
+    with _lock:
+        _records.clear()
+        _counters.clear()
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def _is_open(record):
+    return "_counts" in record
+
+
+def _rows(value):
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, dict):                     # e.g. a cube, its length is the number of its fields
+        return None
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def _selected(setting, name):
+    return setting is True or name in setting
+
+
+def _emit(record):
+    with _lock:
+        _records.append(record)
+        if _settings["metrics_path"] is not None:
+            with open(_settings["metrics_path"], "a") as f:
+                f.write(json.dumps(record, default = str) + "\n")
+    if logger.isEnabledFor(logging.DEBUG):
+        text = ", ".join(key + " = " + str(value) for key, value in record.items() if key not in ["stage", "top_allocations"] and value is not None)
+        logger.debug(record["stage"] + ": " + text, extra = {"metrics": record})
+
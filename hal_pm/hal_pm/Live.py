@@ -0,0 +1,187 @@
+from datetime import datetime, timezone
+import collections
+import os
+import time
+import numpy as np
+import pandas as pd
+from hal_pm import Load_Data
+from hal_pm import Filter_Data
+from hal_pm import Descriptive_Stats
+from hal_pm import Plot_Mean
+from hal_pm import Time_Plots
+from hal_pm import Map
+from hal_pm import Boundaries
+from hal_pm import Time_Cube
+from hal_pm import Render
+from hal_pm import Instrumentation
+
+MEASUREMENTS = Filter_Data.MEASUREMENTS
+
+
+def new_region(lat_start, lat_end, long_start, long_end, window_hours, name = None, method = "Z-score", z_val = 2.58,
+               crit_val = [0,100], quantile = [0,0.99], base_interval = "1Min", k = 1, geo_boundaries = None,
+               base_url = Load_Data.BASE_URL, cache = True):
+    '''Creates the state of a live region, whose trailing time window is kept up to date by refresh'''
+
+    '''INPUT:'''
+
+    '''lat_start, lat_end, long_start, long_end:  bounding box of the region'''
+    '''window_hours:    length of the trailing time window, type: int or float'''
+    '''name:            name of the region (its output directory in watch), default: the bounding box'''
+    '''method:          outlier filter, Z-score, critical_value or quantile (see Filter_Data.remove_outliers_stream). The bounds are'''
+    '''                 computed from the measurements of the window and applied to the new measurements, rows that were'''
+    '''                 accepted once are not filtered again'''
+    '''z_val, crit_val, quantile:  parameters of the filter'''
+    '''base_interval:   time bins of the cube, the extremes and the expiry, type: str, default: 1Min'''
+    '''k:               number of maxima per measurement, type: int, default: 1'''
+    '''geo_boundaries:  geojson file for the maps, default: None (no maps)'''
+    '''base_url:        url of the REST-API (or of a Replay_Server)'''
+    '''cache:           if True, the parsed boundaries are kept in their disk cache (see Boundaries.load_boundaries)'''
+
+    '''OUTPUT:'''
+
+    '''dictionary with the region, the time of the newest ingested measurement (last, None before the first refresh), the cube'''
+    '''of the window, the maxima per time bin (extremes), the maxima of the window (maxima) and the filter summaries'''
+
+    # Defensive programming
+    if not (isinstance(window_hours, float) or isinstance(window_hours, int)) or window_hours <= 0:
+        raise ValueError("window_hours must be a positive number")
+    if method not in ["Z-score", "critical_value", "quantile"]:
+        raise ValueError("method must be one of Z-score, critical_value, quantile")
+    if not isinstance(k, int) or k < 1:
+        raise ValueError("k needs to be a positive integer")
+    if geo_boundaries is not None and not isinstance(geo_boundaries, str):
+        raise TypeError("geo_boundaries must be a file path as string")
+
+    return {"name": name if name is not None else "_".join(str(c) for c in [lat_start, lat_end, long_start, long_end]),
+            "bbox": (lat_start, lat_end, long_start, long_end), "window": pd.Timedelta(hours = window_hours),
+            "method": method, "z_val": z_val, "crit_val": crit_val, "quantile": quantile, "base_interval": base_interval, "k": k,
+            "geo_boundaries": geo_boundaries, "base_url": base_url, "cache": cache,
+            "last": None, "cube": None, "summaries": collections.deque(), "extremes": {}, "maxima": None}
+
+
+@Instrumentation.timed(rows_out = False)
+def refresh(state, now = None):
+    '''Brings a live region up to now: fetches only the measurements after the last refresh, filters them, adds them to the cube'''
+    '''and the extremes and removes everything that fell out of the window. The first refresh loads the whole window'''
+    '''The cost of a refresh grows with the new measurements (and the number of time bins of the window), not with the rows of the window.'''
+    '''Measurements that reach the REST-API after a refresh that already covered their time are not fetched anymore'''
+
+    '''INPUT:'''
+
+    '''state:           state out of new_region, updated in place'''
+    '''now:             end of the window, default: the current UTC time'''
+
+    '''OUTPUT:'''
+
+    '''dictionary of what changed: the number of fetched, kept, missing and outlier rows, the number of expired cube cells,'''
+    '''cube (True if the cube changed) and extremes (True if the maxima of the window changed)'''
+
+    now = pd.Timestamp(datetime.now(timezone.utc).replace(tzinfo = None) if now is None else now)
+    start = now - state["window"]
+    since = start if state["last"] is None or state["last"] < start else state["last"]
+    changes = {"fetched": 0, "kept": 0, "missing": 0, "outliers": 0, "expired": 0, "cube": False, "extremes": False}
+    if now <= since:
+        return changes
+
+    # 1. only the measurements after the last refresh are fetched (not aligned to the query cache, which would fetch whole slices)
+    delta = Load_Data.load_data(*state["bbox"], since.to_pydatetime(), (now - since).total_seconds() / 3600,
+                                base_url = state["base_url"], cache = False)
+    if state["last"] is not None:
+        delta = delta[delta["time"] > state["last"]]                                    # load_data keeps the measurements on both borders
+    state["last"] = now
+    changes["fetched"] = len(delta)
+
+    # 2. filter: the bounds come from the summaries of the measurements in the window, including the new ones
+    complete = delta[MEASUREMENTS].values.astype(np.float64)
+    complete = complete[~np.isnan(complete).any(axis = 1)]
+    state["summaries"].append((now, Filter_Data.outlier_summary(complete, state["method"])))
+    summary = Filter_Data.merge_outlier_summaries([s for _, s in state["summaries"]], state["method"])
+    lower, upper = Filter_Data.outlier_bounds(summary, state["method"], state["z_val"], state["crit_val"], state["quantile"])
+    kept, changes["missing"], changes["outliers"] = Filter_Data.apply_bounds(delta, lower, upper)
+    changes["kept"] = len(kept)
+
+    # 3. aggregates: the new rows are added to the cube, the maxima are kept per time bin so that they can expire with the bins
+    if len(kept) > 0:
+        if state["cube"] is None:
+            state["cube"] = Time_Cube.build_cube(kept, base_interval = state["base_interval"])
+        else:
+            state["cube"] = Time_Cube.append(state["cube"], kept)
+        for m in MEASUREMENTS:
+            new = Descriptive_Stats.top_k(kept, k = state["k"], measurement = m, by = "time", time_interval = state["base_interval"])
+            state["extremes"][m] = Descriptive_Stats.merge_top_k([state["extremes"].get(m), new], k = state["k"], measurement = m,
+                                                                 by = "time", time_interval = state["base_interval"])
+        changes["cube"] = True
+
+    # 4. expiry: bins that ended before the start of the window, and the filter summaries of refreshes before the window
+    while len(state["summaries"]) > 1 and state["summaries"][0][0] <= start:
+        state["summaries"].popleft()
+    if state["cube"] is not None:
+        n_cells = len(state["cube"]["cells"])
+        state["cube"] = Time_Cube.expire(state["cube"], start)
+        changes["expired"] = n_cells - len(state["cube"]["cells"])
+        changes["cube"] = changes["cube"] or changes["expired"] > 0
+        first_bin = start.floor(state["base_interval"])
+        for m in state["extremes"]:
+            extremes = state["extremes"][m]
+            state["extremes"][m] = extremes[extremes["time"] >= first_bin]
+
+    # 5. the maxima of the window are the maxima of the per bin maxima
+    parts = []
+    for m, label in [("measurement_PM10", "max PM10"), ("measurement_PM2.5", "max PM2.5")]:
+        part = Descriptive_Stats.merge_top_k([state["extremes"].get(m)], k = state["k"], measurement = m)
+        if part is not None:
+            parts.append(part.assign(label = label))
+    maxima = pd.concat(parts, ignore_index = True) if len(parts) > 0 else None
+    changes["extremes"] = not _same_frame(maxima, state["maxima"])
+    state["maxima"] = maxima
+    return changes
+
+
+@Instrumentation.timed("live_render", rows_out = False)
+def render(state, changes, out_dir = "."):
+    '''Writes the outputs of a live region whose inputs changed in the last refresh: maxima.csv if the maxima changed,'''
+    '''the mean plot, the time plots and the maps if the cube changed. Returns the list of the written files'''
+    os.makedirs(out_dir, exist_ok = True)
+    written = []
+    if changes["extremes"] and state["maxima"] is not None:
+        path = os.path.join(out_dir, "maxima.csv")
+        state["maxima"].drop(columns = ["rank"]).to_csv(path, index = False)
+        written.append(path)
+    if changes["cube"] and state["cube"] is not None and len(state["cube"]["cells"]) > 0:
+        tasks = [{"function": Plot_Mean.plot_mean_pm, "args": (state["cube"],), "figure": {"figsize": (20, 20)},
+                  "path": os.path.join(out_dir, 'plot_mean.png')},
+                 {"function": Time_Plots.plot_average_pol, "args": (state["cube"],), "figure": {"nrows": 2, "ncols": 2, "figsize": (20, 20)},
+                  "path": os.path.join(out_dir, 'maxplots.png')}]
+        written += Render.render_all(tasks, max_workers = 1)
+        if state["geo_boundaries"] is not None:
+            pm_maps = Map.map_data(state["cube"], state["geo_boundaries"], measurement_type = MEASUREMENTS, compact = True, out_dir = out_dir,
+                                   cache_dir = Boundaries.DEFAULT_CACHE_DIR if state.get("cache", True) else None)
+            written += [os.path.join(out_dir, "index_" + m[m.find("_")+1:] + ".html") for m in pm_maps]
+    return written
+
+
+def watch(states, out_dir = "live", every_seconds = 300, refreshes = None):
+    '''Refreshes and renders several live regions every every_seconds seconds, each region writes to out_dir/<name>'''
+
+    '''INPUT:'''
+
+    '''states:          list of states out of new_region'''
+    '''refreshes:       number of refreshes, default: None (until interrupted)'''
+
+    n = 0
+    while refreshes is None or n < refreshes:
+        started = time.perf_counter()
+        for state in states:
+            changes = refresh(state)
+            written = render(state, changes, os.path.join(out_dir, state["name"]))
+            Instrumentation.logger.info("%s: %d new rows, %d expired cells, %d files written", state["name"], changes["kept"], changes["expired"], len(written))
+        n += 1
+        if refreshes is None or n < refreshes:
+            time.sleep(max(0, every_seconds - (time.perf_counter() - started)))
+
+
+def _same_frame(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    return a.shape == b.shape and a.reset_index(drop = True).equals(b.reset_index(drop = True))
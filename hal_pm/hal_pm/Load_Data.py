@@ -1,23 +1,73 @@
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import codecs
+import json
 from datetime import datetime, timedelta
+import time
+import numpy as np
 import pandas as pd
+from hal_pm import Query_Cache
+from hal_pm import Instrumentation
+from hal_pm import Measurement_Store
 
-def load_data(lat_start, lat_end, long_start, long_end, start_datetime, delta_hours):
+BASE_URL = 'http://sensordata.gwdg.de/api/'
+ENDPOINTS = {'P1': 'measurements/P1',          # P1 endpoint (PM10)
+             'P2': 'measurements/P2'}          # P2 endpoint (PM2.5)
+STREAM_CHUNKSIZE = 100000                      # rows per column buffer when streaming
+
+# canonical compact schema of the merged PM frame, applied once at load time
+SCHEMA = {"measurement_PM10": "float32",
+          "measurement_PM2.5": "float32",
+          "time": "datetime64[ns]",
+          "lat": "float32",
+          "lon": "float32",
+          "sensor_id": "int32"}
+
+
+def load_data(lat_start, lat_end, long_start, long_end, start_datetime, delta_hours,
+              slice_hours = 6, tile_deg = 1, max_workers = 8, retries = 3, backoff = 1, base_url = BASE_URL,
+              measurement_id = False, cache = True, cache_dir = Query_Cache.DEFAULT_CACHE_DIR,
+              cache_size_mb = Query_Cache.DEFAULT_SIZE_MB, stream = False, chunksize = None, store = None):
     '''Function for loading the data out of the REST-API'''
-    
+
     '''INPUT:'''
-    
+
     '''lat_start:                          latitude range starting point, type: byte'''
     '''lat_end:                            latitude range ending point, type: byte'''
     '''long_start:                         longitude range starting point, type: byte'''
     '''long_end:                           longitude range ending point, type: byte'''
     '''start_year, start_month, start_day: year / month / day of the measurement to start, type: byte'''
     '''delta_hours:                        time delta to calculate time space of measurement, type: byte'''
-    
+    '''slice_hours:                        length of the time slices the query is split into, type: byte, default: 6'''
+    '''tile_deg:                           edge length (in degrees) of the spatial tiles the query is split into, type: byte, default: 1'''
+    '''max_workers:                        number of slices that are fetched at the same time, type: int, default: 8'''
+    '''retries:                            number of times a failed slice is requested again, type: int, default: 3'''
+    '''backoff:                            seconds to wait before the first retry, doubled for every further retry, type: byte, default: 1'''
+    '''base_url:                           url of the REST-API, type: string, default: http://sensordata.gwdg.de/api/'''
+    '''measurement_id:                     if True, the string column measurement_id (sensor_id + "_" + time) is added.
+                                          It can also be built later with add_measurement_id, type: boolean, default: False'''
+    '''cache:                              if True, slices that lie in the past are stored on disk and reused by later queries.
+                                          The slice borders are then aligned to a fixed grid of slice_hours and tile_deg, so that
+                                          overlapping queries share them. Only the slices that fill a whole grid cell are cached,
+                                          the edges of the query are fetched at the requested size. Needs pyarrow, type: boolean, default: True'''
+    '''cache_dir:                          directory of the query cache, type: string, default: ~/.cache/hal_pm'''
+    '''cache_size_mb:                      size limit of the query cache, least recently used slices are deleted first, type: byte, default: 1024'''
+    '''stream:                             if True, the responses are parsed incrementally into typed column buffers
+                                          (int32 sensor_id, datetime64 time, float32 measurements) instead of
+                                          loading the full json payload, type: boolean, default: False'''
+    '''chunksize:                          if given, a generator is returned that yields the merged data frame in batches
+                                          of at most chunksize rows, slice by slice, type: int, default: None'''
+    '''store:                              measurement store (Measurement_Store.open_store) or its directory, every merged slice
+                                          is also written to it, so that later analyses can query it instead of the REST-API
+                                          (Measurement_Store.query / scan), type: dict or string, default: None'''
+
     '''OUPUT:'''
-    
-    '''Merged data frame on P1 and P2 is outputted'''
-    
+
+    '''Merged data frame on P1 and P2 is outputted, or a generator of merged data frames if chunksize is given.
+       The columns follow the compact SCHEMA (float32 measurements and coordinates, datetime64 time, int32 sensor_id)'''
+
     '''Defensive programming'''
     if not (isinstance(lat_start, float) or isinstance(lat_start, int)):                    # checks type of lat_start parameter with isinstance (int or float)
         raise TypeError("Coordinate value only supports int and float")                     # raise TypeError is not numeric
@@ -29,7 +79,7 @@ def load_data(lat_start, lat_end, long_start, long_end, start_datetime, delta_ho
         raise TypeError("Coordinate value only supports int and float")
     if not (isinstance(delta_hours, float) or isinstance(delta_hours, int)):
         raise TypeError("Time delta value only supports int and float")
-    if not (isinstance(start_datetime, datetime.datetime)):
+    if not (isinstance(start_datetime, datetime)):
         raise TypeError("Start datetime only supports datetime.fromisoformat() object")
     if delta_hours < 0:                                                                     # if delta_hours is smaller equal zero:
         raise ValueError("Time delta only defined for positive numbers")                    # raise value error
@@ -37,52 +87,375 @@ def load_data(lat_start, lat_end, long_start, long_end, start_datetime, delta_ho
         raise ValueError("Latitude range ending starting point must be larger than starting point")
     if long_end <= long_start:
         raise ValueError("Longitude range ending starting point must be larger than starting point")
-    
-    '''Import Data from REST_API'''
-    # Basic parameters
-    base_url='http://sensordata.gwdg.de/api/' 
-    endpoint_url_P1='measurements/P1'          # P1 endpoint
-    endpoint_url_P2='measurements/P2'          # P2 endpoint
-
-    # Select geo-coordinates
-    latrange=[lat_start, lat_end]
-    longrange=[long_start, long_end]
+    if not (isinstance(slice_hours, float) or isinstance(slice_hours, int)) or slice_hours <= 0:
+        raise ValueError("slice_hours must be a positive number")
+    if not (isinstance(tile_deg, float) or isinstance(tile_deg, int)) or tile_deg <= 0:
+        raise ValueError("tile_deg must be a positive number")
+    if not isinstance(max_workers, int) or max_workers < 1:
+        raise ValueError("max_workers must be a positive integer")
+    if not isinstance(measurement_id, bool):
+        raise TypeError("measurement_id needs to be a boolean")
+    if not isinstance(cache, bool):
+        raise TypeError("cache needs to be a boolean")
+    if not isinstance(stream, bool):
+        raise TypeError("stream needs to be a boolean")
+    if chunksize is not None and (not isinstance(chunksize, int) or chunksize < 1):
+        raise ValueError("chunksize must be a positive integer")
+    if store is not None and not isinstance(store, (str, dict)):
+        raise TypeError("store must be a measurement store or the directory of one")
+    if isinstance(store, str):
+        store = Measurement_Store.open_store(store)
 
+    '''Import Data from REST_API'''
     # Select time range
     end_date = (start_datetime + timedelta(hours = delta_hours))
 
-    # Build the query
-    mydata = '{"timeStart": "'+start_datetime.strftime("%Y-%m-%dT%H:%M:%SZ")+'",' + \
-             '"timeEnd": "'+end_date.strftime("%Y-%m-%dT%H:%M:%SZ")+'", "area":  \
-             {"coordinates":['+str(latrange)+','+str(longrange)+']}}'
+    # Split the query into time slices and spatial tiles, every (endpoint, slice, tile) is one request
+    cache = Query_Cache.check(cache)
+    slices = _time_slices(start_datetime, end_date, slice_hours, aligned = cache)
+    tiles = _area_tiles(lat_start, lat_end, long_start, long_end, tile_deg, aligned = cache)
+    bbox = (lat_start, lat_end, long_start, long_end)
+
+    # in batch mode only a few slices are fetched ahead, so that memory stays bounded by the slice size
+    if chunksize is None:
+        ahead = len(slices)
+    else:
+        ahead = max(2, -(-max_workers // (len(ENDPOINTS) * len(tiles))))
+
+    def merged_slices():
+        # Run the queries for P1 and P2 at the same time on a bounded thread pool with one pooled session,
+        # slices that are already in the query cache are not requested again
+        session = _make_session(max_workers)
+        try:
+            with ThreadPoolExecutor(max_workers = max_workers) as pool:
+                queue = deque()
+                i = 0
+                while i < len(slices) or len(queue) > 0:
+                    while i < len(slices) and len(queue) < ahead:
+                        parts = []
+                        for key in ENDPOINTS:
+                            for t in tiles:
+                                part = None
+                                cacheable = cache and _cacheable(slices[i], t, slice_hours, tile_deg)
+                                if cacheable:
+                                    part = Query_Cache.read(Query_Cache.slice_key(key, slices[i], t, base_url), cache_dir)
+                                    if part is not None:
+                                        Instrumentation.count("cache_hits")
+                                if part is None:
+                                    part = pool.submit(Instrumentation.bind(_fetch_slice), session, base_url + ENDPOINTS[key], slices[i], t,
+                                                       retries, backoff, stream, chunksize or STREAM_CHUNKSIZE)
+                                parts.append((key, t, part, cacheable))
+                        queue.append((i, parts))
+                        i += 1
+
+                    k, parts = queue.popleft()
+                    s = slices[k]
+                    frames = {key: [] for key in ENDPOINTS}
+                    for key, t, part, cacheable in parts:
+                        if not isinstance(part, pd.DataFrame):
+                            part = part.result()
+                            # other servers (e.g. a Replay_Server without a recording) answer unknown queries with no rows, those are not kept
+                            if cacheable and (len(part) > 0 or base_url == BASE_URL):
+                                Query_Cache.write(Query_Cache.slice_key(key, s, t, base_url), part, cache_dir, cache_size_mb)
+                        frames[key].append(part)
+                    df = _merge_slice(frames, max(s[0], start_datetime), min(s[1], end_date), k == len(slices) - 1, bbox)
+                    if store is not None:
+                        Measurement_Store.write(store, df)
+                    yield df
+        finally:
+            session.close()
+
+    '''Initialize output'''
+    if chunksize is not None:
+        return _rechunk(merged_slices(), chunksize, measurement_id)                                  # generator of merged batches
+    with Instrumentation.stage("load_data", slices = len(slices), tiles = len(tiles), endpoints = len(ENDPOINTS)) as record:
+        df_total = pd.concat(list(merged_slices()), ignore_index = True)                             # slices do not overlap, so they can just be stacked
+        if measurement_id == True:
+            df_total = add_measurement_id(df_total)
+        record["rows_out"] = len(df_total)
+    return df_total                                                                                  # return combined data frame
+
+
+def apply_schema(df):
+    '''Casts a data frame with PM measurements to the compact SCHEMA'''
+
+    '''INPUT:'''
+
+    '''df:              A pandas data frame with (some of) the columns of load_data, e.g. with time as strings'''
+
+    '''OUTPUT:'''
+
+    '''The data frame with float32 measurements and coordinates, datetime64 time and int32 sensor_id'''
+
+    casts = {c: t for c, t in SCHEMA.items() if c in df and c != "time" and df[c].dtype != t}
+    if len(casts) > 0:
+        df = df.astype(casts)
+    if "time" in df and not pd.api.types.is_datetime64_dtype(df["time"]):
+        df = df.assign(time = _parse_time(df["time"]))
+    return df
+
+
+def time_column(df):
+    '''returns the time column of df as datetime64. Frames in the compact SCHEMA are returned as they are,
+       only frames from other sources (e.g. time as strings) are parsed'''
+    if pd.api.types.is_datetime64_any_dtype(df["time"]):
+        return df["time"]
+    return pd.Series(_parse_time(df["time"]), index = df.index, name = "time")
+
+
+def add_measurement_id(df):
+    '''Adds the string column measurement_id (sensor_id + "_" + time) to a data frame out of load_data'''
+
+    '''INPUT:'''
+
+    '''df:              A pandas data frame out of load_data'''
+
+    '''OUTPUT:'''
+
+    '''The data frame with the additional column measurement_id'''
+
+    if "measurement_id" in df:
+        return df
+    df = df.copy()
+    df["measurement_id"] = df["sensor_id"].astype(str) + "_" + df["time"].dt.strftime("%Y-%m-%dT%H:%M:%S")
+    return df
+
+
+def _merge_slice(frames, time_start, time_end, last, bbox):
+    '''merges P1 and P2 of one time slice and cuts it to [time_start, time_end) and the bounding box.
+       The last slice also keeps measurements at time_end'''
 
-    # Run the query
-    response_P1 = requests.post(base_url + endpoint_url_P1, data=mydata)
-    response_P2 = requests.post(base_url + endpoint_url_P2, data=mydata)
-    
     '''Initialize data frames'''
-    j_P1 = response_P1.json()                                                                            # convert REST-API data to json at first
-    del j_P1[1]                                                                                          # delete 'sensor' string, that causes errors
-    df_P1 = pd.DataFrame(j_P1[1], columns =j_P1[0])                                                      # put all in pandas data frame
+    started = time.perf_counter()
+    df_P1 = _stitch(frames['P1'])                                                                        # stitch the tiles of P1 together
     df_P1 = df_P1.rename(columns={"P1": "measurement_PM10"})                                             # Change column name for better overview
-    l_P1 = list(range(len(df_P1["sensor_id"])))
-    for i in range(len(l_P1)):                                                                           # Adding unique measurement_id to merge P1 and P2
-        l_P1[i] = str(df_P1["sensor_id"][i]) + "_" + str(df_P1["time"][i])
-    df_P1["measurement_id"] = l_P1
-    df_P1 = df_P1.reindex(columns = ["measurement_PM10", "time", "lat", "lon", "sensor_id", "measurement_id"])    # rearranging column names for better overview 
-
-    
-    j_P2 = response_P2.json()
-    del j_P2[1]
-    df_P2 = pd.DataFrame(j_P2[1], columns =j_P2[0])
+    df_P1 = df_P1.reindex(columns = ["measurement_PM10", "time", "lat", "lon", "sensor_id"])            # rearranging column names for better overview
+
+    df_P2 = _stitch(frames['P2'])
     df_P2 = df_P2.rename(columns={"P2": "measurement_PM2.5"})
-    l_P2 = list(range(len(df_P2["sensor_id"])))
-    for j in range(len(l_P2)):                                                                           # Adding unique measurement_id to merge P1 and P2
-        l_P2[j] = str(df_P2["sensor_id"][j]) + "_" + str(df_P2["time"][j])
-    df_P2["measurement_id"] = l_P2
-    df_P2 = df_P2.reindex(columns = ["measurement_PM2.5", "measurement_id"])
-    
-    '''Initialize output'''
-    df_total = pd.merge(df_P1, df_P2, on = "measurement_id")                                         # merge data frame on unique measurement_id
-    df_total = df_total.reindex(columns = ["measurement_PM10", "measurement_PM2.5", "time", "lat", "lon", "sensor_id", "measurement_id"])
-    return df_total                                                                                  # return combined data frame
\ No newline at end of file
+    df_P2 = df_P2.reindex(columns = ["measurement_PM2.5", "time", "sensor_id"])
+
+    df = pd.merge(df_P1, df_P2, on = ["sensor_id", "time"])                                         # merge data frame on the typed (sensor_id, time) key
+    df = df.reindex(columns = ["measurement_PM10", "measurement_PM2.5", "time", "lat", "lon", "sensor_id"])
+
+    # slices share their borders and grid aligned slices can exceed the query, cut them back
+    # (before the float32 cast of the SCHEMA, so that sensors on the border of the bounding box are kept)
+    before_end = (df["time"] <= time_end) if last else (df["time"] < time_end)
+    keep = (df["time"] >= time_start) & before_end & \
+           (df["lat"] >= bbox[0]) & (df["lat"] <= bbox[1]) & \
+           (df["lon"] >= bbox[2]) & (df["lon"] <= bbox[3])
+    df = apply_schema(df[keep].reset_index(drop = True))
+    Instrumentation.count("merge_seconds", time.perf_counter() - started)
+    return df
+
+
+def _rechunk(batches, chunksize, measurement_id):
+    '''splits the merged slices into data frames of at most chunksize rows'''
+    for df in batches:
+        for i in range(0, len(df), chunksize):
+            part = df.iloc[i:i + chunksize].reset_index(drop = True)
+            if measurement_id == True:
+                part = add_measurement_id(part)
+            yield part
+
+
+def _time_slices(start_datetime, end_datetime, slice_hours, aligned = False):
+    '''splits the time window [start_datetime, end_datetime] into consecutive slices of at most slice_hours.
+       If aligned, the slice borders lie on a fixed grid of slice_hours (counted from 1970-01-01), the first and the last
+       slice are cut to the window'''
+    slices = []
+    step = timedelta(hours = slice_hours)
+    epoch = datetime(1970, 1, 1)
+    s = start_datetime
+    while s < end_datetime:
+        e = epoch + ((s - epoch) // step + 1) * step if aligned else s + step
+        slices.append((s, min(e, end_datetime)))
+        s = min(e, end_datetime)
+    if len(slices) == 0:                                                                             # a window of zero length is still queried once
+        slices.append((start_datetime, end_datetime))
+    return slices
+
+
+def _area_tiles(lat_start, lat_end, long_start, long_end, tile_deg, aligned = False):
+    '''splits the bounding box into tiles with an edge length of at most tile_deg degrees.
+       If aligned, the tile borders lie on a fixed grid of tile_deg degrees, the tiles at the border are cut to the bounding box'''
+    if aligned:
+        lat_edges = [lat_start] + [e for e in _grid_edges(lat_start, lat_end, tile_deg) if lat_start < e < lat_end] + [lat_end]
+        long_edges = [long_start] + [e for e in _grid_edges(long_start, long_end, tile_deg) if long_start < e < long_end] + [long_end]
+    else:
+        lat_edges = list(np.arange(lat_start, lat_end, tile_deg)) + [lat_end]
+        long_edges = list(np.arange(long_start, long_end, tile_deg)) + [long_end]
+    return [([float(lat_edges[i]), float(lat_edges[i+1])], [float(long_edges[j]), float(long_edges[j+1])])
+            for i in range(len(lat_edges) - 1) for j in range(len(long_edges) - 1)]
+
+
+def _cacheable(time_slice, tile, slice_hours, tile_deg):
+    '''True if an aligned slice fills a whole cell of the grid (so other queries ask for exactly the same slice) and its data is final'''
+    return time_slice[1] - time_slice[0] == timedelta(hours = slice_hours) and \
+           abs(tile[0][1] - tile[0][0] - tile_deg) < 1e-6 and abs(tile[1][1] - tile[1][0] - tile_deg) < 1e-6 and \
+           Query_Cache.is_final(time_slice)
+
+
+def _grid_edges(start, end, step):
+    '''edges of the grid cells of size step that cover [start, end]'''
+    first = int(np.floor(start / step))
+    last = max(int(np.ceil(end / step)), first + 1)
+    return [round(i * step, 6) for i in range(first, last + 1)]
+
+
+def _build_query(start_datetime, end_datetime, latrange, longrange):
+    '''builds the json body of a query to the measurement endpoints'''
+    return '{"timeStart": "'+start_datetime.strftime("%Y-%m-%dT%H:%M:%SZ")+'",' + \
+           '"timeEnd": "'+end_datetime.strftime("%Y-%m-%dT%H:%M:%SZ")+'", "area":  \
+           {"coordinates":['+str(latrange)+','+str(longrange)+']}}'
+
+
+def _make_session(pool_size):
+    '''creates a requests session whose connection pool is large enough for all worker threads'''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _post(session, url, data, retries, backoff, stream = False):
+    '''posts a query and retries it with exponential backoff on connection errors and server errors'''
+    for attempt in range(retries + 1):
+        try:
+            with Instrumentation.counted("http"):
+                response = session.post(url, data = data, stream = stream)
+            Instrumentation.count("http_requests")
+            if response.status_code < 500:
+                response.raise_for_status()                                                          # client errors are not retried
+                return response
+            error = requests.HTTPError(str(response.status_code) + " Server Error for url: " + url, response = response)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        if attempt < retries:
+            Instrumentation.count("http_retries")
+            time.sleep(backoff * 2 ** attempt)
+    raise error
+
+
+def _fetch_slice(session, url, time_slice, tile, retries, backoff, stream = False, chunksize = None):
+    '''fetches one time slice of one tile from one endpoint and returns it as a data frame'''
+    data = _build_query(time_slice[0], time_slice[1], tile[0], tile[1])
+    if stream:
+        with _post(session, url, data, retries, backoff, stream = True) as response:
+            return pd.concat(list(_iter_typed(response, chunksize or STREAM_CHUNKSIZE)), ignore_index = True)
+    response = _post(session, url, data, retries, backoff)
+    Instrumentation.count("bytes_fetched", len(response.content))
+    with Instrumentation.counted("json"):
+        j = response.json()                                                                          # convert REST-API data to json at first
+    del j[1]                                                                                         # delete 'sensor' string, that causes errors
+    df = pd.DataFrame(j[1], columns = j[0])                                                          # put all in pandas data frame
+    df["time"] = _parse_time(df["time"])
+    return _typed_ids(df)                                                                            # integer sensor_id and datetime64 time form the join key
+
+
+def _typed_ids(df):
+    '''casts the sensor_id of a parsed response to int64, the same way for streamed and complete responses. Numeric strings
+       are accepted, rows with a missing, non-numeric or non-integer sensor_id cannot be joined and are left out'''
+    ids = pd.to_numeric(df["sensor_id"], errors = "coerce").values.astype(np.float64)
+    valid = np.isfinite(ids) & (ids == np.floor(ids))
+    if not valid.all():
+        Instrumentation.logger.warning("%d rows with a malformed sensor_id were left out", (~valid).sum())
+        df = df[valid].reset_index(drop = True)
+        ids = ids[valid]
+    return df.assign(sensor_id = ids.astype(np.int64))
+
+
+def _parse_time(values):
+    '''parses timestamps of the REST-API into datetime64 (UTC, without time zone)'''
+    return pd.Series(pd.to_datetime(values, utc = True)).dt.tz_localize(None).values
+
+
+def _stitch(frames):
+    '''concatenates the slices of one endpoint, measurements on shared slice borders are only kept once'''
+    df = pd.concat(frames, ignore_index = True)
+    return df.drop_duplicates(subset = ["sensor_id", "time"], ignore_index = True)
+
+
+def _iter_typed(response, chunksize):
+    '''parses a streamed response into typed, preallocated column buffers and yields them as data frames of at most chunksize rows'''
+    rows = _iter_json_rows(_count_bytes(response.iter_content(chunk_size = 2 ** 16)))
+    header = next(rows)
+    i_id, i_time, i_lat, i_lon = [header.index(c) for c in ["sensor_id", "time", "lat", "lon"]]
+    i_val = [i for i in range(len(header)) if i not in (i_id, i_time, i_lat, i_lon)][0]        # the measurement column (P1 or P2)
+
+    def new_buffers():
+        return (np.empty(chunksize, dtype = object), np.empty(chunksize, dtype = object),
+                np.empty(chunksize, dtype = np.float64), np.empty(chunksize, dtype = np.float64),
+                np.empty(chunksize, dtype = np.float32))
+
+    def to_frame(buffers, n):
+        ids, times, lat, lon, vals = buffers
+        return _typed_ids(pd.DataFrame({"sensor_id": ids[:n],
+                                        "time": _parse_time(times[:n]),
+                                        "lat": lat[:n], "lon": lon[:n], header[i_val]: vals[:n]}))
+
+    buffers = new_buffers()
+    ids, times, lat, lon, vals = buffers
+    n = 0
+    n_yielded = 0
+    for row in rows:
+        ids[n] = row[i_id]
+        times[n] = row[i_time]
+        lat[n] = row[i_lat]
+        lon[n] = row[i_lon]
+        vals[n] = np.nan if row[i_val] is None else row[i_val]
+        n += 1
+        if n == chunksize:                                                                           # buffers are full, hand them over and start new ones
+            yield to_frame(buffers, n)
+            n_yielded += 1
+            buffers = new_buffers()
+            ids, times, lat, lon, vals = buffers
+            n = 0
+    if n > 0 or n_yielded == 0:
+        yield to_frame(buffers, n)
+
+
+def _count_bytes(byte_chunks):
+    '''passes the chunks of a streamed response on and counts their bytes'''
+    for chunk in byte_chunks:
+        Instrumentation.count("bytes_fetched", len(chunk))
+        yield chunk
+
+
+def _iter_json_rows(byte_chunks):
+    '''incremental parser for responses of the form [header, "sensor", [row, row, ...]].
+       Yields the header first and then one row after the other, without holding the full payload'''
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    stage = 0                           # 0: outer list, 1: header, 2: "sensor" string, 3: list of rows, 4: rows
+    for chunk in byte_chunks:
+        buf = buf[pos:] + text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if stage == 0 or stage == 3:
+                if buf[pos] != "[":
+                    raise ValueError("Unexpected format of the REST-API response")
+                pos += 1
+                stage += 1
+                continue
+            if stage == 4 and buf[pos] == "]":
+                return
+            try:
+                value, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:                                                             # the value is not complete yet, read the next chunk
+                break
+            if stage == 1:
+                yield value
+                stage = 2
+            elif stage == 2:
+                stage = 3
+            else:
+                yield value
+    raise ValueError("The REST-API response ended unexpectedly")
@@ -2,132 +2,275 @@ import folium
 from folium.plugins import TimeSliderChoropleth
 import numpy as np 
 import pandas as pd
-from datetime import datetime
-import json
-from shapely.geometry import shape, Point
+import os
+import shapely
 import geopandas as gpd
 from branca.colormap import linear
+from hal_pm import Load_Data
+from hal_pm import Boundaries
+from hal_pm import Time_Cube
+from hal_pm import Instrumentation
+from hal_pm import Sensor_Registry
 
-def map_data(df, geo_boundaries, lat = "lat", lon = "lon", measurement_type = "measurement_PM10", time_interval = "5Min"):
+@Instrumentation.timed(rows_out = False)
+def map_data(df, geo_boundaries, lat = "lat", lon = "lon", measurement_type = "measurement_PM10", time_interval = "5Min",
+             compact = False, simplify_zoom = None, out_dir = ".", registry = None, cache_dir = Boundaries.DEFAULT_CACHE_DIR):
     '''
     Maps the PM10 and PM2.5 concentration 
     
     INPUTS:
-    df:                  A pandas dataframe containing PM10 and Pm2.5 measurements, the location and time of the measurement
+    df:                  A pandas dataframe containing PM10 and Pm2.5 measurements, the location and time of the measurement,
+                         or a cube out of Time_Cube.build_cube (time_interval must then be a multiple of its interval)
     geo_boundaries:      A geojson file containinig the geoboundaries on which to aggregate the data
-    measurement_type:    String either measurement_PM10 or measurement_PM2.5
+    measurement_type:    String either measurement_PM10 or measurement_PM2.5, or a list of both. For a list, the spatial join,
+                         the aggregation, the sensor markers and the polygon geometries are computed once and shared by all maps
     lat:                 String with the column name of latitudes in df
     lon:                 String with the column name of longitude in df
     time_interval:       String specifying the time interval to which to aggregate the data (e.g. 30S, 10Min, 1H, 1D)
+    compact:             If True, a lightweight HTML is written: every polygon geometry is written exactly once (the time
+                         varying colours are only kept in the style table of the slider) and all sensors are drawn as one
+                         batched GeoJSON layer instead of one marker object per sensor
+    simplify_zoom:       Only with compact = True. If given (e.g. 11), the polygons are simplified and their coordinates
+                         snapped to a grid of about one pixel at that zoom level of the map
+    out_dir:             Directory the HTML files are written to (created if it does not exist)
+    registry:            Optional sensor registry out of Sensor_Registry.build_registry. The sensor locations, markers and
+                         polygons are then taken from it (df only needs sensor_id, e.g. after Sensor_Registry.strip) and the
+                         unique sensors are not searched in the rows
+    cache_dir:           Directory of the disk cache of the parsed boundaries (see Boundaries.load_boundaries), None: no disk cache
     
     
     
     OUTPUTS:
-    index_measurement_type.html:               An HTML file with an interactive map
-    m:                                         The map
+    index_measurement_type.html:               An HTML file with an interactive map (one per measurement type) in out_dir
+    m:                                         The map, or a dictionary {measurement_type: map} if a list was given
     '''
     
     # Defensive programming
-    if not (isinstance(df,pd.core.frame.DataFrame)):
-        raise TypeError("df must be a pandas dataframe")
-    if not "time" in df:
-        raise NameError("There is no column named time in df -- need a column named time!")
+    cube = Time_Cube.is_cube(df)
+    if cube:
+        columns = df["measurements"]
+    else:
+        if not (isinstance(df,pd.core.frame.DataFrame)):
+            raise TypeError("df must be a pandas dataframe or a cube out of Time_Cube.build_cube")
+        columns = df.columns
+        if not "time" in df:
+            raise NameError("There is no column named time in df -- need a column named time!")
+        if not (isinstance(lat, str)):
+            raise TypeError("lat must be a string")
+        if not lat in df and registry is None:
+            raise NameError(lat+" is not a column of df")
+        if not (isinstance(lon,str)):
+            raise TypeError("lon must be a string")
+        if not lon in df and registry is None:
+            raise NameError(lon+" is not a column of df")
+        if not "sensor_id" in df:
+            raise NameError("There is no column named sensor_id in df -- need a column named sensor_id!")
     if not (isinstance(geo_boundaries,str)):
         raise TypeError("geo_boundaries must be a file path as string")
-        
-    if not (isinstance(lat, str)):
-        raise TypeError("lat must be a string")
-    if not lat in df:
-        raise NameError(lat+" is not a column of df")
-    if not (isinstance(lon,str)):
-        raise TypeError("lon must be a string")
-    if not lon in df:
-        raise NameError(lon+" is not a column of df")
-    
-    if not (isinstance(measurement_type,str)):
-        raise TypeError("measurement_type must be a column name as string")
-    if not measurement_type in df:
-        raise NameError(measurement_type+" is not a column of df")
+    
+    single = isinstance(measurement_type,str)
+    measurement_types = [measurement_type] if single else measurement_type
+    if not (isinstance(measurement_types,list) and len(measurement_types) > 0):
+        raise TypeError("measurement_type must be a column name as string or a list of column names")
+    for m_type in measurement_types:
+        if not (isinstance(m_type,str)):
+            raise TypeError("measurement_type must be a column name as string or a list of column names")
+        if not m_type in columns:
+            raise NameError(m_type+" is not a column of df")
     if not isinstance(time_interval,str):
         raise TypeError("time_interval must be a string")
+    if not isinstance(compact,bool):
+        raise TypeError("compact must be a boolean")
+    if simplify_zoom is not None and not isinstance(simplify_zoom,int):
+        raise TypeError("simplify_zoom must be an integer zoom level")
+    if not isinstance(out_dir,str):
+        raise TypeError("out_dir must be a directory path as string")
     
-    # generate the PM label for the plots
-    start = measurement_type.find("_")+1
-    end = len(measurement_type)
-    pm_label = measurement_type[start:end]
-    
-    # first load the geo boundaries and create a geopandas dataframe out of df
-    plz = gpd.read_file(geo_boundaries)
-    geo_df = gpd.GeoDataFrame(df,geometry = gpd.points_from_xy(df["lon"], df["lat"]), crs = 4326)
+    # one row per sensor
+    if cube:
+        sensors = df["sensors"]
+    elif registry is not None:
+        sensors = Sensor_Registry.sensors_of(registry, df)[['sensor_id', 'lat', 'lon']]
+    else:
+        sensors = df[['sensor_id', lat, lon]].drop_duplicates('sensor_id').rename(columns = {lat: 'lat', lon: 'lon'})
     
-    # combine the geoboundaries with the geo_df (allocate the points to the correct polygons)
-    plz_pm = gpd.sjoin(plz,geo_df)
-    plz_pm['polygon_id'] = plz_pm.index
-    plz_pm = plz_pm.reset_index()
-    plz_geom = plz_pm[['polygon_id','geometry']]
+    # first load the geo boundaries (parsed once per file and clipped to the area of the data)
+    with Instrumentation.stage("boundaries"):
+        bbox = (sensors['lat'].min(), sensors['lat'].max(), sensors['lon'].min(), sensors['lon'].max())
+        plz = Boundaries.load_boundaries(geo_boundaries, bbox = bbox, cache_dir = cache_dir)
     
-    plz_pm = plz_pm[['polygon_id',measurement_type,'time']]
-    plz_pm['time'] = pd.to_datetime(plz_pm['time'])
+    # allocate the sensors to the correct polygons (memoized per sensor, so only new sensors are looked up)
+    with Instrumentation.stage("sjoin", rows_in = len(sensors)):
+        if registry is None:
+            polygon_of = Boundaries.assign_sensors(geo_boundaries, sensors, cache_dir = cache_dir)
+        else:
+            polygon_of = Sensor_Registry.polygon_of(registry, geo_boundaries, cache_dir = cache_dir)
     
-    # aggreagte the data within each polygon by some prespecified time interval
+    # aggreagte the data within each polygon by some prespecified time interval (all measurement types in one pass)
     # this decides on how fine grained the slider is. 
-    gr_plz_pm = plz_pm.groupby([pd.Grouper(key = "time",freq = time_interval), 'polygon_id']).mean()
-    gr_plz_pm = gr_plz_pm.reset_index()
-    gr_plz_pm['geometry'] = plz['geometry'][gr_plz_pm['polygon_id']].reset_index()['geometry']
+    with Instrumentation.stage("aggregate") as record:
+        if cube:
+            gr_plz_pm = Time_Cube.polygon_means(df, polygon_of, time_interval)[['time', 'polygon_id'] + measurement_types] # rollup of the cube cells
+        else:
+            plz_pm = df[measurement_types].assign(polygon_id = df['sensor_id'].map(polygon_of), time = Load_Data.time_column(df)) # time is already datetime64 for frames out of load_data
+            plz_pm = plz_pm[plz_pm['polygon_id'].notna()]
+            gr_plz_pm = plz_pm.groupby([pd.Grouper(key = "time",freq = time_interval), 'polygon_id']).mean()
+            gr_plz_pm = gr_plz_pm.reset_index()
+        gr_plz_pm['geometry'] = plz.loc[gr_plz_pm['polygon_id'], 'geometry'].values
+        gr_plz_pm["dt_index"] = gr_plz_pm['time'].astype(int) // 10**9  # translate time to integer values
+        record["rows_out"] = len(gr_plz_pm)
     
-    # define the style dictionary which is needed for the time slider (for each polygon and 
-    # each time we assign a color based on the measured PM value)
-    gr_plz_pm["dt_index"] = gr_plz_pm['time'].astype(int) // 10**9  # translate time to integer values
-    cmap = linear.BuPu_09.scale(0, 50) # define the color scale
-    cmap.caption = str(pm_label+" concentration (μg/m³)") # define the label of the color scale (needed for plotting later)
-    
-    styledict = {}
-    for poly in pd.unique(gr_plz_pm['polygon_id']):
-    
-        meas = gr_plz_pm.loc[gr_plz_pm['polygon_id'] == poly] # only retain measurements in that polygon
-        poly = int(poly)
-        styledict[poly] = {}
-    
-        for date_time in meas['dt_index']: # for each timestamp within that polygon assign a color
-            value = float(meas[measurement_type][meas['dt_index'] == date_time]) #extract the measured value
-            styledict[poly][date_time] = {'color': cmap(value),'opacity': 0.1}  # assign a color for the polygon - time - value combination
-            # similar values will have similar colors because of the color scale cmap.
-          
-          
-    # prepare data for plotting
-    gr_plz_pm = gr_plz_pm.set_index(gr_plz_pm['polygon_id'])
-    geo_gr_plz_pm = gpd.GeoDataFrame(gr_plz_pm)
-    geo_gr_plz_pm = geo_gr_plz_pm.drop('time', axis = 1) # drop the time variable sicne else not convertibleto json file (needed for plotting)
+    # prepare data for plotting, the geojson is serialised once and shared by all maps
+    with Instrumentation.stage("geojson"):
+        if compact:
+            geojson = polygon_geojson(plz.loc[pd.unique(gr_plz_pm['polygon_id'])], simplify_zoom) # one feature per polygon
+        else:
+            geo_gr_plz_pm = gpd.GeoDataFrame(gr_plz_pm.set_index(gr_plz_pm['polygon_id']))
+            geo_gr_plz_pm = geo_gr_plz_pm.drop('time', axis = 1) # drop the time variable sicne else not convertibleto json file (needed for plotting)
+            geojson = geo_gr_plz_pm.to_json() # transform the geopandas dataframe to a json file
 
     # extract the location of all sensors
-    markers = df[df.duplicated('sensor_id') == False]
-    markers = markers[['lat','lon','sensor_id']]
-    markers = markers.reset_index()
+    markers = sensors.reset_index(drop = True)
     
-    # Define the title, relying on html
     time_start = min(gr_plz_pm.time).strftime("%d.%m.%y - %H:%M")
     time_end = max(gr_plz_pm.time).strftime("%d.%m.%y - %H:%M")
-    loc = pm_label+" concentrations from "+time_start+" to "+time_end+" with a time interval of "+time_interval # define the title of the map
-    title_html = ''' <h3 align="center" style="font-size:16px"><b>{}</b></h3>'''.format(loc) # format the title
+    if cube or registry is not None:
+        center = [np.median(sensors['lat']), np.median(sensors['lon'])] # define the center of the map
+    else:
+        center = [np.median(df[lat]), np.median(df[lon])]
+    
+    maps = {}
+    for m_type in measurement_types:
+        # generate the PM label for the plots
+        pm_label = m_type[m_type.find("_")+1:]
+        
+        # define the style dictionary which is needed for the time slider (for each polygon and 
+        # each time we assign a color based on the measured PM value)
+        cmap = linear.BuPu_09.scale(0, 50) # define the color scale
+        cmap.caption = str(pm_label+" concentration (μg/m³)") # define the label of the color scale (needed for plotting later)
+        with Instrumentation.stage("styledict", rows_in = len(gr_plz_pm)):
+            styledict = build_styledict(gr_plz_pm['polygon_id'].values, gr_plz_pm['dt_index'].values,
+                                        gr_plz_pm[m_type].values, cmap) # similar values will have similar colors because of the color scale cmap.
+        
+        # Define the title, relying on html
+        loc = pm_label+" concentrations from "+time_start+" to "+time_end+" with a time interval of "+time_interval # define the title of the map
+        title_html = ''' <h3 align="center" style="font-size:16px"><b>{}</b></h3>'''.format(loc) # format the title
+        
+        m = folium.Map(location=center, zoom_start=11) # create the base map
+        
+        TimeSliderChoropleth(
+            data = geojson, # the shared geojson
+            styledict=styledict # use the styledictionary defined earlier
+        ).add_to(m) 
+        
+
+        if compact:
+            sensor_layer(markers).add_to(m) # all sensors in one layer
+        else:
+            for jj in range(markers.shape[0]): # add circle markers for all sensors
+                folium.CircleMarker(location = [markers['lat'][jj],markers['lon'][jj]],
+                                    color = "green",radius = 1,fill = True,
+                                    popup = "sensor id:"+str(markers["sensor_id"][jj])).add_to(m)
+       
+        m.add_child(cmap) # add the legend 
+        
+        m.get_root().html.add_child(folium.Element(title_html)) # add the title
+        
+        os.makedirs(out_dir, exist_ok = True)
+        file_name = os.path.join(out_dir, "index_"+pm_label+".html")
+        with Instrumentation.stage("write", path = file_name) as record:
+            m.save(file_name) # save the map
+            record["bytes_written"] = os.path.getsize(file_name)
+        Instrumentation.logger.info("%s written: %s MB in %s s", file_name, round(record["bytes_written"] / 1024**2, 2), round(record["seconds"], 2))
+        maps[m_type] = m
+    
+    if single:
+        return maps[measurement_type]
+    return maps
+
+
+def build_styledict(polygon_ids, dt_index, values, cmap, n_colors = 512, opacity = 0.1):
+    '''
+    Builds the style dictionary of the TimeSliderChoropleth in one vectorized pass
+    
+    INPUTS:
+    polygon_ids:         Array with the polygon id of every (polygon, time bin) row
+    dt_index:            Array with the time bin of every row as integer seconds
+    values:              Array with the aggregated measurement of every row, rows without a value (NaN, e.g. a polygon
+                         with PM2.5 but no PM10 readings in a time bin) are left out instead of being coloured
+    cmap:                The branca colormap
+    n_colors:            Size of the colour lookup table. The colours are precomputed for n_colors values evenly
+                         spaced between cmap.vmin and cmap.vmax (512 colours resolve 0 - 50 μg/m³ in steps of 0.1)
+    opacity:             Opacity of the polygons
+    
+    OUTPUTS:
+    styledict:           {polygon_id: {time: {'color': ..., 'opacity': ...}}}
+    '''
+    
+    # colour lookup table, one style per colour that is shared by all entries with that colour
+    lut = [cmap(v) for v in np.linspace(cmap.vmin, cmap.vmax, n_colors)]
+    styles = np.empty(n_colors, dtype = object)
+    styles[:] = [{'color': c, 'opacity': opacity} for c in lut]
     
-    center = [np.median(df[lat]), np.median(df[lon])] # define the center of the map
-    m = folium.Map(location=center, zoom_start=11) # create the base map
+    # leave out the rows without a value, a missing mean is not the cleanest air
+    values = np.asarray(values, dtype = float)
+    keep = ~np.isnan(values)
+    polygon_ids, dt_index, values = np.asarray(polygon_ids)[keep], np.asarray(dt_index)[keep], values[keep]
+    if len(values) == 0:
+        return {}
     
-    g = TimeSliderChoropleth(
-        data = geo_gr_plz_pm.to_json(), # transform the geopandas dataframe to a json file
-        styledict=styledict # use the styledictionary defined earlier
-    ).add_to(m) 
+    # map all values to their colour at once (values outside the scale get the colour of the closest end)
+    idx = np.rint((values - cmap.vmin) / (cmap.vmax - cmap.vmin) * (n_colors - 1))
+    idx = np.clip(idx, 0, n_colors - 1).astype(int)
     
+    # sort by polygon and time once, every polygon is then one contiguous block
+    order = np.lexsort((dt_index, polygon_ids))
+    polygon_ids = np.asarray(polygon_ids)[order]
+    dt_index = np.asarray(dt_index)[order].tolist()
+    row_styles = styles[idx[order]].tolist()
+    bounds = np.r_[np.flatnonzero(np.r_[True, polygon_ids[1:] != polygon_ids[:-1]]), len(polygon_ids)]
+    
+    styledict = {}
+    for i in range(len(bounds) - 1):
+        start, end = bounds[i], bounds[i + 1]
+        styledict[int(polygon_ids[start])] = dict(zip(dt_index[start:end], row_styles[start:end]))
+    return styledict
+
 
-    for jj in range(markers.shape[0]): # add circle markers for all sensors
-        folium.CircleMarker(location = [markers['lat'][jj],markers['lon'][jj]],
-                            color = "green",radius = 1,fill = True,
-                            popup = str("sensor id:"+markers['sensor_id'][jj])).add_to(m)
-   
-    m.add_child(cmap) # add the legend 
+def polygon_geojson(polygons, simplify_zoom = None):
+    '''
+    Serialises every polygon exactly once, with the polygon id as feature id and no other properties
     
-    m.get_root().html.add_child(folium.Element(title_html)) # add the title
+    INPUTS:
+    polygons:            GeoDataFrame of the polygons, indexed by polygon id
+    simplify_zoom:       Optional zoom level. The polygons are simplified and their coordinates snapped to a grid of
+                         about one pixel at that zoom level (360 / (256 * 2^zoom) degrees)
     
-    m.save(str("index_"+pm_label+".html")) # save the map
+    OUTPUTS:
+    A geojson string
+    '''
+    geometry = polygons.geometry
+    if simplify_zoom is not None:
+        pixel = 360 / (256 * 2 ** simplify_zoom)
+        geometry = geometry.simplify(pixel, preserve_topology = True)
+        geometry = gpd.GeoSeries(shapely.set_precision(geometry.values, pixel), index = geometry.index, crs = geometry.crs)
+    return gpd.GeoDataFrame(geometry = geometry).to_json()
+
+
+def sensor_layer(markers):
+    '''
+    Draws all sensors as one GeoJSON layer of circle markers (instead of one folium object per sensor)
     
-    return m
\ No newline at end of file
+    INPUTS:
+    markers:             Data frame with the columns sensor_id, lat and lon
+    
+    OUTPUTS:
+    A folium.GeoJson layer
+    '''
+    features = [{"type": "Feature", "properties": {"sensor_id": str(i)},
+                 "geometry": {"type": "Point", "coordinates": [round(float(x), 6), round(float(y), 6)]}}
+                for i, x, y in zip(markers["sensor_id"].tolist(), markers["lon"].tolist(), markers["lat"].tolist())]
+    return folium.GeoJson({"type": "FeatureCollection", "features": features},
+                          name = "sensors",
+                          marker = folium.CircleMarker(radius = 1, color = "green", fill = True),
+                          popup = folium.GeoJsonPopup(fields = ["sensor_id"], aliases = ["sensor id:"]))
@@ -0,0 +1,195 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from hal_pm import Query_Cache
+from hal_pm import Instrumentation
+
+INDEX = "_index.parquet"
+META = "_store.json"
+DERIVED = ["measurement_id"]            # columns that are not stored, they can be built again (Load_Data.add_measurement_id)
+
+
+def open_store(root, tile_deg = 1):
+    '''Opens (or creates) a measurement store: Parquet files partitioned by day and spatial tile'''
+
+    '''INPUT:'''
+
+    '''root:            directory of the store, the partitions are root/day=<YYYY-MM-DD>/tile=<lat>_<lon>.parquet'''
+    '''tile_deg:        edge length (in degrees) of the spatial tiles, an existing store keeps its own, type: int or float, default: 1'''
+
+    '''OUTPUT:'''
+
+    '''store:           dictionary with root, tile_deg and index (data frame with one row per partition: path, day, tile,'''
+    '''                 rows, sensors and the minimum and maximum of every column, used to prune partitions before reading)'''
+
+    # Defensive programming
+    if not Query_Cache.available():
+        raise ImportError("the measurement store needs pyarrow to write and read parquet files")
+    if not (isinstance(tile_deg, float) or isinstance(tile_deg, int)) or tile_deg <= 0:
+        raise ValueError("tile_deg must be a positive number")
+
+    meta_path = os.path.join(root, META)
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            tile_deg = json.load(f)["tile_deg"]
+    else:
+        os.makedirs(root, exist_ok = True)
+        with open(meta_path, "w") as f:
+            json.dump({"tile_deg": tile_deg}, f)
+    index_path = os.path.join(root, INDEX)
+    index = pd.read_parquet(index_path) if os.path.exists(index_path) else pd.DataFrame(columns = ["path", "day", "tile_lat", "tile_lon", "rows"])
+    return {"root": root, "tile_deg": tile_deg, "index": index}
+
+
+@Instrumentation.timed(rows_out = False)
+def write(store, df):
+    '''Writes measurements (a data frame out of load_data) to the partitions of a store'''
+
+    '''Rows are merged into the existing partitions, a measurement (sensor_id, time) that is already stored is replaced,'''
+    '''so overlapping loads can be written several times. The partitions are sorted by time and sensor_id.'''
+
+    '''OUTPUT:'''
+
+    '''number of partitions that were written'''
+
+    # Defensive programming
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError("df must be a pandas dataframe")
+    for column in ["time", "sensor_id", "lat", "lon"]:
+        if not column in df:
+            raise NameError(column + " is not a column of df")
+    if len(df) == 0:
+        return 0
+
+    df = df.drop(columns = [c for c in DERIVED if c in df])
+    keys = partition_keys(store, df["time"].values, df["lat"].values, df["lon"].values)
+    rows = []
+    for (day, tile_lat, tile_lon), part in df.groupby(keys, sort = True):
+        path = _partition_path(day, tile_lat, tile_lon)
+        full_path = os.path.join(store["root"], path)
+        if os.path.exists(full_path):
+            part = pd.concat([pd.read_parquet(full_path), part], ignore_index = True)
+            part = part.drop_duplicates(subset = ["sensor_id", "time"], keep = "last")
+        part = part.sort_values(["time", "sensor_id"], ignore_index = True)
+        os.makedirs(os.path.dirname(full_path), exist_ok = True)
+        part.to_parquet(full_path + ".tmp", index = False)
+        os.replace(full_path + ".tmp", full_path)                                          # atomic, so readers never see half written files
+        rows.append(dict({"path": path, "day": pd.Timestamp(day), "tile_lat": tile_lat, "tile_lon": tile_lon}, **_partition_stats(part)))
+
+    written = pd.DataFrame(rows)
+    index = store["index"]
+    index = index[~index["path"].isin(written["path"])]
+    store["index"] = pd.concat([index, written], ignore_index = True) if len(index) > 0 else written
+    store["index"] = store["index"].sort_values(["day", "tile_lat", "tile_lon"], ignore_index = True)
+    index_path = os.path.join(store["root"], INDEX)
+    store["index"].to_parquet(index_path + ".tmp", index = False)
+    os.replace(index_path + ".tmp", index_path)
+    return len(rows)
+
+
+def partitions(store, lat_start = None, lat_end = None, long_start = None, long_end = None, start = None, end = None, value_range = None):
+    '''the rows of the index of the partitions that can hold measurements of the query (see query), the others are pruned
+    with the minimum and maximum of their columns without opening them'''
+    index = store["index"]
+    keep = np.ones(len(index), dtype = bool)
+    limits = {"lat": (lat_start, lat_end), "lon": (long_start, long_end)}
+    limits.update(value_range or {})
+    for column, (low, high) in limits.items():
+        if not column + "_min" in index:
+            continue
+        if low is not None:
+            keep &= ~(index[column + "_max"].values < low)                                 # partitions without values (NaN) are kept
+        if high is not None:
+            keep &= ~(index[column + "_min"].values > high)
+    if len(index) > 0 and start is not None:
+        keep &= index["time_max"].values >= pd.Timestamp(start).to_datetime64()
+    if len(index) > 0 and end is not None:
+        keep &= index["time_min"].values < pd.Timestamp(end).to_datetime64()
+    return index[keep]
+
+
+def scan(store, lat_start = None, lat_end = None, long_start = None, long_end = None, start = None, end = None, columns = None,
+         value_range = None):
+    '''Generator of the measurements of a query, one data frame per partition (in the order of day and tile), so that only one
+    partition is held in memory. Takes the same arguments as query. The chunks can be passed to the functions that read data
+    in chunks, e.g. Filter_Data.remove_outliers_stream, Descriptive_Stats.top_k_stream, Corr_Fct.corr_matrix and
+    Time_Cube.build_cube_stream (whose cube Plot_Mean, Time_Plots and Map accept)'''
+    selected = partitions(store, lat_start, lat_end, long_start, long_end, start, end, value_range)
+    filters = {"lat": (lat_start, lat_end), "lon": (long_start, long_end)}
+    filters.update(value_range or {})
+    for path in selected["path"]:
+        with Instrumentation.stage("store_read", path = path) as record:
+            df = pd.read_parquet(os.path.join(store["root"], path), columns = _read_columns(columns, filters, start, end), memory_map = True)
+            keep = np.ones(len(df), dtype = bool)
+            for column, (low, high) in filters.items():
+                if low is not None:
+                    keep &= df[column].values >= low
+                if high is not None:
+                    keep &= df[column].values <= high
+            if start is not None:
+                keep &= df["time"].values >= pd.Timestamp(start).to_datetime64()
+            if end is not None:
+                keep &= df["time"].values < pd.Timestamp(end).to_datetime64()
+            df = df[keep].reset_index(drop = True)
+            if columns is not None:
+                df = df[list(columns)]
+            record["rows_out"] = len(df)
+        if len(df) > 0:
+            yield df
+
+
+def query(store, lat_start = None, lat_end = None, long_start = None, long_end = None, start = None, end = None, columns = None,
+          value_range = None):
+    '''Reads the measurements of a bounding box and time range out of a store'''
+
+    '''INPUT:'''
+
+    '''lat_start, lat_end, long_start, long_end:  bounding box (borders included), None: no limit'''
+    '''start, end:      time range, start included and end excluded, type: datetime or string, None: no limit'''
+    '''columns:         columns to read, the other columns are not read from disk, default: None (all)'''
+    '''value_range:     further limits {column: (low, high)}, e.g. {"measurement_PM10": (50, None)}. Partitions whose minimum and'''
+    '''                 maximum lie outside are not read'''
+
+    '''OUTPUT:'''
+
+    '''data frame in the schema of load_data (sorted by time within every partition), use scan to read it in chunks'''
+
+    frames = list(scan(store, lat_start, lat_end, long_start, long_end, start, end, columns, value_range))
+    if len(frames) == 0:
+        return pd.DataFrame(columns = columns if columns is not None else ["measurement_PM10", "measurement_PM2.5", "time", "lat", "lon", "sensor_id"])
+    return pd.concat(frames, ignore_index = True)
+
+
+def partition_keys(store, time, lat, lon):
+    '''day (datetime64[D]) and tile numbers (floor of the coordinate / tile_deg) of measurements'''
+    tile_deg = store["tile_deg"]
+    return [np.asarray(time).astype("datetime64[D]"), np.floor(np.asarray(lat, dtype = np.float64) / tile_deg).astype(np.int64),
+            np.floor(np.asarray(lon, dtype = np.float64) / tile_deg).astype(np.int64)]
+
+
+def _partition_path(day, tile_lat, tile_lon):
+    return os.path.join("day=" + str(np.datetime64(day, "D")), "tile=" + str(tile_lat) + "_" + str(tile_lon) + ".parquet")
+
+
+def _partition_stats(df):
+    '''rows, sensors and the minimum and maximum of every numeric and time column of a partition'''
+    stats = {"rows": len(df), "sensors": df["sensor_id"].nunique()}
+    for column in df.columns:
+        if column != "sensor_id" and (pd.api.types.is_numeric_dtype(df[column]) or pd.api.types.is_datetime64_any_dtype(df[column])):
+            stats[column + "_min"] = df[column].min()
+            stats[column + "_max"] = df[column].max()
+    return stats
+
+
+def _read_columns(columns, filters, start, end):
+    '''the columns that are read from disk: the selected ones and the ones the rows are filtered on'''
+    if columns is None:
+        return None
+    needed = list(columns)
+    for column, (low, high) in filters.items():
+        if (low is not None or high is not None) and not column in needed:
+            needed.append(column)
+    if (start is not None or end is not None) and not "time" in needed:
+        needed.append("time")
+    return needed
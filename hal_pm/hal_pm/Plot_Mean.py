@@ -2,26 +2,32 @@ from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from hal_pm import Load_Data
+from hal_pm import Time_Cube
+from hal_pm import Render
+from hal_pm import Instrumentation
+import matplotlib.dates as mdates
 
+@Instrumentation.timed(rows_out = False)
 def plot_mean_pm(df, df2 = None, time_interval = None, ax = None):
     '''plots the mean PM10 and PM2.5 concentration over the given location against time'''
     
     '''INPUTS:'''
     
-    '''df:             Pandas Data Frame with PM10 and PM2.5 measurements as column'''
-    '''df2:            optional: second Pandas Data Frame with PM10 and PM2.5 measurements
+    '''df:             Pandas Data Frame with PM10 and PM2.5 measurements as column, or a cube out of Time_Cube.build_cube'''
+    '''df2:            optional: second Pandas Data Frame (or cube) with PM10 and PM2.5 measurements
                        as column. If provided, its series are plotted against the ones in df'''
     '''time_interval:  A String indicating over which time interval to average the data.
                        If none is provided, the function automatically calculates a value that leads
-                       to 25 data points after averaging'''
+                       to 25 data points after averaging (for a cube rounded up to a multiple of its interval)'''
     '''                Look at documentation of pandas.DataFrame.resample to get permissive values'''
     
     '''OUTPUTS:'''
     
     
     
-    df['date_time'] = pd.to_datetime(df['time']) #convert time column to date_time
-    df1 = df[['date_time','measurement_PM10','measurement_PM2.5']] #keep only the columns we need
+    if not Time_Cube.is_cube(df):
+        df = df[['measurement_PM10','measurement_PM2.5']].assign(date_time = Load_Data.time_column(df)) #keep only the columns we need, time is already datetime64
     
     
     ######time_interval over which to average#####
@@ -30,34 +36,39 @@ def plot_mean_pm(df, df2 = None, time_interval = None, ax = None):
         secinday = 60 * 60 * 24 #seconds in a day
         
         #get range of time over which we have data
-        timediff = df['date_time'].iloc[-1] - df['date_time'][0]
+        time_min, time_max = _time_range(df)
+        timediff = time_max - time_min
         
         #30 points make for a good default value for number of data points after averaging
         #get minute value (for smoothing) that leads to 30 points
-        min_smoother = divmod(timediff.days * secinday + timediff.seconds, 60)[0] // 25
+        min_smoother = max(1, divmod(timediff.days * secinday + timediff.seconds, 60)[0] // 25)
+        if Time_Cube.is_cube(df):
+            step = max(1, df['interval'] // pd.Timedelta("1Min"))
+            min_smoother = -(-min_smoother // step) * step #multiple of the interval of the cube
         
         time_interval = str(min_smoother) + "Min" #final value for time_interval
     
     
     
     #average over the given time_interval
-    mean_data1 = df1.set_index('date_time').resample(time_interval, label='right').mean()
-    mean_data1['date_time'] = mean_data1.index.strftime("%H:%M")
+    mean_data1 = _mean_data(df, time_interval)
     
     #get date that data was collected on
-    day1 = df1['date_time'][0].strftime("%Y/%m/%d")
+    day1 = _time_range(df)[0].strftime("%Y/%m/%d")
 
     
     #if a second dataframe is supplied, perform the same averaging operations
     if df2 is not None:
         #same exact as with df1
-        df2['date_time'] = pd.to_datetime(df2['time'])
-        df2 = df2[['date_time','measurement_PM10','measurement_PM2.5']]
-        mean_data2 = df2.set_index('date_time').resample(time_interval, label='right').mean()
-        mean_data2['date_time'] = mean_data2.index.strftime("%H:%M")
+        if not Time_Cube.is_cube(df2):
+            df2 = df2[['measurement_PM10','measurement_PM2.5']].assign(date_time = Load_Data.time_column(df2))
+        mean_data2 = _mean_data(df2, time_interval)
         
         #additionally (for the plot legend), rename columns to include the respecitive dates
-        day2 = df2['date_time'][0].strftime("%y/%m/%d")
+        day2 = _time_range(df2)[0].strftime("%y/%m/%d")
+        
+        #the second window is drawn on the time axis of the first one, so both are compared at the same time of day
+        mean_data2['date_time'] = mean_data2['date_time'] - (_time_range(df2)[0].floor('D') - _time_range(df)[0].floor('D'))
 
         mean_data1 = mean_data1.rename(columns = {'measurement_PM10': 'PM10: ' + day1, 
                                                   'measurement_PM2.5': 'PM2.5: ' + day1})
@@ -67,8 +78,7 @@ def plot_mean_pm(df, df2 = None, time_interval = None, ax = None):
     
     
     ########Plotting###########
-    plt.rc('font', size=20)          # controls default text sizes
-
+    # the axes are drawn on real datetime values, long series are reduced to the resolution of the axes (Render.plot_series)
     _ax = 0
     if ax is None:
         fig, ax = plt.subplots(figsize = (20,10))
@@ -77,10 +87,10 @@ def plot_mean_pm(df, df2 = None, time_interval = None, ax = None):
     if df2 is None:
         mean_data1 = mean_data1.rename(columns = {'measurement_PM10': 'PM10', 
                                                   'measurement_PM2.5': 'PM2.5'})
-        ax.plot('date_time', 'PM10', data = mean_data1, 
-                color = "darkred",  linewidth = 3)
-        ax.plot('date_time', 'PM2.5', data = mean_data1, 
-                color = 'steelblue', linewidth = 3)
+        for column, color in [('PM10', "darkred"), ('PM2.5', 'steelblue')]:
+            Render.plot_series(ax, mean_data1['date_time'].values, mean_data1[column].values,
+                               label = column, color = color, linewidth = 3)
+        Render.date_axis(ax, maxticks = 20)
         ax.set_title("Average PM concentration for " + day1)
 
     
@@ -88,29 +98,43 @@ def plot_mean_pm(df, df2 = None, time_interval = None, ax = None):
         #first, print correlation between the two respective series
         corrpm10 = np.round(np.corrcoef(mean_data1['PM10: ' + day1], mean_data2['PM10: ' + day2])[0,1], 4)
         corrpm25 = np.round(np.corrcoef(mean_data1['PM2.5: ' + day1], mean_data2['PM2.5: ' + day2])[0,1], 4)
-        print("The correlation between the two PM10 series is " + str(corrpm10) + " and \n" +
-             "the correlation between the two PM2.5 series is " + str(corrpm25))
+        Instrumentation.logger.info("The correlation between the two PM10 series is " + str(corrpm10) + " and \n" +
+                                    "the correlation between the two PM2.5 series is " + str(corrpm25))
         
         #then, plotting
-        ax.plot('date_time', 'PM2.5: ' + day1, data = mean_data1, 
-                color = 'skyblue', linewidth = 3)
-        ax.plot('date_time', 'PM10: ' + day1, data = mean_data1, 
-                color = "steelblue", linewidth = 3)
-        ax.plot('date_time', 'PM2.5: ' + day2, data = mean_data2, 
-                color = 'darksalmon', linewidth = 3)
-        ax.plot('date_time', 'PM10: ' + day2, data = mean_data2, 
-                color = 'darkred', linewidth = 3)
+        for mean_data, column, color in [(mean_data1, 'PM2.5: ' + day1, 'skyblue'), (mean_data1, 'PM10: ' + day1, "steelblue"),
+                                         (mean_data2, 'PM2.5: ' + day2, 'darksalmon'), (mean_data2, 'PM10: ' + day2, 'darkred')]:
+            Render.plot_series(ax, mean_data['date_time'].values, mean_data[column].values,
+                               label = column, color = color, linewidth = 3)
+        Render.date_axis(ax, maxticks = 20)
+        ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M")) # both windows share the time of day
         ax.set_title("Average PM concentration for " + day1 + " and " + day2)
-    ax.xaxis.set_major_locator(plt.MaxNLocator(20))
     ax.grid(True)
     ax.legend(loc = "best")
     ax.set_xlabel("Date and Time")
     ax.set_ylabel("μg/m³")
+    Render.set_font(ax, 20) # font size of this plot only, no global plt.rc
 
     if _ax == 1:
         fig.autofmt_xdate(rotation = 45)
 
     return ax
-    
-    
-    
\ No newline at end of file
+
+
+def _time_range(df):
+    '''first and last time of a data frame (with a date_time column) or of a cube'''
+    if Time_Cube.is_cube(df):
+        bins = df['cells']['bin']
+        return df['origin'] + bins.min() * df['interval'], df['origin'] + bins.max() * df['interval']
+    return df['date_time'].min(), df['date_time'].max()
+
+
+def _mean_data(df, time_interval):
+    '''averages a data frame (with a date_time column) or a cube over time_interval, the bins are labelled by their right edge'''
+    if Time_Cube.is_cube(df):
+        mean_data = Time_Cube.mean_series(df, time_interval)
+        mean_data.index = mean_data.index + pd.Timedelta(time_interval)
+    else:
+        mean_data = df.set_index('date_time').resample(time_interval, label='right').mean()
+    mean_data['date_time'] = mean_data.index
+    return mean_data
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+import hashlib
+import importlib.util
+import os
+import warnings
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "hal_pm")
+DEFAULT_SIZE_MB = 1024
+SETTLE_HOURS = 1                    # slices that ended less than SETTLE_HOURS ago may still receive data and are not cached
+
+
+def available():
+    '''returns True if the optional dependency pyarrow (needed to write parquet files) is installed'''
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def check(cache):
+    '''turns the cache off with a warning if pyarrow is not installed'''
+    if cache and not available():
+        warnings.warn("pyarrow is not installed, the query cache is turned off")
+        return False
+    return cache
+
+
+def slice_key(endpoint, time_slice, tile, base_url = None):
+    '''Builds the cache key of one query slice'''
+
+    '''INPUT:'''
+
+    '''endpoint:        name of the endpoint, e.g. P1'''
+    '''time_slice:      tuple of start and end datetime of the slice'''
+    '''tile:            tuple of the latitude range and the longitude range of the tile'''
+    '''base_url:        url of the server, slices of different servers (e.g. a Replay_Server) never share an entry'''
+
+    '''OUTPUT:'''
+
+    '''A string that can be used as file name'''
+
+    desc = endpoint + "_" + time_slice[0].strftime("%Y%m%dT%H%M%S") + "_" + time_slice[1].strftime("%Y%m%dT%H%M%S")
+    digest = hashlib.sha1(repr((base_url, tile[0], tile[1])).encode()).hexdigest()[:16]
+    return desc + "_" + digest
+
+
+def is_final(time_slice, now = None):
+    '''returns True if a slice lies far enough in the past that its data cannot change anymore'''
+    if now is None:
+        now = datetime.now(timezone.utc).replace(tzinfo = None)
+    return time_slice[1] + timedelta(hours = SETTLE_HOURS) < now
+
+
+def read(key, cache_dir = DEFAULT_CACHE_DIR):
+    '''Reads a cached slice, returns None if the slice is not cached. A hit marks the slice as recently used'''
+    path = _path(key, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        df = pd.read_parquet(path)
+    except Exception:                                                   # a corrupt file (e.g. from an interrupted write) counts as a miss
+        os.remove(path)
+        return None
+    os.utime(path)                                                      # the modification time is used as last access time for the LRU eviction
+    return df
+
+
+def write(key, df, cache_dir = DEFAULT_CACHE_DIR, size_mb = DEFAULT_SIZE_MB):
+    '''Writes a slice to the cache and evicts the least recently used slices if the cache exceeds size_mb'''
+    os.makedirs(cache_dir, exist_ok = True)
+    path = _path(key, cache_dir)
+    tmp_path = path + ".tmp"
+    df.to_parquet(tmp_path, index = False)
+    os.replace(tmp_path, path)                                          # atomic, so readers never see half written files
+    evict(cache_dir, size_mb)
+
+
+def evict(cache_dir = DEFAULT_CACHE_DIR, size_mb = DEFAULT_SIZE_MB):
+    '''Deletes the least recently used slices until the cache is smaller than size_mb, returns the number of deleted slices'''
+    if not os.path.isdir(cache_dir):
+        return 0
+    files = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir) if f.endswith(".parquet")]
+    stats = sorted([(os.stat(f).st_mtime, os.stat(f).st_size, f) for f in files])
+    total = sum(s[1] for s in stats)
+    limit = size_mb * 1024 ** 2
+    n_deleted = 0
+    for mtime, size, f in stats:
+        if total <= limit:
+            break
+        os.remove(f)
+        total -= size
+        n_deleted += 1
+    return n_deleted
+
+
+def clear(cache_dir = DEFAULT_CACHE_DIR):
+    '''Deletes all cached slices'''
+    evict(cache_dir, size_mb = 0)
+
+
+def _path(key, cache_dir):
+    return os.path.join(cache_dir, key + ".parquet")
@@ -0,0 +1,184 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import numpy as np
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from hal_pm import Instrumentation
+
+FONT_SIZE = 20
+_TASKS = []                 # tasks of render_all, inherited by forked worker processes instead of being pickled
+
+
+def new_figure(nrows = 1, ncols = 1, figsize = (20, 10), dpi = 100, **kwargs):
+    '''Creates a figure on the Agg canvas without touching the pyplot state machine (no global figure list, no interactive backend)'''
+
+    '''INPUT:'''
+
+    '''nrows, ncols:    Number of subplots'''
+    '''figsize, dpi:    Size of the figure in inches and its resolution'''
+    '''kwargs:          Passed on to Figure.subplots (e.g. sharey)'''
+
+    '''OUTPUT:'''
+
+    '''fig, ax as plt.subplots returns them. The figure is freed as soon as it is not referenced anymore'''
+
+    fig = Figure(figsize = figsize, dpi = dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots(nrows = nrows, ncols = ncols, **kwargs)
+    return fig, ax
+
+
+def save(fig, path, **kwargs):
+    '''writes a figure with the Agg backend'''
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    fig.savefig(path, **kwargs)
+    return path
+
+
+def set_font(ax, size = FONT_SIZE):
+    '''sets the font size of the title, axis labels, tick labels and legend of one axes, instead of changing plt.rc for all figures'''
+    ax.title.set_fontsize(size)
+    ax.xaxis.label.set_fontsize(size)
+    ax.yaxis.label.set_fontsize(size)
+    ax.tick_params(labelsize = size)
+    legend = ax.get_legend()
+    if legend is not None:
+        for text in legend.get_texts():
+            text.set_fontsize(size)
+
+
+def date_axis(ax, maxticks = 10, rotation = 45):
+    '''real datetime x-axis with at most maxticks ticks, the tick labels only show what changes between ticks'''
+    locator = mdates.AutoDateLocator(maxticks = maxticks)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    ax.tick_params(axis = 'x', labelrotation = rotation)
+
+
+def plot_series(ax, x, y, method = "minmax", max_points = None, **kwargs):
+    '''Plots a long series after downsampling it to the resolution of the axes'''
+
+    '''INPUT:'''
+
+    '''ax:              The axes'''
+    '''x, y:            Arrays of the series, x sorted (datetime64 or numbers)'''
+    '''method:          "minmax" (minimum and maximum per pixel column, keeps every spike), "lttb" (largest triangle three buckets,'''
+    '''                 keeps the visual shape with fewer points) or None (no downsampling)'''
+    '''max_points:      Number of points after downsampling, default: one per pixel column of the axes (min and max of every two columns)'''
+    '''kwargs:          Passed on to ax.plot'''
+
+    '''OUTPUT:'''
+
+    '''The lines of ax.plot'''
+
+    if max_points is None:
+        max_points = max(int(ax.get_window_extent().width), 2)
+    if method == "minmax":
+        x, y = minmax(x, y, max_points // 2)
+    elif method == "lttb":
+        x, y = lttb(x, y, max_points)
+    elif method is not None:
+        raise ValueError("method must be minmax, lttb or None")
+    return ax.plot(x, y, **kwargs)
+
+
+def minmax(x, y, n_buckets):
+    '''keeps the minimum and the maximum of every one of n_buckets equally wide x intervals (in their original order).
+    Intervals without a value keep one missing value, so gaps of the series stay visible'''
+    x, y = np.asarray(x), np.asarray(y, dtype = np.float64)
+    n = len(y)
+    if n <= 2 * n_buckets or n_buckets < 1:
+        return x, y
+    xf = _as_float(x)
+    span = xf[-1] - xf[0]
+    bucket = np.zeros(n, dtype = np.int64) if span <= 0 else np.minimum(((xf - xf[0]) / span * n_buckets).astype(np.int64), n_buckets - 1)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    counts = np.diff(np.r_[starts, n])
+    position = np.arange(n)
+    lowest = np.repeat(np.fmin.reduceat(y, starts), counts)
+    highest = np.repeat(np.fmax.reduceat(y, starts), counts)
+    first_min = np.minimum.reduceat(np.where(y == lowest, position, n), starts)              # first position of the minimum of every bucket
+    first_max = np.minimum.reduceat(np.where(y == highest, position, n), starts)
+    empty = first_min == n                                                                    # only missing values in the bucket
+    keep = np.unique(np.r_[first_min[~empty], first_max[~empty], starts[empty]])
+    return x[keep], y[keep]
+
+
+def lttb(x, y, n_out):
+    '''largest triangle three buckets downsampling to n_out points (Steinarsson 2013), missing values are left out'''
+    x, y = np.asarray(x), np.asarray(y, dtype = np.float64)
+    valid = ~np.isnan(y)
+    x, y = x[valid], y[valid]
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return x, y
+    xf = _as_float(x)
+    edges = np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.int64)                       # n_out - 2 buckets between the first and the last point
+    selected = np.empty(n_out, dtype = np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = xf[edges[i + 1]:edges[i + 2]].mean(), y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = xf[n - 1], y[n - 1]
+        area = np.abs((xf[a] - next_x) * (y[start:end] - y[a]) - (xf[a] - xf[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return x[selected], y[selected]
+
+
+def render_all(tasks, max_workers = None):
+    '''Renders independent figures in parallel worker processes'''
+
+    '''INPUT:'''
+
+    '''tasks:           List of dictionaries with function, path and optionally args, kwargs and figure (arguments of new_figure).'''
+    '''                 The figure is created with new_figure and function(*args, ax = ax, **kwargs) draws into it.'''
+    '''                 function must be defined at module level'''
+    '''max_workers:     Number of processes, default: one per task (at most the number of CPUs). 1 renders in this process'''
+
+    '''OUTPUT:'''
+
+    '''List of the written files'''
+
+    global _TASKS
+    if max_workers is None:
+        max_workers = min(len(tasks), os.cpu_count() or 1)
+    if max_workers <= 1 or len(tasks) <= 1:
+        return [_render(task) for task in tasks]
+
+    # with fork the workers inherit the tasks (and their data) instead of receiving a pickled copy
+    if "fork" in multiprocessing.get_all_start_methods():
+        _TASKS = tasks
+        try:
+            with ProcessPoolExecutor(max_workers = max_workers, mp_context = multiprocessing.get_context("fork")) as pool:
+                return list(pool.map(_render_index, range(len(tasks))))
+        finally:
+            _TASKS = []
+    with ProcessPoolExecutor(max_workers = max_workers) as pool:
+        return list(pool.map(_render, tasks))
+
+
+def _render(task):
+    with Instrumentation.stage("render", path = task["path"]):
+        fig, ax = new_figure(**task.get("figure", {}))
+        task["function"](*task.get("args", ()), ax = ax, **task.get("kwargs", {}))
+        with Instrumentation.stage("save"):
+            return save(fig, task["path"])
+
+
+def _render_index(i):
+    return _render(_TASKS[i])
+
+
+def _as_float(x):
+    '''numbers for the x positions, datetime64 as nanoseconds'''
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
@@ -0,0 +1,143 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+import requests
+
+
+def record(url, data, record_dir):
+    '''Posts a query to the real REST-API and stores the response so it can be replayed later'''
+
+    '''INPUT:'''
+
+    '''url:             full url of the endpoint, e.g. http://sensordata.gwdg.de/api/measurements/P1'''
+    '''data:            body of the query as string'''
+    '''record_dir:      directory in which the responses are stored'''
+
+    '''OUTPUT:'''
+
+    '''file path of the recorded response'''
+
+    path = url.split("/api/")[-1]
+    response = requests.post(url, data = data)
+    response.raise_for_status()
+    os.makedirs(record_dir, exist_ok = True)
+    file_path = os.path.join(record_dir, _response_name(path, data))
+    with open(file_path, "wb") as f:
+        f.write(response.content)
+    return file_path
+
+
+def serve(record_dir, port = 0):
+    '''Starts a local stand-in for sensordata.gwdg.de that replays recorded responses'''
+
+    '''INPUT:'''
+
+    '''record_dir:      directory with responses written by record()'''
+    '''port:            port of the server, 0 picks a free port'''
+
+    '''OUTPUT:'''
+
+    '''the running server and its base url, which can be passed as base_url to Load_Data.load_data.
+       Queries without a recording are answered with an empty result. Stop the server with server.shutdown()'''
+
+    handler = type("ReplayHandler", (_ReplayHandler,), {"record_dir": record_dir})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    base_url = "http://127.0.0.1:" + str(server.server_address[1]) + "/api/"
+    return server, base_url
+
+
+def serve_frame(df, port = 0, record_dir = None):
+    '''Starts a local stand-in for sensordata.gwdg.de that answers every query from a data frame, e.g. to replay a live feed'''
+
+    '''INPUT:'''
+
+    '''df:              data frame out of load_data (sensor_id, time, lat, lon, measurement_PM10, measurement_PM2.5)'''
+    '''port:            port of the server, 0 picks a free port'''
+    '''record_dir:      if given, every response is also stored there as by record(), so that the same queries can be'''
+    '''                 replayed by serve() without computing the responses again'''
+
+    '''OUTPUT:'''
+
+    '''the running server and its base url. Queries are answered with the rows in their time range and area, as the REST-API.
+       Set server.now to a timestamp to only serve the rows up to that time (measurements that have "arrived" so far),
+       None serves all rows. Stop the server with server.shutdown()'''
+
+    df = df.assign(time = pd.to_datetime(df["time"])).sort_values("time", kind = "stable").reset_index(drop = True)
+    if record_dir is not None:
+        os.makedirs(record_dir, exist_ok = True)
+    handler = type("FrameHandler", (_FrameHandler,), {"frame": df, "record_dir": record_dir})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.now = None
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    base_url = "http://127.0.0.1:" + str(server.server_address[1]) + "/api/"
+    return server, base_url
+
+
+def _response_name(path, data):
+    '''file name of a recorded response: the endpoint and a hash of the query'''
+    digest = hashlib.sha1(data.encode() if isinstance(data, str) else data).hexdigest()
+    return path.strip("/").replace("/", "_") + "_" + digest + ".json"
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    record_dir = None
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("/api/")[-1]
+        file_path = os.path.join(self.record_dir, _response_name(path, data))
+        if os.path.exists(file_path):
+            with open(file_path, "rb") as f:
+                body = f.read()
+        else:
+            column = path.strip("/").split("/")[-1]
+            body = json.dumps([["sensor_id", "time", "lat", "lon", column], "sensor", []]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _FrameHandler(BaseHTTPRequestHandler):
+    frame = None
+    record_dir = None
+    columns = {"P1": "measurement_PM10", "P2": "measurement_PM2.5"}
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        query = json.loads(data)
+        column = self.path.strip("/").split("/")[-1]
+        start = pd.Timestamp(query["timeStart"]).tz_localize(None)
+        end = pd.Timestamp(query["timeEnd"]).tz_localize(None)
+        if self.server.now is not None:
+            end = min(end, pd.Timestamp(self.server.now))
+        lat, lon = query["area"]["coordinates"]
+
+        times = self.frame["time"].values
+        rows = self.frame.iloc[np.searchsorted(times, start.to_datetime64(), side = "left"):
+                               np.searchsorted(times, end.to_datetime64(), side = "right")]
+        rows = rows[(rows["lat"] >= lat[0]) & (rows["lat"] <= lat[1]) & (rows["lon"] >= lon[0]) & (rows["lon"] <= lon[1])]
+        values = [None if np.isnan(v) else v for v in rows[self.columns[column]].astype(float).tolist()]        # missing values are null
+        body = json.dumps([["sensor_id", "time", "lat", "lon", column], "sensor",
+                           list(zip(rows["sensor_id"].astype(int).tolist(), rows["time"].dt.strftime("%Y-%m-%dT%H:%M:%S").tolist(),
+                                    rows["lat"].astype(float).tolist(), rows["lon"].astype(float).tolist(), values))]).encode()
+        if self.record_dir is not None:
+            with open(os.path.join(self.record_dir, _response_name(self.path.split("/api/")[-1], data)), "wb") as f:
+                f.write(body)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+from hal_pm import Load_Data
+from hal_pm import Boundaries
+
+CELL_DEG = 0.05             # edge length (in degrees) of the cells of the grid index, about 5 km
+EARTH_RADIUS_KM = 6371.0
+
+
+def build_registry(df, lat = "lat", lon = "lon", cell_deg = CELL_DEG):
+    '''Builds a table with one row per sensor out of measurements, sensors do not move, so their location only has to be
+    stored once and spatial work can be done per sensor instead of per row'''
+
+    '''INPUT:'''
+
+    '''df:              data frame out of load_data (or a chunk of it), needs the columns sensor_id, time, lat and lon'''
+    '''lat, lon:        column names of the sensor location'''
+    '''cell_deg:        edge length (in degrees) of the cells of the grid index used by in_bbox and within_radius, type: float'''
+
+    '''OUTPUT:'''
+
+    '''registry:        dictionary with sensors (data frame sorted by sensor_id: sensor_id, lat, lon, first_seen, last_seen, rows),'''
+    '''                 cell_deg, grid (cell numbers of the sensors, sorted, and the sensor positions in that order) and'''
+    '''                 boundaries (the boundary file of the polygon_id column, see assign_polygons)'''
+
+    # Defensive programming
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError("df must be a pandas dataframe")
+    for column in ["sensor_id", "time", lat, lon]:
+        if not column in df:
+            raise NameError(column + " is not a column of df")
+    if not (isinstance(cell_deg, float) or isinstance(cell_deg, int)) or cell_deg <= 0:
+        raise ValueError("cell_deg must be a positive number")
+
+    registry = {"sensors": _summarise(df, lat, lon), "cell_deg": cell_deg, "boundaries": None}
+    registry["grid"] = _grid(registry["sensors"], cell_deg)
+    return registry
+
+
+def update(registry, df, lat = "lat", lon = "lon"):
+    '''Adds the sensors of new measurements (e.g. the next chunk of load_data) to a registry: first_seen, last_seen and rows
+    are merged, a sensor that reports a new location keeps the new one. Polygons are assigned again for new or moved sensors'''
+    if len(df) == 0:
+        return registry
+    new = _summarise(df, lat, lon)
+    known = registry["sensors"]
+    position = pd.Index(known["sensor_id"]).get_indexer(new["sensor_id"])
+    old = position >= 0
+    if old.any():
+        previous = known.iloc[position[old]]
+        new.loc[old, "first_seen"] = np.minimum(new.loc[old, "first_seen"].values, previous["first_seen"].values)
+        new.loc[old, "last_seen"] = np.maximum(new.loc[old, "last_seen"].values, previous["last_seen"].values)
+        new.loc[old, "rows"] = new.loc[old, "rows"].values + previous["rows"].values
+    sensors = pd.concat([known[~known["sensor_id"].isin(new["sensor_id"])].drop(columns = "polygon_id", errors = "ignore"), new])
+    registry = dict(registry, sensors = sensors.sort_values("sensor_id", ignore_index = True))
+    registry["grid"] = _grid(registry["sensors"], registry["cell_deg"])
+    if registry["boundaries"] is not None:
+        registry = assign_polygons(registry, registry["boundaries"])                        # memoized, only new or moved sensors are looked up
+    return registry
+
+
+def in_bbox(registry, lat_start, lat_end, long_start, long_end):
+    '''sensor_ids of the sensors within a bounding box (borders included), only the sensors of the grid cells that overlap it are compared'''
+    candidates = _candidates(registry, lat_start, lat_end, long_start, long_end)
+    sensors = registry["sensors"].iloc[candidates]
+    keep = (sensors["lat"].values >= lat_start) & (sensors["lat"].values <= lat_end) & \
+           (sensors["lon"].values >= long_start) & (sensors["lon"].values <= long_end)
+    return sensors["sensor_id"].values[keep]
+
+
+def within_radius(registry, lat, lon, radius_km):
+    '''sensor_ids of the sensors at most radius_km (great circle distance) away from (lat, lon)'''
+    if radius_km < 0:
+        raise ValueError("radius_km must not be negative")
+    d_lat = np.degrees(radius_km / EARTH_RADIUS_KM)
+    d_lon = d_lat / max(np.cos(np.radians(min(abs(lat) + d_lat, 90))), 1e-12)              # widest at the border closest to the pole
+    candidates = _candidates(registry, lat - d_lat, lat + d_lat, lon - d_lon, lon + d_lon)
+    sensors = registry["sensors"].iloc[candidates]
+    distance = haversine(lat, lon, sensors["lat"].values.astype(np.float64), sensors["lon"].values.astype(np.float64))
+    return sensors["sensor_id"].values[distance <= radius_km]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    '''great circle distance in km between points given in degrees'''
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def assign_polygons(registry, geo_boundaries, cache_dir = Boundaries.DEFAULT_CACHE_DIR):
+    '''Adds the column polygon_id (index of the polygon in the boundaries, NaN outside of all polygons) to the sensors of a
+    registry. The point in polygon lookup is done once per sensor (Boundaries.assign_sensors)'''
+    polygon_id = Boundaries.assign_sensors(geo_boundaries, registry["sensors"], cache_dir = cache_dir)
+    sensors = registry["sensors"].assign(polygon_id = registry["sensors"]["sensor_id"].map(polygon_id))
+    return dict(registry, sensors = sensors, boundaries = geo_boundaries)
+
+
+def polygon_of(registry, geo_boundaries, cache_dir = Boundaries.DEFAULT_CACHE_DIR):
+    '''Series indexed by sensor_id with the polygon of every sensor inside the boundaries, as Boundaries.assign_sensors'''
+    if registry["boundaries"] != geo_boundaries:
+        return Boundaries.assign_sensors(geo_boundaries, registry["sensors"], cache_dir = cache_dir)
+    sensors = registry["sensors"][registry["sensors"]["polygon_id"].notna()]
+    return pd.Series(sensors["polygon_id"].values.astype(np.int64), index = sensors["sensor_id"].values, name = "polygon_id")
+
+
+def strip(df, lat = "lat", lon = "lon"):
+    '''the measurements without the location columns, which repeat the location of the sensor in every row (see join_location)'''
+    return df.drop(columns = [c for c in [lat, lon] if c in df])
+
+
+def join_location(registry, df, lat = "lat", lon = "lon"):
+    '''adds the location of the sensors of the registry to the rows of df (NaN for sensors that are not in the registry)'''
+    position = pd.Index(registry["sensors"]["sensor_id"]).get_indexer(df["sensor_id"])
+    found = position >= 0
+    columns = {}
+    for name, column in [(lat, "lat"), (lon, "lon")]:
+        values = registry["sensors"][column].values
+        columns[name] = np.where(found, values[np.maximum(position, 0)], np.nan).astype(values.dtype)
+    return df.assign(**columns)
+
+
+def sensors_of(registry, df):
+    '''the rows of the registry of the sensors that occur in df'''
+    sensors = registry["sensors"]
+    return sensors[np.isin(sensors["sensor_id"].values, pd.unique(df["sensor_id"]))].reset_index(drop = True)
+
+
+def _summarise(df, lat, lon):
+    '''one row per sensor of df: the first location, first and last time and the number of rows'''
+    grouped = pd.DataFrame({"sensor_id": df["sensor_id"].values, "lat": df[lat].values, "lon": df[lon].values,
+                            "time": Load_Data.time_column(df).values}).groupby("sensor_id", sort = True)
+    sensors = pd.DataFrame({"lat": grouped["lat"].first(), "lon": grouped["lon"].first(), "first_seen": grouped["time"].min(),
+                            "last_seen": grouped["time"].max(), "rows": grouped.size()})
+    return sensors.reset_index()
+
+
+def _cell(lat, lon, cell_deg):
+    '''cell numbers of the grid index, the cells of one row of latitude are numbered consecutively from west to east'''
+    row = np.floor((np.asarray(lat, dtype = np.float64) + 90) / cell_deg)
+    column = np.floor((np.asarray(lon, dtype = np.float64) + 180) / cell_deg)
+    return row, column
+
+
+def _grid(sensors, cell_deg):
+    row, column = _cell(sensors["lat"].values, sensors["lon"].values, cell_deg)
+    width = int(np.ceil(360 / cell_deg)) + 1
+    key = np.where(np.isnan(row) | np.isnan(column), -1, row * width + column).astype(np.int64)   # -1: sensors without a location
+    order = np.argsort(key, kind = "stable")
+    return {"keys": key[order], "order": order, "width": width}
+
+
+def _candidates(registry, lat_start, lat_end, long_start, long_end):
+    '''positions of the sensors in the grid cells that overlap a bounding box, one binary search per row of cells'''
+    grid = registry["grid"]
+    (row_start, row_end), (column_start, column_end) = [np.clip(v, 0, grid["width"] - 1).astype(np.int64) for v in
+                                                        _cell([lat_start, lat_end], [long_start, long_end], registry["cell_deg"])]
+    if lat_end < lat_start or long_end < long_start:
+        return np.empty(0, dtype = np.int64)
+    rows = np.arange(row_start, row_end + 1) * grid["width"]
+    starts = np.searchsorted(grid["keys"], rows + column_start, side = "left")
+    ends = np.searchsorted(grid["keys"], rows + column_end, side = "right")
+    if len(rows) == 0 or (ends - starts).sum() == 0:
+        return np.empty(0, dtype = np.int64)
+    return np.sort(np.concatenate([grid["order"][s:e] for s, e in zip(starts, ends) if e > s]))
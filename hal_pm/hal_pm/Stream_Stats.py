@@ -0,0 +1,102 @@
+import numpy as np
+
+DEFAULT_COMPRESSION = 200           # a t-digest keeps about compression / 2 centroids, more centroids give more accurate quantiles
+
+
+def moments(values):
+    '''Computes the running moments (count, mean, sum of squared deviations) of a chunk'''
+
+    '''INPUT:'''
+
+    '''values:          2d array, one column per variable. NaN values are ignored'''
+
+    '''OUTPUT:'''
+
+    '''dictionary with the arrays n, mean and m2 (one entry per column), can be merged with merge_moments'''
+
+    values = np.asarray(values, dtype = np.float64)
+    valid = ~np.isnan(values)
+    n = valid.sum(axis = 0).astype(np.float64)
+    total = np.where(valid, values, 0).sum(axis = 0)
+    mean = np.divide(total, n, out = np.zeros_like(total), where = n > 0)
+    m2 = (np.where(valid, values - mean, 0) ** 2).sum(axis = 0)
+    return {"n": n, "mean": mean, "m2": m2}
+
+
+def merge_moments(a, b):
+    '''Merges the moments of two chunks (the parallel form of Welford's update, exact up to floating point)'''
+    if a is None:
+        return b
+    if b is None:
+        return a
+    n = a["n"] + b["n"]
+    delta = b["mean"] - a["mean"]
+    weight = np.divide(b["n"], n, out = np.zeros_like(n), where = n > 0)
+    mean = a["mean"] + delta * weight
+    m2 = a["m2"] + b["m2"] + delta ** 2 * a["n"] * weight
+    return {"n": n, "mean": mean, "m2": m2}
+
+
+def std(m):
+    '''sample standard deviation (ddof = 1, as pandas) from merged moments'''
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return np.sqrt(m["m2"] / (m["n"] - 1))
+
+
+def digest(values, compression = DEFAULT_COMPRESSION):
+    '''Builds a t-digest quantile sketch of a chunk'''
+
+    '''INPUT:'''
+
+    '''values:          1d array, NaN values are ignored'''
+    '''compression:     size parameter of the sketch, type: int'''
+
+    '''OUTPUT:'''
+
+    '''dictionary with the centroid means and weights and the exact minimum and maximum, can be merged with merge_digests'''
+
+    values = np.asarray(values, dtype = np.float64)
+    values = np.sort(values[~np.isnan(values)])
+    return _compress(values, np.ones(len(values)), compression)
+
+
+def merge_digests(digests, compression = DEFAULT_COMPRESSION):
+    '''Merges several t-digests into one, the result does not depend on how the data was split into chunks (up to the sketch error)'''
+    digests = [d for d in digests if d is not None and len(d["weight"]) > 0]
+    if len(digests) == 0:
+        return _compress(np.empty(0), np.empty(0), compression)
+    means = np.concatenate([d["mean"] for d in digests])
+    weights = np.concatenate([d["weight"] for d in digests])
+    order = np.argsort(means, kind = "stable")
+    merged = _compress(means[order], weights[order], compression)
+    merged["min"] = min(d["min"] for d in digests)
+    merged["max"] = max(d["max"] for d in digests)
+    return merged
+
+
+def digest_quantile(d, q):
+    '''Approximate q-quantile (0 <= q <= 1) of a t-digest, the centroids are interpolated linearly'''
+    total = d["weight"].sum()
+    if total == 0:
+        return np.nan
+    if q <= 0:
+        return d["min"]
+    if q >= 1:
+        return d["max"]
+    centre = np.cumsum(d["weight"]) - d["weight"] / 2                                     # rank of the centre of every centroid
+    return float(np.interp(q * total, np.r_[0, centre, total], np.r_[d["min"], d["mean"], d["max"]]))
+
+
+def _compress(means, weights, compression):
+    '''merges sorted centroids so that no centroid spans more than one unit of the scale function k(q) = compression / (2 pi) * asin(2q - 1),
+    centroids are therefore small in the tails (accurate extreme quantiles) and large around the median'''
+    if len(means) == 0:
+        return {"mean": np.empty(0), "weight": np.empty(0), "min": np.nan, "max": np.nan}
+    total = weights.sum()
+    q = (np.cumsum(weights) - weights / 2) / total
+    k = compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+    bucket = np.floor(k - k[0]).astype(np.int64)                                           # sorted input, so buckets are contiguous
+    weight = np.bincount(bucket, weights = weights)
+    keep = weight > 0
+    mean = np.bincount(bucket, weights = means * weights)[keep] / weight[keep]
+    return {"mean": mean, "weight": weight[keep], "min": means[0], "max": means[-1]}
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+from hal_pm import Load_Data
+
+BBOX = (51.3, 53.8, 6.7, 11.6)             # lat_start, lat_end, long_start, long_end: about the size of Lower Saxony
+
+
+def sensor_frame(n_sensors = 1500, hours = 24, sampling_seconds = 145, start = "2021-06-01", bbox = BBOX, missing_rate = 0.01,
+                 outlier_rate = 0.001, seed = 0, measurement_id = False):
+    '''Generates sensor data in the exact schema of load_data, e.g. to measure the analysis functions at production scale without the REST-API'''
+
+    '''INPUT:'''
+
+    '''n_sensors:       number of sensors, type: int, default: 1500'''
+    '''hours:           length of the time span, type: int or float, default: 24'''
+    '''sampling_seconds: seconds between two readings of a sensor, every sensor reports with its own offset, type: int, default: 145'''
+    '''start:           start of the time span, type: str or datetime, default: 2021-06-01'''
+    '''bbox:            (lat_start, lat_end, long_start, long_end) in which the sensors are placed uniformly'''
+    '''missing_rate:    share of the rows with a missing PM10 or PM2.5 value (or both), type: float, default: 0.01'''
+    '''outlier_rate:    share of the rows with a spike (10 to 50 times the usual value, as broken or wet sensors report), default: 0.001'''
+    '''seed:            seed of the random generator, the same arguments always give the same frame'''
+    '''measurement_id:  if True, the column measurement_id is added (as load_data(..., measurement_id = True))'''
+
+    '''OUTPUT:'''
+
+    '''data frame with the columns and types of Load_Data.SCHEMA in the column order of load_data, sorted by time.'''
+    '''Every sensor has its own level, PM2.5 follows PM10 with a sensor specific ratio and both follow a daily cycle'''
+
+    # Defensive programming
+    if not isinstance(n_sensors, int) or n_sensors < 1:
+        raise ValueError("n_sensors must be a positive integer")
+    if not (isinstance(hours, float) or isinstance(hours, int)) or hours <= 0:
+        raise ValueError("hours must be a positive number")
+    if not isinstance(sampling_seconds, int) or sampling_seconds < 1:
+        raise ValueError("sampling_seconds must be a positive integer")
+    if not (0 <= missing_rate <= 1 and 0 <= outlier_rate <= 1):
+        raise ValueError("missing_rate and outlier_rate must lie between 0 and 1")
+
+    rng = np.random.default_rng(seed)
+    n_times = max(int(hours * 3600 // sampling_seconds), 1)
+    n = n_times * n_sensors
+
+    # sensors: id, location, level, PM2.5 / PM10 ratio and the offset of their clock
+    sensor_id = rng.choice(np.arange(1000, 1000 + max(80 * n_sensors, 79000)), n_sensors, replace = False)
+    lat = rng.uniform(bbox[0], bbox[1], n_sensors)
+    lon = rng.uniform(bbox[2], bbox[3], n_sensors)
+    level = rng.lognormal(np.log(12), 0.4, n_sensors)
+    ratio = rng.uniform(0.4, 0.8, n_sensors)
+    offset = rng.integers(0, sampling_seconds, n_sensors)
+
+    # rows in time order: reading i of every sensor, then reading i + 1, ...
+    sensor = np.tile(np.arange(n_sensors), n_times)
+    seconds = np.repeat(np.arange(n_times, dtype = np.int64) * sampling_seconds, n_sensors) + offset[sensor]
+    time = np.datetime64(pd.Timestamp(start).to_datetime64(), "ns") + seconds.astype("timedelta64[s]")
+    hour = (time - time.astype("datetime64[D]")).astype(np.int64) / 3.6e12
+    cycle = 1 + 0.3 * np.sin(2 * np.pi * (hour - 8) / 24)                                      # more particles in the morning and evening
+    pm10 = level[sensor] * cycle * rng.gamma(8, 1 / 8, n)
+    pm25 = pm10 * ratio[sensor] * rng.gamma(16, 1 / 16, n)
+
+    spikes = rng.random(n) < outlier_rate
+    factor = rng.uniform(10, 50, spikes.sum())
+    pm10[spikes] *= factor
+    pm25[spikes] *= factor
+    missing = np.flatnonzero(rng.random(n) < missing_rate)
+    which = rng.integers(0, 3, len(missing))                                                    # 0: PM10, 1: PM2.5, 2: both
+    pm10[missing[which != 1]] = np.nan
+    pm25[missing[which != 0]] = np.nan
+
+    df = pd.DataFrame({"measurement_PM10": pm10, "measurement_PM2.5": pm25, "time": time,
+                       "lat": lat[sensor], "lon": lon[sensor], "sensor_id": sensor_id[sensor]})
+    df = Load_Data.apply_schema(df.sort_values("time", kind = "stable", ignore_index = True))
+    if measurement_id == True:
+        df = Load_Data.add_measurement_id(df)
+    return df
+
+
+def polygon_grid(file_path, lat_start = BBOX[0], lat_end = BBOX[1], long_start = BBOX[2], long_end = BBOX[3], n = 60):
+    '''Writes an n x n grid of rectangular postcode-like polygons (property plz, as the postcode boundaries) as geojson,
+    the boundaries for Map.map_data on data of sensor_frame. Returns file_path'''
+    lat_edges = np.linspace(lat_start, lat_end, n + 1)
+    long_edges = np.linspace(long_start, long_end, n + 1)
+    polygons = [box(long_edges[j], lat_edges[i], long_edges[j+1], lat_edges[i+1]) for i in range(n) for j in range(n)]
+    gpd.GeoDataFrame({"plz": [str(i).zfill(5) for i in range(n * n)]}, geometry = polygons, crs = 4326).to_file(file_path, driver = "GeoJSON")
+    return file_path
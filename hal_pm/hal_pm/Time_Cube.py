@@ -0,0 +1,293 @@
+import numpy as np
+import pandas as pd
+from hal_pm import Load_Data
+from hal_pm import Instrumentation
+
+MEASUREMENTS = ["measurement_PM10", "measurement_PM2.5"]
+
+
+@Instrumentation.timed(rows_out = False)
+def build_cube(df, base_interval = "1Min", lat = "lat", lon = "lon", measurements = MEASUREMENTS, origin = None):
+    '''Aggregates the measurements to a (time bin x sensor) cube in a single pass over the rows'''
+    '''Plot_Mean.plot_mean_pm, Descriptive_Stats.plot_mean_pm, Time_Plots.plot_average_pol and Map.map_data accept the cube instead of
+    the data frame, coarser time intervals and polygon rollups are then derived from the cube without touching the rows again'''
+
+    '''INPUT:'''
+
+    '''df:                  data frame out of load_data (after filtering), needs the columns time, sensor_id, lat, lon and the measurements'''
+    '''base_interval:       finest time interval of the cube, all later intervals must be multiples of it (e.g. 1Min, 5Min, 1h), type: str'''
+    '''lat, lon:            column names of the sensor location'''
+    '''measurements:        list of the measurement columns'''
+    '''origin:              start of bin 0, default: midnight of the first day of df'''
+
+    '''OUTPUT:'''
+
+    '''cube:                dictionary with origin (midnight of the first day, as the default origin of pandas resample),'''
+    '''                     interval, measurements, sensors (data frame of sensor_id, lat, lon; row i is sensor i of the cells) and'''
+    '''                     cells (data frame with one row per non-empty time bin and sensor: bin, sensor and'''
+    '''                     <measurement>_count/_sum/_sumsq/_min/_max, missing values are not counted)'''
+
+    # Defensive programming
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError("df must be a pandas dataframe")
+    for column in ["time", "sensor_id", lat, lon] + list(measurements):
+        if not column in df:
+            raise NameError(column + " is not a column of df")
+    if not isinstance(base_interval, (str, pd.Timedelta)):
+        raise TypeError("base_interval must be a string")
+    if len(df) == 0 and origin is None:
+        raise ValueError("df does not contain any rows")
+
+    time = Load_Data.time_column(df).values.astype("datetime64[ns]")
+    origin = time.min().astype("datetime64[D]").astype("datetime64[ns]") if origin is None else pd.Timestamp(origin).to_datetime64()
+    step = pd.Timedelta(base_interval).value
+    bins = (time - origin).astype(np.int64) // step
+    codes, _ = pd.factorize(df["sensor_id"])
+    n_sensors = codes.max() + 1 if len(codes) else 0
+
+    # sort once by (bin, sensor), every cell is then one contiguous block that is reduced with ufunc.reduceat
+    key = bins * max(n_sensors, 1) + codes
+    order = np.argsort(key, kind = "stable")
+    key = key[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(key) else np.empty(0, dtype = np.int64)
+    cells = {"bin": key[starts] // max(n_sensors, 1), "sensor": key[starts] % max(n_sensors, 1)}
+    for m in measurements:
+        x = df[m].values[order].astype(np.float64)
+        valid = ~np.isnan(x)
+        x0 = np.where(valid, x, 0)
+        cells[m + "_count"] = np.add.reduceat(valid.astype(np.int64), starts) if len(x) else np.empty(0, dtype = np.int64)
+        cells[m + "_sum"] = np.add.reduceat(x0, starts) if len(x) else np.empty(0)
+        cells[m + "_sumsq"] = np.add.reduceat(x0 ** 2, starts) if len(x) else np.empty(0)
+        minimum = np.minimum.reduceat(np.where(valid, x, np.inf), starts) if len(x) else np.empty(0)
+        maximum = np.maximum.reduceat(np.where(valid, x, -np.inf), starts) if len(x) else np.empty(0)
+        cells[m + "_min"] = np.where(np.isinf(minimum), np.nan, minimum)
+        cells[m + "_max"] = np.where(np.isinf(maximum), np.nan, maximum)
+
+    first = np.unique(codes, return_index = True)[1]                                        # first row of every sensor
+    sensors = df[["sensor_id", lat, lon]].iloc[first].rename(columns = {lat: "lat", lon: "lon"}).reset_index(drop = True)
+    return {"origin": pd.Timestamp(origin), "interval": pd.Timedelta(base_interval), "measurements": list(measurements),
+            "sensors": sensors, "cells": pd.DataFrame(cells)}
+
+
+def append(cube, df, lat = "lat", lon = "lon"):
+    '''Adds new rows (e.g. the newest measurements of a live region) to a cube'''
+    '''Only the cells from the first time bin of the new rows on are combined again, the older cells are kept as they are.
+    For rows that are newer than the cube this is the last bin of the cube at most, so the cost grows with the new rows'''
+
+    '''OUTPUT:'''
+
+    '''the cube with the new rows, new sensors are added to the sensors of the cube'''
+
+    if len(df) == 0:
+        return cube
+    delta = build_cube(df, base_interval = cube["interval"], lat = lat, lon = lon, measurements = cube["measurements"], origin = cube["origin"])
+
+    # the sensor numbers of the new cells are translated to those of the cube, unknown sensors are numbered after the known ones
+    position = pd.Index(cube["sensors"]["sensor_id"]).get_indexer(delta["sensors"]["sensor_id"])
+    new = position < 0
+    position[new] = len(cube["sensors"]) + np.arange(new.sum())
+    sensors = pd.concat([cube["sensors"], delta["sensors"][new]], ignore_index = True) if new.any() else cube["sensors"]
+    cells = delta["cells"].assign(sensor = position[delta["cells"]["sensor"].values])
+
+    old = cube["cells"]
+    split = np.searchsorted(old["bin"].values, cells["bin"].values.min(), side = "left")          # the cells are sorted by bin
+    tail = _reduce(pd.concat([old.iloc[split:], cells], ignore_index = True), ["bin", "sensor"], cube["measurements"])
+    return dict(cube, sensors = sensors, cells = pd.concat([old.iloc[:split], tail], ignore_index = True))
+
+
+def build_cube_stream(chunks, base_interval = "1Min", lat = "lat", lon = "lon", measurements = MEASUREMENTS, origin = None):
+    '''Builds a cube out of data frames that are read one after the other (e.g. Measurement_Store.scan or load_data with
+    chunksize), only one chunk and the cells are held in memory. Takes the arguments of build_cube, the default origin is
+    midnight of the first day of the first chunk. The chunks can overlap in time, their cells are combined once at the end'''
+    cube, parts = None, []
+    for df in chunks:
+        if len(df) == 0:
+            continue
+        delta = build_cube(df, base_interval = base_interval, lat = lat, lon = lon, measurements = measurements, origin = origin)
+        if cube is None:
+            cube, origin = delta, delta["origin"]
+            parts.append(delta["cells"])
+            continue
+        position = pd.Index(cube["sensors"]["sensor_id"]).get_indexer(delta["sensors"]["sensor_id"])
+        new = position < 0
+        position[new] = len(cube["sensors"]) + np.arange(new.sum())
+        if new.any():
+            cube = dict(cube, sensors = pd.concat([cube["sensors"], delta["sensors"][new]], ignore_index = True))
+        parts.append(delta["cells"].assign(sensor = position[delta["cells"]["sensor"].values]))
+    if cube is None:
+        raise ValueError("chunks do not contain any rows")
+    return dict(cube, cells = _reduce(pd.concat(parts, ignore_index = True), ["bin", "sensor"], cube["measurements"]))
+
+
+def expire(cube, start):
+    '''Removes the time bins that end before start (a bin that contains start is kept), e.g. to keep a trailing window'''
+    first = (pd.Timestamp(start) - cube["origin"]) // cube["interval"]
+    split = np.searchsorted(cube["cells"]["bin"].values, first, side = "left")
+    if split == 0:
+        return cube
+    return dict(cube, cells = cube["cells"].iloc[split:].reset_index(drop = True))
+
+
+def is_cube(obj):
+    '''returns True if obj is a cube out of build_cube'''
+    return isinstance(obj, dict) and "cells" in obj and "sensors" in obj
+
+
+def coarsen(cube, interval):
+    '''Returns the cube at a coarser time interval (a multiple of the interval of the cube), computed from the cells only'''
+    rebinned = _rebin(cube, interval)
+    if rebinned is cube:
+        return cube
+    return dict(rebinned, cells = _reduce(rebinned["cells"], ["bin", "sensor"], cube["measurements"]))
+
+
+def mean_series(cube, interval = None):
+    '''Mean of every measurement over all sensors per time bin, the same as df.resample(interval).mean() of the rows'''
+
+    '''OUTPUT:'''
+
+    '''data frame indexed by the start of every time bin (also empty bins, as resample) with one column per measurement'''
+
+    cube = cube if interval is None else _rebin(cube, interval)                             # the reduction below combines the cells anyway
+    totals = _reduce(cube["cells"], ["bin"], cube["measurements"], ("count", "sum")).set_index("bin")
+    totals = totals.reindex(np.arange(totals.index.min(), totals.index.max() + 1))
+    means = _means(totals, cube["measurements"])
+    means.index = pd.DatetimeIndex(_bin_times(cube, totals.index.values))
+    return means
+
+
+def sensor_means(cube):
+    '''Mean of every measurement per sensor over the whole time range, data frame indexed by sensor_id'''
+    totals = _reduce(cube["cells"], ["sensor"], cube["measurements"], ("count", "sum")).set_index("sensor")
+    means = _means(totals, cube["measurements"])
+    means.index = cube["sensors"]["sensor_id"].values[totals.index.values]
+    return means
+
+
+def sensor_series(cube, sensor_id, measurement):
+    '''Time series of the bin means of one sensor, returns the bin starts and the means as arrays'''
+    code = np.flatnonzero(cube["sensors"]["sensor_id"].values == sensor_id)
+    cells = cube["cells"][cube["cells"]["sensor"].values == (code[0] if len(code) else -1)]
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        values = cells[measurement + "_sum"].values / cells[measurement + "_count"].values
+    return _bin_times(cube, cells["bin"].values), values
+
+
+def time_matrix(cube, measurement, interval = None):
+    '''Aligned (time bin x sensor) matrix of the bin means of one measurement, NaN where a sensor has no value in a bin'''
+
+    '''OUTPUT:'''
+
+    '''times:               start of every time bin (rows, also empty bins)'''
+    '''sensor_ids:          sensor_id of every column'''
+    '''matrix:              2d float64 array'''
+
+    cube = cube if interval is None else coarsen(cube, interval)
+    cells = cube["cells"]
+    first = cells["bin"].min() if len(cells) else 0
+    n_bins = cells["bin"].max() - first + 1 if len(cells) else 0
+    matrix = np.full((n_bins, len(cube["sensors"])), np.nan)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        matrix[cells["bin"].values - first, cells["sensor"].values] = cells[measurement + "_sum"].values / cells[measurement + "_count"].values
+    return _bin_times(cube, np.arange(first, first + n_bins)), cube["sensors"]["sensor_id"].values, matrix
+
+
+def polygon_means(cube, polygon_of, interval = None):
+    '''Mean of every measurement per time bin and polygon, as the groupby of Map.map_data on the rows'''
+
+    '''INPUT:'''
+
+    '''polygon_of:          Series indexed by sensor_id with the polygon of every sensor (Boundaries.assign_sensors), other sensors are left out'''
+
+    '''OUTPUT:'''
+
+    '''data frame with the columns time, polygon_id and one column per measurement, one row per non-empty time bin and polygon'''
+
+    cube = cube if interval is None else _rebin(cube, interval)                             # the reduction below combines the cells anyway
+    polygon = cube["sensors"]["sensor_id"].map(polygon_of).values
+    cells = cube["cells"].assign(polygon_id = polygon[cube["cells"]["sensor"].values])
+    cells = cells[cells["polygon_id"].notna()]
+    totals = _reduce(cells, ["bin", "polygon_id"], cube["measurements"], ("count", "sum"))
+    means = _means(totals, cube["measurements"])
+    means.insert(0, "polygon_id", totals["polygon_id"].values)
+    means.insert(0, "time", _bin_times(cube, totals["bin"].values))
+    return means
+
+
+def to_frame(cube, interval = None):
+    '''Long data frame with one row per time bin and sensor: time, sensor_id, lat, lon and count, mean, std, min, max per measurement'''
+    cube = cube if interval is None else coarsen(cube, interval)
+    cells = cube["cells"]
+    frame = cube["sensors"].iloc[cells["sensor"].values].reset_index(drop = True)
+    frame.insert(0, "time", _bin_times(cube, cells["bin"].values))
+    for m in cube["measurements"]:
+        n = cells[m + "_count"].values
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            mean = cells[m + "_sum"].values / n
+            var = (cells[m + "_sumsq"].values - n * mean ** 2) / (n - 1)
+        frame[m + "_count"] = n
+        frame[m + "_mean"] = mean
+        frame[m + "_std"] = np.sqrt(np.maximum(var, 0))
+        frame[m + "_min"] = cells[m + "_min"].values
+        frame[m + "_max"] = cells[m + "_max"].values
+    return frame
+
+
+def _bins_per(cube, interval):
+    '''number of cube bins per interval, raises a ValueError if interval is not a multiple of the interval of the cube'''
+    factor, rest = divmod(pd.Timedelta(interval).value, cube["interval"].value)
+    if factor < 1 or rest != 0:
+        raise ValueError("interval must be a multiple of the interval of the cube (" + str(cube["interval"]) + ")")
+    return factor
+
+
+def _bin_times(cube, bins):
+    '''start times of the bins as datetime64 array'''
+    return cube["origin"].to_datetime64() + np.asarray(bins, dtype = np.int64) * cube["interval"].to_timedelta64()
+
+
+def _rebin(cube, interval):
+    '''the cube with the bin numbers of a coarser interval, the cells of one sensor in the same new bin are not combined yet'''
+    factor = _bins_per(cube, interval)
+    if factor == 1:
+        return cube
+    return dict(cube, interval = pd.Timedelta(interval), cells = cube["cells"].assign(bin = cube["cells"]["bin"].values // factor))
+
+
+def _reduce(cells, by, measurements, stats = ("count", "sum", "sumsq", "min", "max")):
+    '''combines the statistics of the cells with the same by columns (sorted by the by columns). The cells are only sorted
+    if they are not in order already (e.g. coarser time bins of a cube keep the order of the bins), the groups are reduced with ufunc.reduceat'''
+    key = np.zeros(len(cells), dtype = np.int64)
+    uniques = []
+    for column in by:
+        values = cells[column].values
+        if np.issubdtype(values.dtype, np.integer) and len(values) and values.min() >= 0:         # bin and sensor numbers are their own codes
+            codes, labels = values.astype(np.int64), np.arange(values.max() + 1)
+        else:
+            codes, labels = pd.factorize(values, sort = True)
+        key = key * len(labels) + codes
+        uniques.append(labels)
+    order = None
+    if len(key) > 1 and (np.diff(key) < 0).any():
+        order = np.argsort(key, kind = "stable")
+        key = key[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(key) else np.empty(0, dtype = np.int64)
+
+    reduced = {}
+    group_key = key[starts]
+    for column, labels in zip(reversed(by), reversed(uniques)):                                # undo the mixed radix key
+        reduced[column] = np.asarray(labels)[group_key % len(labels)]
+        group_key = group_key // len(labels)
+    reduced = {column: reduced[column] for column in by}
+    ufuncs = {"count": np.add, "sum": np.add, "sumsq": np.add, "min": np.fmin, "max": np.fmax}          # fmin / fmax ignore NaN
+    for m in measurements:
+        for stat in stats:
+            values = cells[m + "_" + stat].values
+            values = values if order is None else values[order]
+            reduced[m + "_" + stat] = ufuncs[stat].reduceat(values, starts) if len(values) else values
+    return pd.DataFrame(reduced)
+
+
+def _means(totals, measurements):
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return pd.DataFrame({m: totals[m + "_sum"].values / totals[m + "_count"].values for m in measurements})
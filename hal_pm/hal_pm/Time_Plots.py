@@ -3,87 +3,83 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from hal_pm import Filter_Data
+from hal_pm import Load_Data
+from hal_pm import Time_Cube
+from hal_pm import Render
+from hal_pm import Instrumentation
 
-def plot_average_pol(df, ax = None):
+@Instrumentation.timed(rows_out = False)
+def plot_average_pol(df, ax = None, k = 1):
     '''Function to plot the time series of the polution of the sensors with the highest/lowest average polution over time'''
-    
+
     '''INPUT:'''
-    
-    '''df:                         dataframe out of load_data function, where missing measurements are removed'''
-    
+
+    '''df:                         dataframe out of load_data function, where missing measurements are removed, or a cube out of'''
+    '''                            Time_Cube.build_cube (the series are then the means of the sensors per time bin of the cube)'''
+    '''k:                          number of sensors with the highest/lowest average that are plotted per subplot, type: int, default: 1'''
+
     '''OUTPUT:'''
-    
+
     '''time series of the polution of the sensors; one per measurement (PM10 and PM2.5)'''
-    
+
     '''Defensive programming'''
-    if df.isnull().values.any() == True:                                                                                     # Check whether data frame contains any NaN, if yes: remove
+    if not isinstance(k, int) or k < 1:
+        raise ValueError("k must be a positive integer")
+    cube = Time_Cube.is_cube(df)
+    if not cube and df.isnull().values.any() == True:                                                                        # Check whether data frame contains any NaN, if yes: remove
         df = Filter_Data.remove_missing(df)
-    
-    '''Find maximum and minimum avergae polututed sensor_id'''
-    # For PM10:
-    max_PM10 = max(df.groupby("sensor_id").mean()['measurement_PM10'])                                                       # group data by sensor_id, average the measurements, save maximum of measurement_PM10
-    min_PM10 = min(df.groupby("sensor_id").mean()['measurement_PM10'])
-    max_PM10_id = df.groupby("sensor_id").mean()[df.groupby("sensor_id").mean()['measurement_PM10'] == max_PM10].index[0]    # get sensor_id of maximum average measurement
-    min_PM10_id = df.groupby("sensor_id").mean()[df.groupby("sensor_id").mean()['measurement_PM10'] == min_PM10].index[0]
-    df_max_PM10 = df.loc[df['sensor_id'] == max_PM10_id]                                                                     # get data frame that contains only measurements of the sensor with maximum average observations
-    df_min_PM10 = df.loc[df['sensor_id'] == min_PM10_id]
-    
-    # For PM2.5
-    max_PM25 = max(df.groupby("sensor_id").mean()['measurement_PM2.5'])
-    min_PM25 = min(df.groupby("sensor_id").mean()['measurement_PM2.5'])
-    max_PM25_id = df.groupby("sensor_id").mean()[df.groupby("sensor_id").mean()['measurement_PM2.5'] == max_PM25].index[0]
-    min_PM25_id = df.groupby("sensor_id").mean()[df.groupby("sensor_id").mean()['measurement_PM2.5'] == min_PM25].index[0]
-    df_max_PM25 = df.loc[df['sensor_id'] == max_PM25_id]
-    df_min_PM25 = df.loc[df['sensor_id'] == min_PM25_id]
-    
+
+    with Instrumentation.stage("sensor_means"):
+        '''Find the k maximum and minimum average polluted sensor_ids'''
+        if cube:
+            means = Time_Cube.sensor_means(df)                                                                                   # average per sensor_id from the sums and counts of the cube
+        else:
+            means = df.groupby("sensor_id")[["measurement_PM10", "measurement_PM2.5"]].mean()                                   # one groupby pass: average of both measurements per sensor_id
+        ids = {("measurement_PM10", "max"): means["measurement_PM10"].nlargest(k).index,                                        # sensor_ids of the k maximum average measurements
+               ("measurement_PM10", "min"): means["measurement_PM10"].nsmallest(k).index,
+               ("measurement_PM2.5", "max"): means["measurement_PM2.5"].nlargest(k).index,
+               ("measurement_PM2.5", "min"): means["measurement_PM2.5"].nsmallest(k).index}
+
+        # sort the data once by sensor_id and time, the series of a sensor is then one contiguous block
+        if not cube:
+            time = Load_Data.time_column(df)
+            order = np.lexsort((time.values, df["sensor_id"].values))
+            sorted_ids = df["sensor_id"].values[order]
+            sorted_time = time.values[order]
+
+    def series(sensor_id, measurement):
+        if cube:
+            return Time_Cube.sensor_series(df, sensor_id, measurement)
+        lo = np.searchsorted(sorted_ids, sensor_id, side = "left")                                                          # binary search for the block of the sensor
+        hi = np.searchsorted(sorted_ids, sensor_id, side = "right")
+        return sorted_time[lo:hi], df[measurement].values[order[lo:hi]]
+
     '''Plot maximum and minimum average polututed time series per measurement and maximum/minumum'''
-    # Initialize two subplots for PM10 (min and max)
+    # Initialize two subplots per measurement (min and max)
     _ax = 0
     if ax is None:
         fig, ax = plt.subplots(nrows = 2, ncols= 2, sharey = False, figsize = (16, 16))
-        #plt.subplots_adjust(wspace=, hspace=1)
         _ax = 1
-    
-    # define each subplot
-    ax[0,0].plot(pd.to_datetime(df_max_PM10['time']).dt.strftime("%Y/%m/%d %H:%M"), df_max_PM10.measurement_PM10, label='average max.', c = 'red')        # get time on x-axis, the measurement on y-axis
-        # moreover, the 'time' column is formatted to pd's datetime first and to a time string of "%Y/%m/%d %H:%M" format second to have better x-axis lables
-    ax[0,0].set_xlabel('Time')                                                                                                # set labels and titles
-    ax[0,0].set_ylabel('μg/m³')
-    ax[0,0].set_title('PM10 (max average sensor)')
-    ax[0,0].grid(True)                                                                                                        # activate background grid
-    ax[0,0].legend(loc='upper left')                                                                                          # add legend
-    ax[0,0].xaxis.set_major_locator(plt.MaxNLocator(10))                                                                      # reducing maximum number of x-axis ticks to 10 for better readableness
-    
-    ax[0,1].plot(pd.to_datetime(df_min_PM10['time']).dt.strftime("%Y/%m/%d %H:%M"), df_min_PM10.measurement_PM10, label='average min.', c = 'darkblue')
-    ax[0,1].set_xlabel('Time')
-    ax[0,1].set_ylabel('μg/m³')
-    ax[0,1].set_title('PM10 (min average sensor)')
-    ax[0,1].grid(True)
-    ax[0,1].legend(loc='upper left')
-    ax[0,1].xaxis.set_major_locator(plt.MaxNLocator(10))
-    
-    #fig1.autofmt_xdate(rotation = 45)
-    
-    # Initialize two subplots for PM2.5 (min and max)
-    #fig1, ax1 = plt.subplots(1, 2, sharey = False, figsize = (10, 6))
-    
+
+    panels = [(ax[0,0], "measurement_PM10", "max", 'PM10 (max average sensor)'),
+              (ax[0,1], "measurement_PM10", "min", 'PM10 (min average sensor)'),
+              (ax[1,0], "measurement_PM2.5", "max", 'PM2.5 (max average sensor)'),
+              (ax[1,1], "measurement_PM2.5", "min", 'PM2.5 (min average sensor)')]
+
     # define each subplot
-    ax[1,0].plot(pd.to_datetime(df_max_PM25['time']).dt.strftime("%Y/%m/%d %H:%M"), df_max_PM25['measurement_PM2.5'], label='average max.', c = 'red')
-    ax[1,0].set_xlabel('Time')
-    ax[1,0].set_ylabel('μg/m³')
-    ax[1,0].set_title('PM2.5 (max average sensor)')
-    ax[1,0].grid(True)
-    ax[1,0].legend(loc='upper left')
-    ax[1,0].xaxis.set_major_locator(plt.MaxNLocator(10))
-    
-    ax[1,1].plot(pd.to_datetime(df_min_PM25['time']).dt.strftime("%Y/%m/%d %H:%M"), df_min_PM25['measurement_PM2.5'], label='average min.', c = 'darkblue')
-    ax[1,1].set_xlabel('Time')
-    ax[1,1].set_ylabel('μg/m³')
-    ax[1,1].set_title('PM2.5 (min average sensor)')
-    ax[1,1].grid(True)
-    ax[1,1].legend(loc='upper left')
-    ax[1,1].xaxis.set_major_locator(plt.MaxNLocator(10))
-    
+    for axis, measurement, extreme, title in panels:
+        colors = plt.cm.Reds(np.linspace(0.9, 0.4, k)) if extreme == "max" else plt.cm.Blues(np.linspace(0.9, 0.4, k))
+        for sensor_id, color in zip(ids[(measurement, extreme)], colors):
+            x, y = series(sensor_id, measurement)
+            label = 'average ' + extreme + '.' if k == 1 else 'sensor ' + str(sensor_id)
+            Render.plot_series(axis, x, y, label = label, c = color)                                                           # get time on x-axis, the measurement on y-axis, downsampled to the width of the axes
+        axis.set_xlabel('Time')                                                                                                # set labels and titles
+        axis.set_ylabel('μg/m³')
+        axis.set_title(title)
+        axis.grid(True)                                                                                                        # activate background grid
+        axis.legend(loc='upper left')                                                                                          # add legend
+        Render.date_axis(axis, maxticks = 10)                                                                                  # reducing maximum number of x-axis ticks to 10 for better readableness
+
     if _ax == 1:
         fig.autofmt_xdate(rotation = 45)
     else:
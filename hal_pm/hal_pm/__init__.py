@@ -1 +1 @@
-__all__ = ["Filter_Data", "Load_Data", "Descriptive_Stats", "Plot_Mean","Time_Plots", "Corr_Fct","Map"]
\ No newline at end of file
+__all__ = ["Filter_Data", "Load_Data", "Descriptive_Stats", "Plot_Mean","Time_Plots", "Corr_Fct","Map", "Replay_Server", "Query_Cache", "Boundaries", "Stream_Stats", "Time_Cube", "Batch", "Render", "Live", "Synthetic_Data", "Benchmark", "Instrumentation", "Measurement_Store", "Sensor_Registry"]
\ No newline at end of file
@@ -1,76 +1,67 @@
-from argparse import ArgumentParser, Namespace
-import datetime
-from hal_pm import *
-import matplotlib.pyplot as plt
-#from load_data import load_data
-#from filter_data import remove_missing, remove_outliers
-import pandas as pd
-import os
+from argparse import ArgumentParser
+from hal_pm import Instrumentation
+from hal_pm import Batch
+from hal_pm import Live
 
 def main(args):
-    start_date = datetime.datetime.fromisoformat(args.start_date)
-    
-    #2. load data
-    pmdata = Load_Data.load_data(args.lat_start, args.lat_end, args.long_start, args.long_end, start_date, args.delta_hours)
-    
-    #3. filter data
-    print("\n")
-    print("Results after filtering:")
-    pmdata = Filter_Data.remove_missing(pmdata)
-    pmdata = Filter_Data.remove_outliers(pmdata, method = args.filter) 
-    
-
-    #4. descriptive stats
-    print("\n")
-    print("The following are the maximum values for the two particle measurements:")
-    pmmax, maxmap = Descriptive_Stats.get_max(pmdata, get_map = True)
-    print(pmmax)
-
-    fig, axes = plt.subplots(1, figsize=(20, 20))
-    Plot_Mean.plot_mean_pm(pmdata, ax = axes)
-    plt.savefig('plot_mean.png')
-
-
-    #5 Time Plots
-    fig, axes = plt.subplots(2, 2, figsize=(20, 20))
-    Time_Plots.plot_average_pol(pmdata, ax = axes)
-    plt.savefig('maxplots.png')
-
-
-    #6 Correlation
-    fig, axes = plt.subplots(1, figsize=(20, 20))
-    corr = Corr_Fct.corr_matrix(pmdata, plot = True)
-    print("\n")
-    print("The correlation between the PM2.5 and the PM10 series is " + str(corr[0,1]))
-    plt.savefig('corrmatrix.png')
+    Instrumentation.configure(level = args.log_level, json_logs = args.json_logs, metrics_path = args.metrics, memory = args.memory,
+                              profile = args.profile)
 
+    #1. batch mode: many regions and time windows from a job spec file
+    if args.batch is not None:
+        Batch.run_batch(args.batch, out_dir = args.out_dir, max_workers = args.workers, prefetch = args.prefetch, cache = not args.no_cache)
+        return
 
-    #7 Second dataframe
-    if args.scd_start_date is not None:
-        scd_start_date = datetime.datetime.fromisoformat(args.scd_start_date)
-        pmdata2 = Load_Data.load_data(args.lat_start, args.lat_end, args.long_start, args.long_end, scd_start_date, args.delta_hours)
-        fig, axes = plt.subplots(1, figsize=(20, 20))
-        print("\n")
-        print("Results for the second time interval")
-        Plot_Mean.plot_mean_pm(pmdata, df2 = pmdata2, ax = axes)
-        fig.autofmt_xdate(rotation = 45)
-        plt.savefig('plot_mean_2nddf')
+    #2. live mode: keep the trailing window of delta_hours up to date and render what changed every --live seconds
+    if args.live is not None:
+        region = Live.new_region(args.lat_start, args.lat_end, args.long_start, args.long_end, args.delta_hours,
+                                 method = args.filter or "Z-score", geo_boundaries = 'geoboundaries/plz_ger.geojson', cache = not args.no_cache)
+        Live.watch([region], out_dir = args.out_dir, every_seconds = args.live)
+        return
 
-    #8 Map
-    PM25_map = Map.map_data(pmdata, 'geoboundaries/plz_ger.geojson', measurement_type = "measurement_PM2.5")
-    PM10_map = Map.map_data(pmdata, 'geoboundaries/plz_ger.geojson', measurement_type = "measurement_PM10")
+    #3. single job: load data, filter, stats, plots and maps (see Batch.report)
+    job = {'lat_start': args.lat_start, 'lat_end': args.lat_end, 'long_start': args.long_start, 'long_end': args.long_end,
+           'start_date': args.start_date, 'delta_hours': args.delta_hours, 'filter': args.filter, 'scd_start_date': args.scd_start_date,
+           'geo_boundaries': 'geoboundaries/plz_ger.geojson', 'compact': args.compact_maps}
+    Batch.run_job(job, out_dir = args.out_dir, cache = not args.no_cache)
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     
-    parser.add_argument('lat_start', action="store", type=float)
-    parser.add_argument('lat_end', action="store", type=float)
-    parser.add_argument('long_start', action="store", type=float)
-    parser.add_argument('long_end', action="store", type=float)
-    parser.add_argument('start_date', action = "store", type=str)
-    parser.add_argument('delta_hours', action="store", type=int)
-    parser.add_argument('filter', action="store", type=str)
-    parser.add_argument('scd_start_date', action="store", type=str)
+    # the positional arguments are only optional with --batch (not used) or --live (start_date and scd_start_date are not used)
+    parser.add_argument('lat_start', action="store", type=float, nargs='?')
+    parser.add_argument('lat_end', action="store", type=float, nargs='?')
+    parser.add_argument('long_start', action="store", type=float, nargs='?')
+    parser.add_argument('long_end', action="store", type=float, nargs='?')
+    parser.add_argument('start_date', action = "store", type=str, nargs='?')
+    parser.add_argument('delta_hours', action="store", type=int, nargs='?')
+    parser.add_argument('filter', action="store", type=str, nargs='?')
+    parser.add_argument('scd_start_date', action="store", type=str, nargs='?')
+    parser.add_argument('--no_cache', action="store_true", help="do not read or write the on-disk query and boundary caches")
+    parser.add_argument('--compact_maps', action="store_true",
+                        help="write lightweight maps (see Map.map_data compact), batch jobs set compact in the job spec")
+    parser.add_argument('--out_dir', action="store", type=str, default=None,
+                        help="output directory (default: the current directory, or reports/ in batch mode)")
+    parser.add_argument('--batch', action="store", type=str, default=None,
+                        help="JSON job spec with a list of regions and time windows, see Batch.read_jobs")
+    parser.add_argument('--live', action="store", type=int, default=None,
+                        help="live mode: refresh the trailing window of delta_hours every LIVE seconds (start_date is ignored)")
+    parser.add_argument('--workers', action="store", type=int, default=4, help="batch mode: number of worker processes")
+    parser.add_argument('--prefetch', action="store", type=int, default=2, help="batch mode: number of jobs fetched ahead")
+    parser.add_argument('--log_level', action="store", type=str, default="INFO", help="DEBUG also logs the time and rows of every stage")
+    parser.add_argument('--json_logs', action="store_true", help="write the log messages as JSON lines")
+    parser.add_argument('--metrics', action="store", type=str, default=None, help="JSON lines file the metrics of every stage are appended to")
+    parser.add_argument('--memory', action="store_true", help="record the peak memory of every stage (tracemalloc, slower)")
+    parser.add_argument('--profile', action="store", type=str, nargs='+', default=None,
+                        help="stages that are run under cProfile, e.g. map_data load_data, the profiles are written to profiles/")
 
     args = parser.parse_args()
+    if args.batch is None:
+        needed = ['lat_start', 'lat_end', 'long_start', 'long_end', 'delta_hours'] if args.live is not None else \
+                 ['lat_start', 'lat_end', 'long_start', 'long_end', 'start_date', 'delta_hours', 'filter', 'scd_start_date']
+        missing = [name for name in needed if getattr(args, name) is None]
+        if missing:
+            parser.error("the following arguments are required: " + ", ".join(missing))
+    if args.out_dir is None:
+        args.out_dir = "reports" if args.batch is not None else "."
     main(args)
@@ -0,0 +1,30 @@
+'''Benchmark.measure leaves a memory trace of the caller running.
+
+Run from the hal_pm directory:  python -m pytest tests'''
+
+import tracemalloc
+import numpy as np
+from hal_pm import Benchmark
+
+
+def allocate():
+    np.ones(2 ** 20)                                                                       # 8 MB
+
+
+def test_measure_starts_and_stops_its_own_trace():
+    assert not tracemalloc.is_tracing()
+    result = Benchmark.measure(allocate, repeat = 1)
+    assert not tracemalloc.is_tracing()
+    assert 7.5 < result["peak_mb"] < 9
+
+
+def test_measure_keeps_the_trace_of_the_caller():
+    tracemalloc.start()
+    try:
+        held = np.ones(2 ** 21)                                                            # 16 MB allocated before, not part of the peak
+        result = Benchmark.measure(allocate, repeat = 1)
+        assert tracemalloc.is_tracing()
+        assert 7.5 < result["peak_mb"] < 9
+        del held
+    finally:
+        tracemalloc.stop()
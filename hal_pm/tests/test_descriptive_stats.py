@@ -0,0 +1,25 @@
+'''get_max and top_k select the same rows as idxmax and a full sort, also for tied values.
+
+Run from the hal_pm directory:  python -m pytest tests'''
+
+import numpy as np
+import pandas as pd
+from hal_pm import Descriptive_Stats
+from hal_pm import Synthetic_Data
+
+
+def test_get_max_picks_the_first_of_tied_maxima():
+    df = Synthetic_Data.sensor_frame(n_sensors = 20, hours = 2)
+    for m in ["measurement_PM10", "measurement_PM2.5"]:
+        df.loc[df.index[[7, 300, 301, 900]], m] = df[m].max() + 1                             # four rows share the maximum
+    maxima = Descriptive_Stats.get_max(df, get_map = False)
+    expected = df.loc[df[["measurement_PM10", "measurement_PM2.5"]].idxmax()].drop(columns = "sensor_id")
+    pd.testing.assert_frame_equal(maxima.drop(columns = "label"), expected)
+
+
+def test_top_k_with_ties_keeps_the_row_order():
+    df = pd.DataFrame({"measurement_PM10": np.array([1, 5, 3, 5, 5, np.nan, 4, 5], dtype = np.float32)})
+    for k in range(1, 8):
+        selected = Descriptive_Stats.top_k(df, k = k)
+        expected = df["measurement_PM10"].dropna().sort_values(ascending = False, kind = "stable").index[:k]
+        assert selected.index.tolist() == expected.tolist()
@@ -0,0 +1,85 @@
+'''The per sensor outlier methods and the chunked filter of Filter_Data on small frames with planted spikes.
+
+Run from the hal_pm directory:  python -m pytest tests'''
+
+import numpy as np
+import pandas as pd
+import pytest
+from hal_pm import Filter_Data
+from hal_pm import Synthetic_Data
+
+SPIKE = 30.0
+SPIKE_AT = 100
+
+
+@pytest.fixture
+def sensors():
+    '''a quiet sensor (1) and a noisy sensor (2), both with the value SPIKE at the same time'''
+    rng = np.random.default_rng(0)
+    time = pd.date_range("2021-06-01", periods = 200, freq = "5Min")
+    frames = []
+    for sensor_id, sd in [(1, 0.5), (2, 10.0)]:
+        values = 10 + sd * rng.standard_normal((len(time), 2))
+        values[SPIKE_AT] = SPIKE
+        frames.append(pd.DataFrame({"measurement_PM10": values[:, 0], "measurement_PM2.5": values[:, 1], "time": time,
+                                    "lat": 52.5, "lon": 8.5, "sensor_id": sensor_id}))
+    return pd.concat(frames, ignore_index = True).sample(frac = 1, random_state = 0)        # the methods must not rely on the row order
+
+
+def spikes(df):
+    return df[(df["time"] == df["time"].min() + pd.Timedelta(minutes = 5 * SPIKE_AT))]
+
+
+@pytest.mark.parametrize("method", ["sensor_robust_Z", "sensor_rolling_Z"])
+def test_spike_is_removed_at_the_quiet_sensor_only(sensors, method):
+    kept = Filter_Data.remove_outliers(sensors, method = method)
+    assert spikes(kept)["sensor_id"].tolist() == [2]
+    assert (kept["sensor_id"] == 1).sum() >= 190
+
+
+def test_rolling_bounds_against_brute_force(sensors):
+    window = pd.Timedelta("1h")
+    lower, upper = Filter_Data._sensor_rolling_bounds(sensors["sensor_id"].values, sensors["time"].values,
+                                                      sensors[Filter_Data.MEASUREMENTS].values, 2.58, window)
+    for i in range(0, len(sensors), 37):
+        row = sensors.iloc[i]
+        others = sensors[(sensors["sensor_id"] == row["sensor_id"]) & ((sensors["time"] - row["time"]).abs() <= window / 2)]
+        others = others.drop(index = sensors.index[i])
+        mean, sd = others[Filter_Data.MEASUREMENTS].mean().values, others[Filter_Data.MEASUREMENTS].std().values
+        np.testing.assert_allclose(lower[i], mean - 2.58 * sd)
+        np.testing.assert_allclose(upper[i], mean + 2.58 * sd)
+
+
+def test_rolling_bounds_with_many_sensors_over_a_long_span():
+    '''5000 sensors over 60 days: (sensor, time in ns) would overflow int64, the bounds of a sensor must not depend on the others'''
+    rng = np.random.default_rng(1)
+    n_sensors, per_sensor = 5000, 6
+    sensor_id = np.repeat(np.arange(n_sensors), per_sensor)
+    offsets = np.tile([0, 600, 1200, 1800, 2400, 60 * 86400], n_sensors)                   # five readings in 40 minutes, one 60 days later
+    time = (np.datetime64("2021-01-01") + (offsets + rng.integers(0, 60, len(offsets))).astype("timedelta64[s]")).astype("datetime64[ns]")
+    values = rng.normal(10, 2, (len(sensor_id), 2))
+    lower, upper = Filter_Data._sensor_rolling_bounds(sensor_id, time, values, 2.58, pd.Timedelta("1h"))
+    for s in [0, 1, 2500, n_sensors - 1]:
+        rows = sensor_id == s
+        alone = Filter_Data._sensor_rolling_bounds(sensor_id[rows], time[rows], values[rows], 2.58, pd.Timedelta("1h"))
+        np.testing.assert_allclose(lower[rows], alone[0])
+        np.testing.assert_allclose(upper[rows], alone[1])
+    assert np.isnan(lower[offsets == 60 * 86400]).all()                                   # alone in its window, never an outlier
+
+
+def test_stream_matches_remove_outliers():
+    df = Synthetic_Data.sensor_frame(n_sensors = 50, hours = 6)
+    chunks = [df.iloc[i:i + 1000] for i in range(0, len(df), 1000)]
+    for method in ["Z-score", "critical_value"]:
+        expected = Filter_Data.remove_outliers(Filter_Data.remove_missing(df), method = method)
+        streamed = pd.concat(list(Filter_Data.remove_outliers_stream(chunks, method = method)))
+        pd.testing.assert_frame_equal(streamed, expected)
+
+
+def test_stream_window_baseline():
+    df = Synthetic_Data.sensor_frame(n_sensors = 50, hours = 6)
+    chunks = [df.iloc[i:i + 1000] for i in range(0, len(df), 1000)]
+    streamed = list(Filter_Data.remove_outliers_stream(iter(chunks), baseline = "window", window = 2))
+    assert len(streamed) == len(chunks)
+    first = Filter_Data.remove_outliers(Filter_Data.remove_missing(chunks[0]))             # the first chunk is its own baseline
+    pd.testing.assert_frame_equal(streamed[0], first)
@@ -0,0 +1,73 @@
+'''Live.refresh against a Replay_Server that serves the measurements of a synthetic frame up to server.now.
+
+Run from the hal_pm directory:  python -m pytest tests'''
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from hal_pm import Live
+from hal_pm import Replay_Server
+from hal_pm import Synthetic_Data
+from hal_pm import Time_Cube
+
+BBOX = (52, 53, 8, 10)
+START = datetime(2021, 6, 1)
+HOURS = 12
+WINDOW = 3
+KEEP_ALL = {"method": "critical_value", "crit_val": [-1e9, 1e9]}          # only rows with missing values are removed
+
+
+@pytest.fixture(scope = "module")
+def frame():
+    return Synthetic_Data.sensor_frame(n_sensors = 40, hours = HOURS, start = START, bbox = BBOX)
+
+
+@pytest.fixture
+def server(frame):
+    server, base_url = Replay_Server.serve_frame(frame)
+    yield server, base_url
+    server.shutdown()
+
+
+def window(frame, now):
+    '''the complete rows of frame within the window that ends at now (borders included)'''
+    rows = frame[(frame["time"] >= now - pd.Timedelta(hours = WINDOW)) & (frame["time"] <= now)]
+    return rows[rows[Live.MEASUREMENTS].notna().all(axis = 1)]
+
+
+def refresh(state, server, now):
+    server.now = now
+    return Live.refresh(state, now = now)
+
+
+def test_refresh_fetches_only_new_rows(server, frame):
+    state = Live.new_region(*BBOX, WINDOW, base_url = server[1], **KEEP_ALL)
+    now = pd.Timestamp(START) + pd.Timedelta(hours = WINDOW)
+    first = refresh(state, server[0], now)
+    assert first["fetched"] == len(window(frame, now)) + first["missing"]
+    assert first["cube"]
+
+    later = now + pd.Timedelta(minutes = 30)
+    delta = frame[(frame["time"] > now) & (frame["time"] <= later)]
+    changes = refresh(state, server[0], later)
+    assert changes["fetched"] == len(delta)
+    assert changes["kept"] == len(delta.dropna(subset = Live.MEASUREMENTS))
+    assert changes["expired"] > 0
+    assert refresh(state, server[0], later)["fetched"] == 0
+
+
+def test_refresh_matches_a_full_rebuild(server, frame):
+    state = Live.new_region(*BBOX, WINDOW, base_url = server[1], **KEEP_ALL)
+    now = pd.Timestamp(START) + pd.Timedelta(hours = WINDOW)
+    for _ in range(8):
+        refresh(state, server[0], now)
+        now = now + pd.Timedelta(minutes = 45)
+    now = state["last"]
+
+    expected = window(frame, now)
+    pd.testing.assert_frame_equal(Time_Cube.mean_series(state["cube"]), Time_Cube.mean_series(Time_Cube.build_cube(expected)),
+                                  check_freq = False)
+    for m, label in [("measurement_PM10", "max PM10"), ("measurement_PM2.5", "max PM2.5")]:
+        maximum = state["maxima"][state["maxima"]["label"] == label][m].max()
+        assert np.isclose(maximum, expected[m].max())
@@ -0,0 +1,158 @@
+'''load_data against a local stand-in of sensordata.gwdg.de (Replay_Server.serve_frame) that answers from a synthetic frame.
+
+Run from the hal_pm directory:  python -m pytest tests'''
+
+import json
+import os
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+from hal_pm import Load_Data
+from hal_pm import Query_Cache
+from hal_pm import Replay_Server
+from hal_pm import Synthetic_Data
+
+BBOX = (52, 53, 8, 10)                  # whole 1 degree tiles, so that every slice of a 6 hour grid can be cached
+START = datetime(2021, 6, 1)
+HOURS = 12
+
+
+@pytest.fixture(scope = "module")
+def frame():
+    return Synthetic_Data.sensor_frame(n_sensors = 40, hours = HOURS, start = START, bbox = BBOX)
+
+
+@pytest.fixture
+def server(frame):
+    server, base_url = Replay_Server.serve_frame(frame)
+    yield server, base_url
+    server.shutdown()
+
+
+def load(base_url, bbox = BBOX, **kwargs):
+    kwargs.setdefault("cache", False)
+    return Load_Data.load_data(*bbox, START, HOURS, base_url = base_url, **kwargs)
+
+
+def assert_same_rows(df, frame):
+    '''same rows and the dtypes of Load_Data.SCHEMA, the row order of load_data is not part of its contract'''
+    assert len(df) == len(frame)
+    assert df.dtypes.to_dict() == {column: pd.api.types.pandas_dtype(t) for column, t in Load_Data.SCHEMA.items()}
+    key = ["sensor_id", "time"]
+    pd.testing.assert_frame_equal(df.sort_values(key, ignore_index = True)[frame.columns], frame.sort_values(key, ignore_index = True))
+
+
+def test_load_without_cache(server, frame):
+    assert_same_rows(load(server[1]), frame)
+
+
+def test_stream(server, frame):
+    assert_same_rows(load(server[1], stream = True), frame)
+
+
+def test_chunksize(server, frame):
+    chunks = list(load(server[1], chunksize = 1000))
+    assert len(chunks) > 1
+    assert max(len(chunk) for chunk in chunks) <= 1000
+    assert_same_rows(pd.concat(chunks, ignore_index = True), frame)
+
+
+def test_cache_answers_without_server(frame, tmp_path):
+    server, base_url = Replay_Server.serve_frame(frame)
+    first = load(base_url, cache = True, cache_dir = str(tmp_path))
+    server.shutdown()
+    server.server_close()
+    assert len(os.listdir(tmp_path)) > 0
+    second = load(base_url, cache = True, cache_dir = str(tmp_path), retries = 0)     # every slice is final and on the grid, nothing is requested
+    assert_same_rows(first, frame)
+    assert_same_rows(second, frame)
+
+
+def test_cache_is_keyed_by_server(server, frame, tmp_path):
+    load(server[1], cache = True, cache_dir = str(tmp_path))
+    key = Query_Cache.slice_key("P1", (START, START + pd.Timedelta(hours = 6)), ([52.0, 53.0], [8.0, 9.0]), server[1])
+    assert Query_Cache.read(key, str(tmp_path)) is not None
+    assert Query_Cache.read(Query_Cache.slice_key("P1", (START, START + pd.Timedelta(hours = 6)), ([52.0, 53.0], [8.0, 9.0])), str(tmp_path)) is None
+
+
+def test_empty_result(server, tmp_path):
+    for stream in [False, True]:
+        df = load(server[1], bbox = (10, 11, 10, 11), stream = stream, cache = True, cache_dir = str(tmp_path))
+        assert len(df) == 0
+        assert list(df.columns) == list(Load_Data.SCHEMA)
+    assert os.listdir(tmp_path) == []                                                   # empty answers of a stand-in server are not cached
+
+
+def failing_first(server, failures, status = 503):
+    '''makes the server answer the first failures requests with a server error'''
+    handler = server.RequestHandlerClass
+    answer = handler.do_POST
+    left = {"n": failures}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        with lock:
+            fail = left["n"] > 0
+            left["n"] -= fail
+        if not fail:
+            return answer(self)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    handler.do_POST = do_POST
+
+
+def test_retry_on_server_error(server, frame):
+    failing_first(server[0], 2)
+    assert_same_rows(load(server[1], retries = 2, backoff = 0.01, max_workers = 1), frame)
+
+
+def test_server_error_without_retries(server):
+    failing_first(server[0], 1)
+    with pytest.raises(requests.HTTPError):
+        load(server[1], retries = 0, max_workers = 1)
+
+
+def test_sensor_on_the_border_of_the_bbox(frame):
+    on_border = frame.assign(lat = frame["lat"].astype("float64"))
+    on_border.loc[on_border["sensor_id"] == on_border["sensor_id"].iloc[0], "lat"] = 52.1     # not exactly representable as float32
+    server, base_url = Replay_Server.serve_frame(on_border)
+    try:
+        df = load(base_url, bbox = (np.float64(52.1), 53, 8, 10))                               # e.g. taken out of a data frame
+    finally:
+        server.shutdown()
+    assert (df["sensor_id"] == on_border["sensor_id"].iloc[0]).sum() == (on_border["sensor_id"] == on_border["sensor_id"].iloc[0]).sum()
+    assert len(df) == (on_border["lat"] >= 52.1).sum()
+
+
+def test_stream_and_complete_responses_give_the_same_frame(server):
+    pd.testing.assert_frame_equal(load(server[1], stream = True), load(server[1]))
+
+
+def answering(server, rows):
+    '''makes the server answer every query with the given rows (sensor_id, time, lat, lon, value)'''
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        column = self.path.strip("/").split("/")[-1]
+        body = json.dumps([["sensor_id", "time", "lat", "lon", column], "sensor", rows]).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    server.RequestHandlerClass.do_POST = do_POST
+
+
+def test_malformed_sensor_ids(server):
+    time = "2021-06-01T01:00:00"
+    answering(server[0], [[1, time, 52.5, 8.5, 10.0], ["2", time, 52.5, 8.6, 11.0], ["x", time, 52.5, 8.7, 12.0],
+                          [None, time, 52.5, 8.8, 13.0], [3.5, time, 52.5, 8.9, 14.0]])
+    complete = load(server[1], bbox = (52, 53, 8, 9), max_workers = 1)
+    streamed = load(server[1], bbox = (52, 53, 8, 9), max_workers = 1, stream = True)
+    assert complete["sensor_id"].tolist() == [1, 2]                                       # numeric strings are kept, the rest is left out
+    pd.testing.assert_frame_equal(streamed, complete)
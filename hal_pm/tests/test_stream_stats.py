@@ -0,0 +1,47 @@
+'''Merging the running moments (Welford) and the t-digests of chunks gives the statistics of all data.
+
+Run from the hal_pm directory:  python -m pytest tests'''
+
+import numpy as np
+from hal_pm import Stream_Stats
+
+
+def chunks_of(values, sizes):
+    return np.split(values, np.cumsum(sizes)[:-1])
+
+
+def test_merged_moments_equal_the_moments_of_all_values():
+    rng = np.random.default_rng(0)
+    values = rng.normal(1e4, 3, (1000, 2))                                                 # a large mean, the merge must not lose the small variance
+    values[rng.random(values.shape) < 0.05] = np.nan
+    merged = None
+    for chunk in chunks_of(values, [1, 10, 300, 689]):
+        merged = Stream_Stats.merge_moments(merged, Stream_Stats.moments(chunk))
+    np.testing.assert_array_equal(merged["n"], (~np.isnan(values)).sum(axis = 0))
+    np.testing.assert_allclose(merged["mean"], np.nanmean(values, axis = 0), rtol = 1e-12)
+    np.testing.assert_allclose(Stream_Stats.std(merged), np.nanstd(values, axis = 0, ddof = 1), rtol = 1e-9)
+
+
+def test_merge_moments_with_empty_chunks():
+    m = Stream_Stats.moments(np.array([[1.0], [2.0], [3.0]]))
+    empty = Stream_Stats.moments(np.empty((0, 1)))
+    for merged in [Stream_Stats.merge_moments(m, empty), Stream_Stats.merge_moments(empty, m), Stream_Stats.merge_moments(None, m)]:
+        np.testing.assert_allclose(merged["mean"], [2.0])
+        np.testing.assert_allclose(Stream_Stats.std(merged), [1.0])
+
+
+def test_merged_digest_quantiles():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(2, 1, 50000)
+    digests = [Stream_Stats.digest(chunk) for chunk in chunks_of(values, [5000] * 10)]
+    merged = Stream_Stats.merge_digests(digests)
+    assert merged["weight"].sum() == len(values)
+    assert Stream_Stats.digest_quantile(merged, 0) == values.min()
+    assert Stream_Stats.digest_quantile(merged, 1) == values.max()
+    for q in [0.01, 0.25, 0.5, 0.75, 0.99]:
+        rank = (values <= Stream_Stats.digest_quantile(merged, q)).mean()
+        assert abs(rank - q) < 0.005
+
+
+def test_merge_digests_without_values():
+    assert np.isnan(Stream_Stats.digest_quantile(Stream_Stats.merge_digests([None, Stream_Stats.digest([np.nan])]), 0.5))
@@ -0,0 +1,301 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import time
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+logger = logging.getLogger(__name__)        # progress (INFO) and image bands without values (WARNING) of map_images and analyse_images
+logger.addHandler(logging.NullHandler())    # silent unless the application configures logging, e.g. logging.basicConfig(level = logging.INFO)
+
+BAND_NAMES = {"LS": ['Red', 'Green', 'Blue', 'NIR', 'SWIR1', 'SWIR2', 'Temp'],
+              "RS": ['NIGHTLIGHTS', 'NDVI_mean', 'NDVI_median', 'NDVI_cropland_mean', 'NDVI_cropland_median', 'WSF', 'NDWI_gao_mean',
+                     'NDWI_gao_median', 'NDWI_McF_mean', 'NDWI_McF_median', 'LC_modis', 'LC_esa']}
+NO_CROPLAND = -888          # pixel value of the RS images for 'no cropland'
+WATER = -999                # pixel value of the RS images for 'water'
+WSF_BAND = 5                # band of the RS images with the year of the settlement (World Settlement Footprint)
+STATS = ['min', 'max', 'mean', 'median', 'sum', 'sum_of_squares', 'std', 'n_negative', 'n_over_1', 'n_not_na', 'n_na', 'n',
+         'n_valid', 'n_water', 'n_no_cropland']
+COLUMN = {name: i for i, name in enumerate(STATS)}
+SKETCH_SIZE = 101           # quantiles per band kept as sketch of its distribution (0 %, 1 %, ..., 100 %)
+
+
+def load_img(file_path, start_year = None, img_width = 255, img_height = 255):
+    '''Loads the centre crop of a GeoTIFF as (height, width, band) array, the channels of a Landsat image (LS in the file name)
+    are reordered to RGB and the WSF band of an RS image (RS in the file name) is fixed for start_year'''
+    file_name = os.path.basename(file_path)
+    is_rs = 'RS' in file_name
+    if is_rs and start_year is None:
+        raise ValueError("the start_year of the survey is needed to fix the WSF band of an RS image")
+    img = import_tif_file(file_path, img_width, img_height)
+    if 'LS' in file_name:
+        img = reorder_rgb(img)
+    if is_rs:
+        img = fix_wsf(img, start_year)
+    return img
+
+
+def import_tif_file(geotiff_file_path, img_width = 255, img_height = 255):
+    '''reads the centre crop of img_width x img_height pixels of every band (None: the whole image) as (height, width, band) array'''
+    return read_center(geotiff_file_path, img_width, img_height).transpose(1, 2, 0)
+
+
+def read_center(file_path, img_width = 255, img_height = 255):
+    '''reads only the pixels of the centre crop (windowed read) as (band, height, width) array, the layout of rasterio'''
+    with rasterio.open(file_path) as src:
+        if img_width is None or img_height is None:
+            return src.read()
+        return src.read(window = center_window(src.height, src.width, img_width, img_height))
+
+
+def center_window(act_h, act_w, img_width = 255, img_height = 255):
+    '''the window of center_crop_img, clipped to the image if it is smaller than the crop'''
+    h_start = max(int((act_h - img_height) / 2), 0)
+    w_start = max(int((act_w - img_width) / 2), 0)
+    return Window(w_start, h_start, min(img_width, act_w - w_start), min(img_height, act_h - h_start))
+
+
+def center_crop_img(img, img_width = 255, img_height = 255):
+    '''centers and crops a (height, width, band) array to img_height x img_width pixels'''
+    window = center_window(img.shape[0], img.shape[1], img_width, img_height)
+    return img[window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width, :]
+
+
+def reorder_rgb(img):
+    '''
+    The order of the channels in GEE is Blue, Green, Red
+    Reorder the imgage to RGB.
+    '''
+    return img[:, :, _band_order(img.shape[2], "LS")]
+
+
+def fix_wsf(img, start_year):
+    '''sets the WSF band to 1 where the area was settled before start_year + 1, else to 0 (in place)'''
+    _fix_wsf_band(img[:, :, WSF_BAND], start_year)
+    return img
+
+
+def compute_stats(img, data_type = "LS", median = True):
+    '''statistics of every band of a (height, width, band) array as {band: {statistic: value}}'''
+    values = band_stats(img.transpose(2, 0, 1), data_type, median)
+    names = stat_names(data_type)
+    return {i: dict(zip(names, values[i, [COLUMN[name] for name in names]])) for i in range(values.shape[0])}
+
+
+def get_basic_stats_ls(band):
+    '''statistics of one band of a Landsat image, NA pixels are left out'''
+    return compute_stats(band[:, :, np.newaxis], "LS")[0]
+
+
+def get_basic_stats_rs(band):
+    '''statistics of one band of an RS image, NA, water and no cropland pixels are left out of the value statistics'''
+    return compute_stats(band[:, :, np.newaxis], "RS")[0]
+
+
+def stat_names(data_type = "LS"):
+    '''names of the statistics of a data type (the ones of get_basic_stats_ls and get_basic_stats_rs)'''
+    names = [name for name in STATS if name != 'n_valid']
+    return names if data_type == "RS" else names[:-2]
+
+
+def band_stats(stack, data_type = "LS", median = True):
+    '''statistics of all bands of an image as float64 array (band, statistic) with the columns of STATS, see band_summary'''
+    return band_summary(stack, data_type, sketch_size = 1 if median else 0)[0]
+
+
+def band_summary(stack, data_type = "LS", sketch_size = SKETCH_SIZE):
+    '''Computes the statistics and the quantile sketch of all bands of an image at once'''
+
+    '''INPUT:'''
+
+    '''stack:           (band, height, width) or (band, pixels) array'''
+    '''data_type:       LS or RS. In RS images the water (-999) and no cropland (-888) pixels are left out of the value statistics'''
+    '''sketch_size:     number of equally spaced quantiles (0 % to 100 %) that are kept per band, 0: none and no median'''
+    '''                 (the median and the sketch are the only results that need a sort)'''
+
+    '''OUTPUT:'''
+
+    '''stats:           float64 array (band, statistic) with the statistics of STATS, n_valid is the number of pixels the'''
+    '''                 value statistics are computed on'''
+    '''sketch:          float32 array (band, sketch_size) of the quantiles of the valid pixels, see Stats_Store.quantile'''
+
+    x = stack.reshape(stack.shape[0], -1)
+    is_na = np.isnan(x)
+    values = np.where(x > NO_CROPLAND, x, np.nan) if data_type == "RS" else x     # NaN > -888 is False, so NA pixels stay NA
+    valid = ~np.isnan(values) if data_type == "RS" else ~is_na
+    filled = np.where(valid, values, 0).astype(np.float64, copy = False)
+
+    c = COLUMN
+    out = np.empty((x.shape[0], len(STATS)))
+    out[:, c['n_na']] = is_na.sum(axis = 1)
+    out[:, c['n']] = x.shape[1]
+    out[:, c['n_not_na']] = out[:, c['n']] - out[:, c['n_na']]
+    out[:, c['n_valid']] = n_valid = valid.sum(axis = 1)
+    with np.errstate(invalid = "ignore", divide = "ignore"):                            # bands without any valid pixel get NaN
+        out[:, c['min']] = np.fmin.reduce(values, axis = 1)                             # fmin and fmax skip NaN
+        out[:, c['max']] = np.fmax.reduce(values, axis = 1)
+        out[:, c['sum']] = filled.sum(axis = 1)
+        out[:, c['sum_of_squares']] = np.einsum("ij,ij->i", filled, filled)
+        out[:, c['mean']] = out[:, c['sum']] / n_valid
+        out[:, c['std']] = np.sqrt(np.maximum(out[:, c['sum_of_squares']] / n_valid - out[:, c['mean']]**2, 0))
+    out[:, c['n_negative']] = (values < 0).sum(axis = 1)
+    out[:, c['n_over_1']] = (values > 1).sum(axis = 1)
+    if data_type == "RS":
+        out[:, c['n_water']] = (x == WATER).sum(axis = 1)
+        out[:, c['n_no_cropland']] = (x == NO_CROPLAND).sum(axis = 1)
+    else:
+        out[:, [c['n_water'], c['n_no_cropland']]] = np.nan
+
+    # one sort per band gives the median and the sketch, NaN are sorted to the end
+    out[:, c['median']] = np.nan
+    sketch = np.empty((x.shape[0], 0), dtype = np.float32)
+    if sketch_size > 0:
+        ordered = np.sort(values, axis = 1)
+        out[:, c['median']] = _sorted_quantiles(ordered, n_valid, np.array([0.5]))[:, 0]
+        if sketch_size > 1:
+            sketch = _sorted_quantiles(ordered, n_valid, np.linspace(0, 1, sketch_size)).astype(np.float32)
+    return out, sketch
+
+
+def image_stats(file_path, data_type = "LS", start_year = None, img_width = 255, img_height = 255, sketch_size = SKETCH_SIZE):
+    '''reads the centre crop of one image (windowed read), prepares it as load_img does and returns band_summary of it'''
+    stack = prepare(read_center(file_path, img_width, img_height), data_type, start_year)
+    return band_summary(stack, data_type, sketch_size)
+
+
+def prepare(stack, data_type = "LS", start_year = None):
+    '''reorder_rgb (LS) or fix_wsf (RS, if start_year is given) of a (band, height, width) array out of read_center'''
+    if data_type == "LS":
+        return stack[_band_order(stack.shape[0], "LS")]
+    if start_year is not None:
+        stack = stack.astype(np.result_type(stack.dtype, np.float32), copy = False)                # NaN are set to 0
+        _fix_wsf_band(stack[WSF_BAND], start_year)
+    return stack
+
+
+def analyse_images(lsms_df, data_type = "LS", img_width = 255, img_height = 255, sketch_size = SKETCH_SIZE, max_workers = None,
+                   chunksize = 8, progress_seconds = 10):
+    '''Computes the statistics of every band of many images in parallel processes'''
+
+    '''INPUT:'''
+
+    '''lsms_df:         data frame with the columns unique_id and file_path (and start_year for RS images), one row per image'''
+    '''data_type:       LS or RS'''
+    '''img_width, img_height:  size of the centre crop that is read, None: the whole image'''
+    '''sketch_size:     number of quantiles per image and band that are kept (see band_summary), 0 saves the sort per band'''
+    '''                 but leaves out the medians'''
+    '''max_workers:     number of processes, default: the number of CPUs, 1 runs in this process'''
+    '''chunksize:       number of images a process gets at a time'''
+    '''progress_seconds:  seconds between two progress messages (images done, images per second, time left), see logger'''
+
+    '''OUTPUT:'''
+
+    '''store:           {"data_type", "ids": unique_id per image, "stats": (image, band, statistic) array with the columns of'''
+    '''                 STATS, "sketch": (image, band, quantile) array}, see Stats_Store to aggregate, save and reload it'''
+    '''failed:          {unique_id: error message} of the images that could not be read, they are not in the store'''
+
+    # Defensive programming
+    if not data_type in BAND_NAMES:
+        raise ValueError("data_type must be one of " + ", ".join(BAND_NAMES))
+    for column in ["unique_id", "file_path"] + (["start_year"] if data_type == "RS" else []):
+        if not column in lsms_df.columns:
+            raise NameError("lsms_df has no column " + column)
+
+    start_years = lsms_df["start_year"] if data_type == "RS" else [None] * len(lsms_df)
+    tasks = [(file_path, data_type, start_year, img_width, img_height, sketch_size)
+             for file_path, start_year in zip(lsms_df["file_path"], start_years)]
+
+    ids, results, sketches, failed = [], [], [], {}
+    for unique_id, summary, error in map_images(image_stats, tasks, lsms_df["unique_id"], max_workers, chunksize, progress_seconds):
+        if error is not None:
+            failed[unique_id] = error
+            continue
+        stats, sketch = summary
+        ids.append(unique_id)
+        results.append(stats)
+        sketches.append(sketch)
+        _report_na_bands(unique_id, stats, data_type)
+    return new_store(data_type, ids, results, sketches, sketch_size), failed
+
+
+def new_store(data_type, ids, results, sketches, sketch_size = SKETCH_SIZE):
+    '''the statistics store out of the band_summary results of several images'''
+    n_bands = len(results[0]) if len(results) > 0 else len(BAND_NAMES[data_type])
+    empty = (0, n_bands, sketch_size if sketch_size > 1 else 0)
+    return {"data_type": data_type, "ids": np.array(ids, dtype = str),
+            "stats": np.stack(results) if len(results) > 0 else np.empty(empty[:2] + (len(STATS),)),
+            "sketch": np.stack(sketches) if len(sketches) > 0 else np.empty(empty, dtype = np.float32)}
+
+
+def map_images(function, tasks, ids, max_workers = None, chunksize = 8, progress_seconds = 10):
+    '''Runs function(*task) for every task in parallel processes and yields (unique_id, result, error) in the order of the tasks.
+    An image that cannot be read does not stop the others (error is its message, result None). Logs the progress (images
+    done, images per second, time left) every progress_seconds seconds. function must be defined at module level'''
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    calls = [(function, task) for task in tasks]
+    started = last = time.perf_counter()
+    n_failed = 0
+    pool = ProcessPoolExecutor(max_workers = max_workers) if max_workers > 1 else None
+    try:
+        outcomes = pool.map(_guarded_call, calls, chunksize = chunksize) if pool is not None else map(_guarded_call, calls)
+        for i, (unique_id, (result, error)) in enumerate(zip(ids, outcomes)):
+            n_failed += error is not None
+            yield unique_id, result, error
+            now = time.perf_counter()
+            if now - last >= progress_seconds or i + 1 == len(calls):
+                last = now
+                _report_progress(i + 1, len(calls), now - started, n_failed)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures = True)
+
+
+def _guarded_call(call):
+    '''runs in the worker processes'''
+    function, task = call
+    try:
+        return function(*task), None
+    except Exception as error:
+        return None, type(error).__name__ + ": " + str(error)
+
+
+def _band_order(n_channels, data_type):
+    '''band indices of the image in RGB order, the first three channels of GEE Landsat images are Blue, Green, Red'''
+    if data_type != "LS" or n_channels < 3:
+        return np.arange(n_channels)
+    return np.r_[[2, 1, 0], np.arange(3, n_channels)]
+
+
+def _fix_wsf_band(band, start_year):
+    band[np.isnan(band)] = 0
+    is_pop = (band < (start_year + 1)) & (band > 1)
+    not_yet_pop = band > start_year
+    band[is_pop] = 1
+    band[not_yet_pop] = 0
+
+
+def _sorted_quantiles(ordered, n_valid, quantiles):
+    '''quantiles (linear interpolation as np.quantile) of the rows of an array sorted with NaN at the end, n_valid values per row'''
+    last = np.maximum(n_valid - 1, 0)[:, np.newaxis]
+    position = quantiles[np.newaxis, :] * last
+    lower = np.floor(position).astype(np.int64)
+    low = np.take_along_axis(ordered, lower, axis = 1).astype(np.float64)
+    high = np.take_along_axis(ordered, np.minimum(lower + 1, last), axis = 1).astype(np.float64)
+    result = low + (position - lower) * (high - low)
+    result[n_valid == 0] = np.nan
+    return result
+
+
+def _report_na_bands(unique_id, stats, data_type):
+    only_na = np.where(stats[:, COLUMN['n_na']] == stats[:, COLUMN['n']])[0]
+    for band in only_na:
+        name = BAND_NAMES[data_type][band] if band < len(BAND_NAMES[data_type]) else str(band)
+        logger.warning("%s: only NAs in image band %d: %s", unique_id, band, name)
+
+
+def _report_progress(done, total, seconds, n_failed):
+    rate = done / seconds if seconds > 0 else float("inf")
+    left = (total - done) / rate if rate > 0 else float("nan")
+    logger.info("%d/%d images, %.1f images/s, %.0f s left%s", done, total, rate, left, ", %d failed" % n_failed if n_failed else "")
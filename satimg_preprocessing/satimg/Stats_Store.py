@@ -0,0 +1,198 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from satimg import Img_Stats
+
+STATS = Img_Stats.STATS
+COLUMN = Img_Stats.COLUMN
+FILES = ["ids.npy", "stats.npy", "sketch.npy"]
+
+
+def write_store(store, directory, parquet = False):
+    '''Writes a statistics store (out of Img_Stats.analyse_images) to a directory'''
+
+    '''INPUT:'''
+
+    '''store:           {"data_type", "ids", "stats", "sketch"}'''
+    '''directory:       the arrays are written as .npy files (ids.npy, stats.npy, sketch.npy) and the names of the statistics and'''
+    '''                 bands to meta.json, read_store maps them into memory instead of unpickling them'''
+    '''parquet:         if True, the table of to_frame is also written to stats.parquet (needs pyarrow)'''
+
+    os.makedirs(directory, exist_ok = True)
+    arrays = {"ids.npy": np.asarray(store["ids"], dtype = str), "stats.npy": np.asarray(store["stats"], dtype = np.float64),
+              "sketch.npy": np.asarray(store["sketch"], dtype = np.float32)}
+    for name, array in arrays.items():
+        tmp_path = os.path.join(directory, name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, array, allow_pickle = False)
+        os.replace(tmp_path, os.path.join(directory, name))                                 # atomic, so readers never see half written files
+    meta = {"data_type": store["data_type"], "stats": STATS, "bands": _band_names(store), "images": len(arrays["ids.npy"])}
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f, indent = 1)
+    if parquet:
+        to_frame(store).to_parquet(os.path.join(directory, "stats.parquet"), index = False)
+    return directory
+
+
+def read_store(directory, mmap = True):
+    '''reads a store written by write_store, with mmap the arrays are memory-mapped (read only) and only the parts that are used are read'''
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["stats"] != STATS:
+        raise ValueError(directory + " was written with the statistics " + ", ".join(meta["stats"]) + ", analyse the images again")
+    mode = "r" if mmap else None
+    store = {"data_type": meta["data_type"]}
+    for name in FILES:
+        store[name[:-4]] = np.load(os.path.join(directory, name), mmap_mode = mode, allow_pickle = False)
+    return store
+
+
+def merge(stores):
+    '''Merges stores of the same data type (e.g. of several countries or of a rerun of failed images), an image that is in
+    several stores is taken from the last one'''
+    if len(stores) == 0:
+        raise ValueError("no stores to merge")
+    for store in stores[1:]:
+        if store["data_type"] != stores[0]["data_type"] or store["stats"].shape[1:] != stores[0]["stats"].shape[1:]:
+            raise ValueError("only stores of the same data type and bands can be merged")
+        if store["sketch"].shape[1:] != stores[0]["sketch"].shape[1:]:
+            raise ValueError("only stores with the same sketch size can be merged")
+    ids = np.concatenate([np.asarray(store["ids"]) for store in stores])
+    keep = len(ids) - 1 - np.unique(ids[::-1], return_index = True)[1]                     # last occurrence of every id
+    keep = np.sort(keep)
+    return {"data_type": stores[0]["data_type"], "ids": ids[keep],
+            "stats": np.concatenate([store["stats"] for store in stores])[keep],
+            "sketch": np.concatenate([store["sketch"] for store in stores])[keep]}
+
+
+def select(store, flagged_ids = None, ids = None):
+    '''boolean mask of the images of a store: in ids (default: all) and not in flagged_ids'''
+    mask = np.ones(len(store["ids"]), dtype = bool)
+    if ids is not None:
+        mask &= np.isin(store["ids"], np.asarray(ids, dtype = str))
+    if flagged_ids is not None and len(flagged_ids) > 0:
+        mask &= ~np.isin(store["ids"], np.asarray(flagged_ids, dtype = str))
+    return mask
+
+
+def aggregate(store, flagged_ids = None, quantiles = None):
+    '''Computes the statistics of every band over all images of a store'''
+
+    '''INPUT:'''
+
+    '''store:           statistics store, see Img_Stats.analyse_images and read_store'''
+    '''flagged_ids:     unique_ids of images that are left out, default: None (all images)'''
+    '''quantiles:       further quantiles of the pixels of a band that are computed from the sketches, e.g. [0.01, 0.99]'''
+
+    '''OUTPUT:'''
+
+    '''{band: {statistic: value}} with min, max, sum, sum_of_squares, N (pixels), N_not_na, N_valid (pixels the values are'''
+    '''computed on), mean and std of all valid pixels (merged moments) and the median of all valid pixels (approximated'''
+    '''from the quantile sketches of the images, not the median of the medians of the images), and q<quantile> for quantiles'''
+
+    mask = select(store, flagged_ids)
+    stats = np.asarray(store["stats"][mask])
+    sketch = np.asarray(store["sketch"][mask])
+    c = COLUMN
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        n_valid = stats[:, :, c['n_valid']].sum(axis = 0)
+        total = stats[:, :, c['sum']].sum(axis = 0)
+        squares = stats[:, :, c['sum_of_squares']].sum(axis = 0)
+        mean = total / n_valid
+        summary = {"min": np.fmin.reduce(stats[:, :, c['min']], axis = 0, initial = np.inf),
+                   "max": np.fmax.reduce(stats[:, :, c['max']], axis = 0, initial = -np.inf),
+                   "mean": mean, "sum": total, "sum_of_squares": squares,
+                   "N": stats[:, :, c['n']].sum(axis = 0), "N_not_na": stats[:, :, c['n_not_na']].sum(axis = 0), "N_valid": n_valid,
+                   "std": calc_std(total, squares, n_valid)}
+    summary["min"][n_valid == 0] = np.nan
+    summary["max"][n_valid == 0] = np.nan
+    levels = [0.5] + list(quantiles or [])
+    values = np.array([[quantile(sketch[:, band], stats[:, band, c['n_valid']], q) for q in levels]
+                       for band in range(stats.shape[1])]).reshape(stats.shape[1], len(levels))
+    summary["median"] = values[:, 0]
+    for i, q in enumerate(levels[1:]):
+        summary["q" + str(q)] = values[:, i + 1]
+    return {band: {name: value[band] for name, value in summary.items()} for band in range(stats.shape[1])}
+
+
+def quantile(sketch, n_valid, q = 0.5):
+    '''Approximates a quantile of all pixels of several images out of their quantile sketches'''
+
+    '''INPUT:'''
+
+    '''sketch:          (image, k) array of k equally spaced quantiles of every image (a band of the store sketch)'''
+    '''n_valid:         number of valid pixels of every image'''
+    '''q:               quantile between 0 and 1'''
+
+    '''OUTPUT:'''
+
+    '''the quantile, the pixels of an image are taken as evenly spread between two of its quantiles. The error is at most'''
+    '''the distance between two neighbouring quantiles of the images, NaN if there is no sketch or no valid pixel'''
+
+    if not 0 <= q <= 1:
+        raise ValueError("q must be between 0 and 1")
+    sketch = np.asarray(sketch, dtype = np.float64)
+    if sketch.ndim != 2 or sketch.shape[1] < 2:
+        return np.nan
+    n_valid = np.asarray(n_valid, dtype = np.float64)
+    used = (n_valid > 0) & ~np.isnan(sketch).any(axis = 1)
+    if not used.any():
+        return np.nan
+    sketch, n_valid = sketch[used], n_valid[used]
+    if q == 0 or q == 1:
+        return sketch[:, 0].min() if q == 0 else sketch[:, -1].max()
+
+    # every pair of neighbouring quantiles holds the same share of the pixels of an image, it is represented by its midpoint
+    midpoints = ((sketch[:, 1:] + sketch[:, :-1]) / 2).ravel()
+    weights = np.repeat(n_valid / (sketch.shape[1] - 1), sketch.shape[1] - 1)
+    order = np.argsort(midpoints, kind = "stable")
+    midpoints, cumulative = midpoints[order], np.cumsum(weights[order])
+    centers = cumulative - weights[order] / 2                                               # rank of the midpoints
+    return float(np.interp(q * cumulative[-1], centers, midpoints))
+
+
+def calc_std(sm, ss, n):
+    '''standard deviation out of the sum, the sum of squares and the number of values'''
+    vr = ss/n - (sm/n)**2
+    return np.sqrt(np.maximum(vr, 0))
+
+
+def flag_images(store, max_na = 500, skip_bands = ()):
+    '''unique_ids of the images with more than max_na NA pixels in any band except skip_bands (e.g. SWIR2 of the Landsat images)'''
+    bands = [band for band in range(store["stats"].shape[1]) if not band in skip_bands]
+    n_na = np.asarray(store["stats"][:, bands, COLUMN['n_na']])
+    return np.asarray(store["ids"])[(n_na > max_na).any(axis = 1)]
+
+
+def band_frames(store, flagged_ids = None):
+    '''{band: data frame with one row per image (statistics and unique_id)}, the layout the notebook built with json_normalize'''
+    mask = select(store, flagged_ids)
+    names = Img_Stats.stat_names(store["data_type"])
+    stats = np.asarray(store["stats"][mask])
+    ids = np.asarray(store["ids"][mask])
+    frames = {}
+    for band in range(stats.shape[1]):
+        frame = pd.DataFrame(stats[:, band, [COLUMN[name] for name in names]], columns = names)
+        counts = [name for name in names if name.startswith("n")]
+        frame[counts] = frame[counts].astype(np.int64)
+        frame['unique_id'] = ids
+        frames[band] = frame
+    return frames
+
+
+def to_frame(store):
+    '''the store as one table with a row per image and band: unique_id, band, band_name and the columns of STATS'''
+    stats = np.asarray(store["stats"])
+    n_images, n_bands = stats.shape[:2]
+    frame = pd.DataFrame(stats.reshape(n_images * n_bands, len(STATS)), columns = STATS)
+    frame.insert(0, "unique_id", np.repeat(np.asarray(store["ids"]), n_bands))
+    frame.insert(1, "band", np.tile(np.arange(n_bands), n_images))
+    frame.insert(2, "band_name", np.tile(np.array(_band_names(store), dtype = object), n_images))
+    return frame
+
+
+def _band_names(store):
+    names = Img_Stats.BAND_NAMES.get(store["data_type"], [])
+    n_bands = np.shape(store["stats"])[1]
+    return [names[band] if band < len(names) else str(band) for band in range(n_bands)]
@@ -0,0 +1,195 @@
+import json
+import os
+import numpy as np
+from satimg import Img_Stats
+
+CHUNK_SIZE = 256            # images per chunk file
+DTYPES = ["float32", "float16"]
+
+
+def build_cache(lsms_df, directory, data_type = "LS", dtype = "float32", img_width = 255, img_height = 255, chunk_size = CHUNK_SIZE,
+                overwrite = False, max_workers = None, chunksize = 8, progress_seconds = 10):
+    '''Decodes, crops and prepares the images once and writes them to a memory-mapped tile cache'''
+
+    '''INPUT:'''
+
+    '''lsms_df:         data frame with the columns unique_id and file_path (and start_year for RS images), one row per image'''
+    '''directory:       directory of the cache, an existing cache is extended: only images that are not in it yet are read'''
+    '''data_type:       LS (the channels are reordered to RGB) or RS (the WSF band is fixed for start_year)'''
+    '''dtype:           float32 or float16 (half the size, about three significant digits, -888 and -999 stay exact)'''
+    '''img_width, img_height:  size of the centre crop, images that are smaller are padded with NaN'''
+    '''chunk_size:      images per chunk file (cache_dir/chunk_<number>.npy)'''
+    '''overwrite:       if True, images that are already in the cache are read and written again'''
+    '''max_workers, chunksize, progress_seconds:  see Img_Stats.map_images'''
+
+    '''OUTPUT:'''
+
+    '''cache:           the cache opened with open_cache'''
+    '''failed:          {unique_id: error message} of the images that could not be read'''
+
+    # Defensive programming
+    if not data_type in Img_Stats.BAND_NAMES:
+        raise ValueError("data_type must be one of " + ", ".join(Img_Stats.BAND_NAMES))
+    if not dtype in DTYPES:
+        raise ValueError("dtype must be one of " + ", ".join(DTYPES))
+    if not isinstance(img_width, int) or not isinstance(img_height, int):
+        raise TypeError("img_width and img_height must be integers, all images of the cache have the same size")
+    for column in ["unique_id", "file_path"] + (["start_year"] if data_type == "RS" else []):
+        if not column in lsms_df.columns:
+            raise NameError("lsms_df has no column " + column)
+
+    meta = {"data_type": data_type, "dtype": dtype, "height": img_height, "width": img_width, "bands": None,
+            "chunk_size": chunk_size, "count": 0}
+    if os.path.exists(os.path.join(directory, "meta.json")):
+        cache = open_cache(directory, mode = "r+")
+        for key in ["data_type", "dtype", "height", "width"]:
+            if cache["meta"][key] != meta[key]:
+                raise ValueError(directory + " holds images with " + key + " " + str(cache["meta"][key]) + ", not " + str(meta[key]))
+    else:
+        os.makedirs(directory, exist_ok = True)
+        cache = _new_cache(directory, meta, [])
+    todo = lsms_df if overwrite else lsms_df[~lsms_df["unique_id"].astype(str).isin(cache["ids"])]
+
+    start_years = todo["start_year"] if data_type == "RS" else [None] * len(todo)
+    tasks = [(file_path, data_type, start_year, img_width, img_height) for file_path, start_year in zip(todo["file_path"], start_years)]
+    failed = {}
+    try:
+        for unique_id, img, error in Img_Stats.map_images(load_tile, tasks, todo["unique_id"], max_workers, chunksize, progress_seconds):
+            if error is not None:
+                failed[unique_id] = error
+            else:
+                count = cache["meta"]["count"]
+                put(cache, unique_id, img)
+                if cache["meta"]["count"] > count and cache["meta"]["count"] % cache["meta"]["chunk_size"] == 0:
+                    flush(cache)                                                            # the index is written after every full chunk, replaced images do not add to it
+    finally:
+        flush(cache)                                                                        # an interrupted run keeps the images written so far
+    return cache, failed
+
+
+def load_tile(file_path, data_type = "LS", start_year = None, img_width = 255, img_height = 255):
+    '''the centre crop of an image as (height, width, band) array, prepared as load_img does'''
+    stack = Img_Stats.prepare(Img_Stats.read_center(file_path, img_width, img_height), data_type, start_year)
+    return stack.transpose(1, 2, 0)
+
+
+def open_cache(directory, mode = "r"):
+    '''Opens a tile cache'''
+
+    '''INPUT:'''
+
+    '''directory:       directory written by build_cache'''
+    '''mode:            r (read only) or r+ (put and flush can change and add images)'''
+
+    '''OUTPUT:'''
+
+    '''{"directory", "meta", "ids", "positions"}: meta has the data type, dtype, size and count of the images, ids the'''
+    '''unique_ids (as strings, get and get_many also accept the original type) in the order the images are stored. The chunk files are memory-mapped when they are first used'''
+
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+    ids = np.load(os.path.join(directory, "ids.npy"), allow_pickle = False)[:meta["count"]]
+    cache = _new_cache(directory, meta, ids.tolist())
+    cache["mode"] = mode
+    return cache
+
+
+def get(cache, unique_id):
+    '''one image as (height, width, band) array, a view into the memory-mapped chunk (no copy, read on first access)'''
+    chunk, row = divmod(cache["positions"][str(unique_id)], cache["meta"]["chunk_size"])
+    return _chunk(cache, chunk)[row]
+
+
+def get_many(cache, unique_ids):
+    '''several images as (image, height, width, band) array (a copy), KeyError if one is not in the cache'''
+    positions = np.array([cache["positions"].get(str(unique_id), -1) for unique_id in unique_ids], dtype = np.int64)
+    if (positions < 0).any():
+        raise KeyError("not in the cache: " + ", ".join(str(u) for u in np.asarray(unique_ids)[positions < 0][:5]))
+    meta = cache["meta"]
+    out = np.empty((len(positions), meta["height"], meta["width"], meta["bands"]), dtype = meta["dtype"])
+    for chunk in np.unique(positions // meta["chunk_size"]):                                 # one memory map per chunk file
+        rows = np.where(positions // meta["chunk_size"] == chunk)[0]
+        out[rows] = _chunk(cache, chunk)[positions[rows] % meta["chunk_size"]]
+    return out
+
+
+def iter_chunks(cache):
+    '''yields (unique_ids, images) per chunk file, images is a (image, height, width, band) view of the memory-mapped chunk'''
+    size = cache["meta"]["chunk_size"]
+    for chunk in range(_n_chunks(cache["meta"])):
+        n = min(size, cache["meta"]["count"] - chunk * size)
+        yield cache["ids"][chunk * size:chunk * size + n], _chunk(cache, chunk)[:n]
+
+
+def put(cache, unique_id, img):
+    '''writes one (height, width, band) image to the cache, it replaces the image of the same unique_id. Call flush to make it
+    visible to open_cache'''
+    meta = cache["meta"]
+    if cache.get("mode") == "r":
+        raise ValueError("the cache is opened read only, open it with mode = 'r+'")
+    if meta["bands"] is None:
+        meta["bands"] = img.shape[2]
+    if img.shape[2] != meta["bands"]:
+        raise ValueError("the cache holds images with " + str(meta["bands"]) + " bands, not " + str(img.shape[2]))
+    unique_id = str(unique_id)                                                              # ids are stored as strings, as in Stats_Store
+    position = cache["positions"].get(unique_id)
+    if position is None:
+        position = cache["positions"][unique_id] = meta["count"]
+        cache["ids"].append(unique_id)
+        meta["count"] += 1
+    chunk, row = divmod(position, meta["chunk_size"])
+    tile = _chunk(cache, chunk)[row]
+    if img.shape[:2] != tile.shape[:2]:
+        tile[...] = np.nan                                                                  # smaller images are padded with NaN
+    tile[:img.shape[0], :img.shape[1]] = img
+
+
+def flush(cache):
+    '''writes the changed chunks to disk and then the index (ids.npy and meta.json), images that are in the index are always complete'''
+    for chunk in cache["chunks"].values():
+        if isinstance(chunk, np.memmap) and chunk.mode != "r":
+            chunk.flush()
+    for name, write in [("ids.npy", lambda f: np.save(f, np.asarray(cache["ids"], dtype = str), allow_pickle = False)),
+                        ("meta.json", lambda f: f.write(json.dumps(cache["meta"], indent = 1).encode()))]:
+        tmp_path = os.path.join(cache["directory"], name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, os.path.join(cache["directory"], name))                       # atomic, so readers never see half written files
+
+
+def analyse_cache(cache, sketch_size = Img_Stats.SKETCH_SIZE):
+    '''the statistics store of Img_Stats.analyse_images computed from the cached images (no TIFF is decoded)'''
+    ids, results, sketches = [], [], []
+    for chunk_ids, images in iter_chunks(cache):
+        for unique_id, img in zip(chunk_ids, images):
+            stats, sketch = Img_Stats.band_summary(img.transpose(2, 0, 1), cache["meta"]["data_type"], sketch_size)
+            ids.append(unique_id)
+            results.append(stats)
+            sketches.append(sketch)
+    return Img_Stats.new_store(cache["meta"]["data_type"], ids, results, sketches, sketch_size)
+
+
+def _new_cache(directory, meta, ids):
+    return {"directory": directory, "meta": meta, "ids": ids, "positions": {unique_id: i for i, unique_id in enumerate(ids)},
+            "chunks": {}, "mode": "r+"}
+
+
+def _n_chunks(meta):
+    return -(-meta["count"] // meta["chunk_size"])
+
+
+def _chunk(cache, chunk):
+    '''memory map of a chunk file, created when the first image of it is put'''
+    if chunk in cache["chunks"]:
+        return cache["chunks"][chunk]
+    meta = cache["meta"]
+    path = os.path.join(cache["directory"], "chunk_" + str(chunk).zfill(5) + ".npy")
+    if os.path.exists(path):
+        array = np.load(path, mmap_mode = cache.get("mode", "r"), allow_pickle = False)
+    elif cache.get("mode") == "r":
+        raise KeyError(path + " does not exist")
+    else:
+        array = np.lib.format.open_memmap(path, mode = "w+", dtype = meta["dtype"],
+                                          shape = (meta["chunk_size"], meta["height"], meta["width"], meta["bands"]))
+    cache["chunks"][chunk] = array
+    return array
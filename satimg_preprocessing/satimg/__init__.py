@@ -0,0 +1 @@
+__all__ = ["Img_Stats", "Stats_Store", "Tile_Cache"]